@@ -0,0 +1,421 @@
+"""Backend benchmarks. Each suite writes JSON tagged with the git commit, so runs can be compared.
+
+    python benchmark_backend.py stages --image face.jpg --sides 480 1024 2048 4000
+    python benchmark_backend.py catalog --rows 1000 10000 100000 1000000
+    python benchmark_backend.py load --image face.jpg --concurrency 1 4 16 64 --catalog-rows 100000
+    python benchmark_backend.py similar --rows 10000 100000 1000000
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from face_features import extract_features, features_from_coords
+from face_shape_recommendations import FACE_SHAPE_RECOMMENDATIONS
+from runtime_probe import runtime_config
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+WARMUP_CALLS = 3
+SERVER_START_TIMEOUT = 180
+
+
+def summarize(samples_ms):
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    if not len(samples):
+        return {"n": 0}
+    return {
+        "n": len(samples),
+        "mean_ms": round(float(samples.mean()), 3),
+        "p50_ms": round(float(np.percentile(samples, 50)), 3),
+        "p95_ms": round(float(np.percentile(samples, 95)), 3),
+        "p99_ms": round(float(np.percentile(samples, 99)), 3),
+    }
+
+
+def time_call(fn, repeat):
+    """Latency summary of `repeat` calls to fn() after a short warm-up"""
+    for _ in range(min(WARMUP_CALLS, repeat)):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return summarize(samples)
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BACKEND_DIR,
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "runtime": runtime_config(),
+    }
+
+
+def write_results(suite, args, results, output):
+    document = {
+        "suite": suite,
+        "environment": environment(),
+        "args": {key: value for key, value in vars(args).items() if key != 'func'},
+        "results": results,
+    }
+    with open(output or f'benchmark_{suite}.json', 'w') as f:
+        json.dump(document, f, indent=2)
+    print(f"Wrote {output or f'benchmark_{suite}.json'}")
+
+
+def encode_at_side(image, side):
+    """JPEG bytes of `image` scaled so its longest side is `side`"""
+    import cv2
+
+    scale = side / max(image.shape[:2])
+    resized = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC)
+    return cv2.imencode('.jpg', resized, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def bench_stages(args):
+    """Per-stage cost of /detect-face at several input resolutions"""
+    import cv2
+
+    from face_detection import FaceShapeDetector
+    from main import face_shape_response
+    from preprocessing import decode_image
+
+    detector = FaceShapeDetector(args.model)
+    detector.warm_up()
+    source = cv2.imread(args.image)
+    if source is None:
+        raise SystemExit(f"Cannot read {args.image}")
+
+    results = []
+    for side in args.sides:
+        data = encode_at_side(source, side)
+        img = decode_image(data, detector.max_side)
+        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        mesh = detector.face_mesh.process(rgb)
+
+        stages = {
+            "decode_full": time_call(lambda: cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR), args.repeat),
+            "decode": time_call(lambda: decode_image(data, detector.max_side), args.repeat),
+            "color": time_call(lambda: cv2.cvtColor(img, cv2.COLOR_BGR2RGB), args.repeat),
+            "mesh": time_call(lambda: detector.face_mesh.process(rgb), args.repeat),
+        }
+        face_found = bool(mesh.multi_face_landmarks)
+        if face_found:
+            landmarks = mesh.multi_face_landmarks[0]
+            coords = detector.landmarks(data)
+            features = features_from_coords(coords[np.newaxis])
+            stages["extract_features"] = time_call(lambda: extract_features(landmarks), args.repeat)
+            stages["features"] = time_call(lambda: features_from_coords(coords[np.newaxis]), args.repeat)
+            stages["classify"] = time_call(lambda: detector.classify(features), args.repeat)
+            stages["predict_proba"] = time_call(lambda: detector.probabilities(features), args.repeat)
+            if detector.cnn is not None:
+                stages["cnn"] = time_call(lambda: detector.cnn.predict(rgb), args.repeat)
+
+        analysis = detector.analyze(data)
+        payload = face_shape_response(analysis["face_shape"], analysis["confidence"], analysis["path"])
+        stages["json"] = time_call(lambda: json.dumps(payload), args.repeat)
+        stages["analyze"] = time_call(lambda: detector.analyze(data), args.repeat)
+
+        results.append({
+            "side": side,
+            "jpeg_bytes": len(data),
+            "decoded_shape": list(img.shape),
+            "face_found": face_found,
+            "stages": stages,
+        })
+        print(f"side {side}: " + ", ".join(f"{name} {s['p50_ms']:.2f}" for name, s in stages.items()) + " (p50 ms)")
+    detector.close()
+    return results
+
+
+def bench_catalog(args):
+    """Index build and query cost of the catalog endpoints at several catalog sizes"""
+    from catalog_index import CatalogIndex
+    from synthetic_catalog import load_base_records, synthesize
+
+    base = load_base_records(args.source)
+    results = []
+    for rows in args.rows:
+        records = synthesize(base, rows, args.seed)
+        start = time.perf_counter()
+        catalog = CatalogIndex(records)
+        build_ms = (time.perf_counter() - start) * 1000
+        brand = catalog.distinct('brand')[0]
+
+        def matching_frames(limit):
+            result = catalog.query(frame_shapes=FACE_SHAPE_RECOMMENDATIONS['oval'], gender='female')
+            page, _ = catalog.page(result, limit=limit)
+            return json.dumps(catalog.get_records(page))
+
+        def frames():
+            result = catalog.query(frame_shapes=['round'], min_price=100, max_price=200, gender='male')
+            page, _ = catalog.page(result, sort='price', limit=50)
+            return json.dumps(catalog.get_records(page))
+
+        def frames_by_brand():
+            page, _ = catalog.page(catalog.query(brand=brand), sort='-price', limit=50)
+            return json.dumps(catalog.get_records(page))
+
+        def filters():
+            return json.dumps({
+                column: catalog.distinct(column) for column in ('brand', 'frame_shape', 'gender', 'age_group')
+            } | {"price_range": catalog.price_range()})
+
+        queries = {
+            "matching_frames_page": time_call(lambda: matching_frames(50), args.repeat),
+            # Unpaged responses serialize every match, so fewer repeats
+            "matching_frames_all": time_call(lambda: matching_frames(None), max(1, args.repeat // 20)),
+            "frames_filtered_sorted": time_call(frames, args.repeat),
+            "frames_by_brand": time_call(frames_by_brand, args.repeat),
+            "filters": time_call(filters, args.repeat),
+        }
+        results.append({"rows": rows, "build_ms": round(build_ms, 1), "queries": queries})
+        print(f"{rows} rows: build {build_ms:.0f} ms, " +
+              ", ".join(f"{name} {s['p50_ms']:.2f}" for name, s in queries.items()) + " (p50 ms)")
+    return results
+
+
+def bench_similar(args):
+    """/frames/{model}/similar search cost and recall at several catalog sizes, on clustered random embeddings"""
+    from build_frame_embeddings import assign_lists, normalize, train_ivf, write_index
+    from catalog_index import CatalogIndex
+    from frame_embeddings import load_frame_embeddings
+    from synthetic_catalog import load_base_records, synthesize
+
+    base = load_base_records(args.source)
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for rows in args.rows:
+        records = synthesize(base, rows, args.seed)
+        catalog = CatalogIndex(records)
+        # Frames cluster around a few hundred looks, as styles and colourways do
+        centres = normalize(rng.standard_normal((256, args.dim)))
+        vectors = normalize(centres[rng.integers(0, 256, rows)] + 0.6 * rng.standard_normal((rows, args.dim)) /
+                            np.sqrt(args.dim)).astype(np.float32)
+        start = time.perf_counter()
+        lists = int(4 * np.sqrt(rows))
+        centroids = train_ivf(vectors, lists, rng)
+        assignment = assign_lists(vectors, centroids)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        with tempfile.TemporaryDirectory() as directory:
+            keys = [[record['brand'], record['model']] for record in records]
+            write_index(directory, {"dim": args.dim, "lists": lists, "frames": rows}, keys, vectors, centroids,
+                        assignment)
+            similar = load_frame_embeddings(directory).bind(catalog)
+            queries = rng.integers(0, rows, args.repeat + WARMUP_CALLS)
+            filters = {
+                "unfiltered": None,
+                "gender": catalog.query(gender='female'),
+                "gender_age_price": catalog.query(gender='male', age_group='adult', min_price=100, max_price=150),
+            }
+            timings = {}
+            for name, filter_rows in filters.items():
+                picks = iter(queries)
+                timings[name] = time_call(lambda: similar.similar(int(next(picks)), 12, filter_rows), args.repeat)
+
+            # Recall@12 of the unfiltered IVF search against an exact scan
+            exact = similar.embeddings.vectors[:].astype(np.float32)
+            hits = 0
+            for row in queries[:100]:
+                found, _ = similar.similar(int(row), 12)
+                scores = exact @ exact[row]
+                scores[row] = -np.inf
+                truth = similar.catalog_rows[np.argpartition(-scores, 12)[:12]]
+                hits += len(set(found.tolist()) & set(truth.tolist()))
+            recall = hits / (12 * min(100, len(queries)))
+
+        results.append({"rows": rows, "dim": args.dim, "lists": lists, "build_ms": round(build_ms, 1),
+                        "recall_at_12": round(recall, 3), "queries": timings})
+        print(f"{rows} frames: IVF build {build_ms:.0f} ms, recall@12 {recall:.3f}, " +
+              ", ".join(f"{name} {s['p50_ms']:.2f}" for name, s in timings.items()) + " (p50 ms)")
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, env):
+    """Run uvicorn in a child process so the load generator doesn't share its GIL"""
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port), '--log-level', 'warning'],
+        cwd=BACKEND_DIR, env=env
+    )
+    import httpx
+
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"Server exited with code {server.returncode}")
+        try:
+            if httpx.get(f'http://127.0.0.1:{port}/ready', timeout=1).status_code == 200:
+                return server
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("Server did not become ready in time")
+
+
+async def run_level(client, send, concurrency, total):
+    """Send `total` requests from `concurrency` concurrent clients; latency summary plus throughput"""
+    import httpx
+
+    latencies = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                response = await send(client)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append((time.perf_counter() - start) * 1000)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return {"concurrency": concurrency, **summarize(latencies),
+            "rps": round(len(latencies) / elapsed, 1), "errors": errors}
+
+
+def load_scenarios(image_data):
+    scenarios = {
+        "filters": lambda client: client.get('/filters'),
+        "matching_frames": lambda client: client.get('/matching-frames/oval', params={"limit": 50}),
+        "frames": lambda client: client.get(
+            '/frames', params={"shape": "round", "min_price": 100, "max_price": 200, "sort": "price", "limit": 50}
+        ),
+    }
+    if image_data is not None:
+        scenarios["detect_face"] = lambda client: client.post(
+            '/detect-face', files={"file": ("face.jpg", image_data, "image/jpeg")}
+        )
+    return scenarios
+
+
+async def drive_load(port, scenarios, args):
+    import httpx
+
+    results = {}
+    for name, send in scenarios.items():
+        total = args.detect_requests if name == 'detect_face' else args.requests
+        results[name] = []
+        for concurrency in args.concurrency:
+            limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+            async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', limits=limits, timeout=60) as client:
+                for _ in range(WARMUP_CALLS):
+                    await send(client)
+                level = await run_level(client, send, concurrency, total)
+            results[name].append(level)
+            print(f"{name} x{concurrency}: p50 {level.get('p50_ms', 0):.1f} ms, p95 {level.get('p95_ms', 0):.1f} ms, "
+                  f"p99 {level.get('p99_ms', 0):.1f} ms, {level['rps']} req/s, {level['errors']} errors")
+    return results
+
+
+def bench_load(args):
+    """p50/p95/p99 latency and throughput of the HTTP endpoints at several concurrency levels"""
+    image_data = None
+    if args.image:
+        with open(args.image, 'rb') as f:
+            image_data = f.read()
+
+    env = dict(os.environ)
+    env['MAGDA_ML_STARTUP'] = 'eager' if image_data is not None else 'lazy'
+    if not args.cache:
+        # Every detection request should reach the workers
+        env['MAGDA_CACHE_MAX_ENTRIES'] = '0'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.catalog_rows:
+            from synthetic_catalog import load_base_records, synthesize, write_csv
+
+            catalog_path = os.path.join(tmp, 'catalog.csv')
+            write_csv(synthesize(load_base_records(args.source), args.catalog_rows, args.seed), catalog_path)
+            env['MAGDA_CATALOG_PATH'] = catalog_path
+
+        port = free_port()
+        server = start_server(port, env)
+        try:
+            results = asyncio.run(drive_load(port, load_scenarios(image_data), args))
+        finally:
+            server.terminate()
+            server.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='suite', required=True)
+
+    stages = subparsers.add_parser('stages', help="Micro-benchmark each /detect-face stage")
+    stages.add_argument('--image', required=True, help="Photo with one face")
+    stages.add_argument('--sides', type=int, nargs='+', default=[480, 1024, 2048, 4000],
+                        help="Longest image side to test, in pixels")
+    stages.add_argument('--model', default='face_shape_model.pkl')
+    stages.add_argument('--repeat', type=int, default=50)
+    stages.set_defaults(func=bench_stages)
+
+    catalog = subparsers.add_parser('catalog', help="Catalog index build and query cost by catalog size")
+    catalog.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    catalog.add_argument('--repeat', type=int, default=100)
+    catalog.set_defaults(func=bench_catalog)
+
+    load = subparsers.add_parser('load', help="HTTP load test against a local uvicorn server")
+    load.add_argument('--image', help="Also load-test /detect-face with this photo")
+    load.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    load.add_argument('--requests', type=int, default=500, help="Requests per catalog endpoint and level")
+    load.add_argument('--detect-requests', type=int, default=100, help="Requests per /detect-face level")
+    load.add_argument('--catalog-rows', type=int, help="Serve a synthetic catalog of this size")
+    load.add_argument('--cache', action='store_true', help="Keep the /detect-face result cache enabled")
+    load.set_defaults(func=bench_load)
+
+    similar = subparsers.add_parser('similar', help="Similar-frames search latency and recall by catalog size")
+    similar.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000])
+    similar.add_argument('--dim', type=int, default=128)
+    similar.add_argument('--repeat', type=int, default=200)
+    similar.set_defaults(func=bench_similar)
+
+    for subparser in (catalog, load, similar):
+        subparser.add_argument('--source', default='stock.csv')
+        subparser.add_argument('--seed', type=int, default=0)
+    for subparser in (stages, catalog, load, similar):
+        subparser.add_argument('--output', help="Defaults to benchmark_<suite>.json")
+
+    args = parser.parse_args()
+    write_results(args.suite, args, args.func(args), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Training input throughput: the old ImageDataGenerator pipeline vs tf.data.
+
+    python benchmark_input_pipeline.py --batches 50
+"""
+import argparse
+import json
+import time
+
+WARMUP_BATCHES = 2
+
+
+def images_per_second(batches, count):
+    """Time `count` batches after a short warm-up; the iterator must yield at least that many"""
+    for _ in range(WARMUP_BATCHES):
+        next(batches)
+    images = 0
+    start = time.perf_counter()
+    for _ in range(count):
+        images += len(next(batches)[0])
+    return round(images / (time.perf_counter() - start), 1)
+
+
+def epoch_images_per_second(batches):
+    """Time one full pass, so a tf.data cache() is complete by the end of it"""
+    images = 0
+    start = time.perf_counter()
+    for batch in batches:
+        images += len(batch[0])
+    return round(images / (time.perf_counter() - start), 1)
+
+
+def legacy_generators():
+    """The ImageDataGenerator setup train_face_shape_model.py used before tf.data"""
+    from PIL import ImageFile
+    from tensorflow.keras.applications.inception_resnet_v2 import preprocess_input
+    from tensorflow.keras.preprocessing.image import ImageDataGenerator
+
+    from train_face_shape_model import BATCH_SIZE, TRAINING_DIR, im_shape, seed
+
+    ImageFile.LOAD_TRUNCATED_IMAGES = True
+    train = ImageDataGenerator(
+        validation_split=0.2, rotation_range=20, width_shift_range=0.2, height_shift_range=0.2,
+        preprocessing_function=preprocess_input, shear_range=0.2, zoom_range=0.2,
+        horizontal_flip=True, fill_mode='nearest'
+    ).flow_from_directory(
+        TRAINING_DIR, target_size=im_shape, shuffle=True, seed=seed,
+        class_mode='categorical', batch_size=BATCH_SIZE, subset='training'
+    )
+    validation = ImageDataGenerator(
+        preprocessing_function=preprocess_input, validation_split=0.2
+    ).flow_from_directory(
+        TRAINING_DIR, target_size=im_shape, shuffle=False, seed=seed,
+        class_mode='categorical', batch_size=BATCH_SIZE, subset='validation'
+    )
+    return train, validation
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batches', type=int, default=50)
+    parser.add_argument('--output', default='input_benchmark.json')
+    args = parser.parse_args()
+
+    from train_face_shape_model import train_dataset, validation_dataset
+
+    legacy_train, legacy_validation = legacy_generators()
+
+    # Validation runs twice with tf.data: the second pass reads from its in-memory cache
+    results = {
+        "batches": args.batches,
+        "train": {
+            "image_data_generator": images_per_second(iter(legacy_train), args.batches),
+            "tf_data": images_per_second(iter(train_dataset.repeat()), args.batches),
+        },
+        "validation": {
+            "image_data_generator": epoch_images_per_second(
+                legacy_validation[index] for index in range(len(legacy_validation))
+            ),
+            "tf_data_first_epoch": epoch_images_per_second(validation_dataset),
+            "tf_data_cached": epoch_images_per_second(validation_dataset),
+        },
+    }
+    print(json.dumps(results, indent=2))
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import json
+import os
+import zlib
+
+import numpy as np
+
+BOTTLENECK_CACHE_DIR = os.environ.get('MAGDA_BOTTLENECK_CACHE_DIR', 'bottleneck_cache')
+
+
+def cache_key(path, seed, view):
+    """Identify one view of one image; editing the file changes its mtime and so its key"""
+    return f"{os.path.abspath(path)}|{os.stat(path).st_mtime_ns}|{seed}|{view}"
+
+
+def view_seed(path, seed, view):
+    """Deterministic per-image, per-view augmentation seed"""
+    return zlib.crc32(f"{seed}|{view}|{os.path.basename(path)}".encode()) & 0x7fffffff
+
+
+class BottleneckCache:
+    """Append-only on-disk store of backbone activations, read back through np.memmap.
+
+    `features.bin` holds one row per cached view; `index.json` maps cache keys
+    to rows and is replaced atomically after every append, so an interrupted
+    run at worst leaves unindexed bytes that the next open truncates.
+    """
+
+    def __init__(self, directory, feature_shape, dtype=np.float16):
+        self.directory = directory
+        self.feature_shape = tuple(int(d) for d in feature_shape)
+        self.dtype = np.dtype(dtype)
+        self.row_bytes = int(np.prod(self.feature_shape)) * self.dtype.itemsize
+        self.data_path = os.path.join(directory, 'features.bin')
+        self.index_path = os.path.join(directory, 'index.json')
+        os.makedirs(directory, exist_ok=True)
+
+        self.rows = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+            if tuple(index['feature_shape']) != self.feature_shape or index['dtype'] != self.dtype.str:
+                raise ValueError(f"{directory} holds {index['dtype']} features of shape "
+                                 f"{tuple(index['feature_shape'])}, expected {self.feature_shape}")
+            self.rows = index['rows']
+
+        # Drop bytes appended by a run that died before updating the index
+        if os.path.exists(self.data_path) and os.path.getsize(self.data_path) != len(self.rows) * self.row_bytes:
+            with open(self.data_path, 'r+b') as f:
+                f.truncate(len(self.rows) * self.row_bytes)
+        self._memmap = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def missing(self, keys):
+        return [key for key in keys if key not in self.rows]
+
+    def add(self, keys, features):
+        features = np.ascontiguousarray(features, dtype=self.dtype).reshape((len(keys),) + self.feature_shape)
+        with open(self.data_path, 'ab') as f:
+            f.write(features.tobytes())
+        for key in keys:
+            self.rows[key] = len(self.rows)
+        self._memmap = None
+
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({"feature_shape": self.feature_shape, "dtype": self.dtype.str, "rows": self.rows}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def features(self):
+        """Memory-mapped (rows, *feature_shape) view of everything cached so far"""
+        if self._memmap is None:
+            self._memmap = np.memmap(self.data_path, dtype=self.dtype, mode='r',
+                                     shape=(len(self.rows),) + self.feature_shape)
+        return self._memmap
+
+    def row_indices(self, keys):
+        return np.array([self.rows[key] for key in keys], dtype=np.int64)
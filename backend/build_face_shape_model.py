@@ -0,0 +1,208 @@
+"""Build face_shape_model.pkl from the FaceShape Dataset.
+
+    python build_face_shape_model.py --workers 8
+
+FaceMesh landmarks for every image are kept in a columnar .npy store, so a
+re-run only meshes images that are new or changed since the last build and
+then retrains the scaler and classifier from the store.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import pickle
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from face_features import features_from_coords
+from runtime_probe import describe, runtime_config
+
+DATASET_DIR = 'FaceShape Dataset'
+SPLITS = ('training_set', 'testing_set')
+LANDMARK_STORE_DIR = os.environ.get('MAGDA_LANDMARK_STORE_DIR', 'landmark_store')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+NUM_LANDMARKS = 468
+
+# One detector per worker process
+_worker_state = {}
+
+
+def _init_worker(max_side, face_crop):
+    from face_detection import FaceShapeDetector
+
+    # Landmarks only: there is no classifier yet while building one
+    detector = FaceShapeDetector(max_side=max_side, face_crop=face_crop, model=(None, None), cascade_threshold=0)
+    detector.warm_up()
+    _worker_state['detector'] = detector
+
+
+def _extract(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return _worker_state['detector'].landmarks(data)
+
+
+def scan_dataset(dataset_dir):
+    """Columns for every image: path relative to the dataset, mtime, size, split and lowercase label"""
+    columns = {'path': [], 'mtime_ns': [], 'size': [], 'split': [], 'label': []}
+    for split in SPLITS:
+        split_dir = os.path.join(dataset_dir, split)
+        for root, _, names in sorted(os.walk(split_dir), key=lambda walk: walk[0]):
+            if root == split_dir:
+                continue
+            label = os.path.relpath(root, split_dir).split(os.sep)[0].lower()
+            for name in sorted(names):
+                if not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                columns['path'].append(os.path.relpath(path, dataset_dir))
+                columns['mtime_ns'].append(stat.st_mtime_ns)
+                columns['size'].append(stat.st_size)
+                columns['split'].append(split)
+                columns['label'].append(label)
+    return columns
+
+
+class LandmarkStore:
+    """One .npy file per column plus (N, 468, 3) landmarks; rows without a face hold NaN"""
+
+    COLUMNS = ('path', 'mtime_ns', 'size', 'split', 'label', 'found', 'features')
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.config = {}
+        self.columns = {}
+        self.landmarks = np.empty((0, NUM_LANDMARKS, 3), dtype=np.float32)
+        if os.path.exists(os.path.join(directory, 'config.json')):
+            with open(os.path.join(directory, 'config.json')) as f:
+                self.config = json.load(f)
+            self.columns = {name: np.load(os.path.join(directory, f'{name}.npy')) for name in self.COLUMNS}
+            self.landmarks = np.load(os.path.join(directory, 'landmarks.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.landmarks)
+
+    def lookup(self):
+        """Map (path, mtime_ns, size) to the row already holding that image's landmarks"""
+        if not self.columns:
+            return {}
+        keys = zip(self.columns['path'].tolist(), self.columns['mtime_ns'].tolist(), self.columns['size'].tolist())
+        return {key: row for row, key in enumerate(keys)}
+
+    @staticmethod
+    def write(directory, config, columns, landmarks):
+        """Write a complete store next to the old one and swap it in"""
+        tmp_dir = directory.rstrip(os.sep) + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for name in LandmarkStore.COLUMNS:
+            np.save(os.path.join(tmp_dir, f'{name}.npy'), np.asarray(columns[name]))
+        np.save(os.path.join(tmp_dir, 'landmarks.npy'), landmarks)
+        with open(os.path.join(tmp_dir, 'config.json'), 'w') as f:
+            json.dump(config, f)
+
+        old_dir = directory.rstrip(os.sep) + '.old'
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.exists(directory):
+            os.replace(directory, old_dir)
+        os.replace(tmp_dir, directory)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def update_store(dataset_dir, store_dir, workers, max_side, face_crop):
+    """Mesh new or changed images and rewrite the store; returns the up-to-date store"""
+    columns = scan_dataset(dataset_dir)
+    config = {"max_side": max_side, "face_crop": face_crop}
+    store = LandmarkStore(store_dir)
+    # Landmarks from a different decode setup aren't comparable, so start over
+    cached = store.lookup() if store.config == config else {}
+
+    keys = list(zip(columns['path'], columns['mtime_ns'], columns['size']))
+    rows = [cached.get(key) for key in keys]
+    todo = [index for index, row in enumerate(rows) if row is None]
+    print(f"{len(keys)} images, {len(keys) - len(todo)} unchanged, extracting {len(todo)} with {workers} workers")
+
+    landmarks = np.full((len(keys), NUM_LANDMARKS, 3), np.nan, dtype=np.float32)
+    reused = [index for index, row in enumerate(rows) if row is not None]
+    if reused:
+        landmarks[reused] = store.landmarks[[rows[index] for index in reused]]
+
+    if todo:
+        start = time.perf_counter()
+        paths = [os.path.join(dataset_dir, columns['path'][index]) for index in todo]
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(max_side, face_crop)
+        ) as executor:
+            chunksize = max(1, len(paths) // (workers * 8))
+            for index, coords in zip(todo, executor.map(_extract, paths, chunksize=chunksize)):
+                if coords is not None:
+                    landmarks[index] = coords
+        elapsed = time.perf_counter() - start
+        print(f"Extracted {len(todo)} images in {elapsed:.1f}s ({len(todo) / elapsed:.1f} images/s)")
+
+    found = ~np.isnan(landmarks).any(axis=(1, 2))
+    columns['found'] = found
+    with np.errstate(divide='ignore', invalid='ignore'):
+        columns['features'] = features_from_coords(landmarks)
+    LandmarkStore.write(store_dir, config, columns, landmarks)
+    print(f"No face found in {int((~found).sum())} images")
+    return LandmarkStore(store_dir)
+
+
+def train(store, output_path):
+    """Fit the scaler and classifier on the training split and report test accuracy"""
+    from sklearn.metrics import classification_report
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.svm import SVC
+
+    columns = store.columns
+    usable = columns['found'] & np.isfinite(columns['features']).all(axis=1)
+    train_rows = usable & (columns['split'] == 'training_set')
+    test_rows = usable & (columns['split'] == 'testing_set')
+
+    scaler = StandardScaler().fit(columns['features'][train_rows])
+    # predict_proba lets the backend smooth streams and gate on confidence
+    clf = SVC(kernel='rbf', probability=True, class_weight='balanced', random_state=10)
+    clf.fit(scaler.transform(columns['features'][train_rows]), columns['label'][train_rows])
+    print(f"Trained on {int(train_rows.sum())} faces, classes {clf.classes_.tolist()}")
+
+    if test_rows.any():
+        predictions = clf.predict(scaler.transform(columns['features'][test_rows]))
+        print(classification_report(columns['label'][test_rows], predictions))
+
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump((clf, scaler), f)
+    os.replace(tmp_path, output_path)
+    print(f"Wrote {output_path}")
+
+
+def main():
+    from face_detection import MODEL_PATH
+    from preprocessing import FACE_CROP, MAX_IMAGE_SIDE
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', default=DATASET_DIR, help="Folder holding training_set and testing_set")
+    parser.add_argument('--store', default=LANDMARK_STORE_DIR)
+    parser.add_argument('--output', default=MODEL_PATH)
+    parser.add_argument('--workers', type=int, default=runtime_config()['cpus'])
+    parser.add_argument('--max-side', type=int, default=MAX_IMAGE_SIDE)
+    parser.add_argument('--face-crop', action='store_true', default=FACE_CROP)
+    parser.add_argument('--extract-only', action='store_true', help="Update the landmark store without training")
+    args = parser.parse_args()
+    print(f"Runtime: {describe()}")
+
+    store = update_store(args.dataset, args.store, max(1, args.workers), args.max_side, args.face_crop)
+    if not args.extract_only:
+        train(store, args.output)
+
+
+if __name__ == '__main__':
+    main()
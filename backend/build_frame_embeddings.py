@@ -0,0 +1,246 @@
+"""Embed every catalog image for /frames/{model}/similar.
+
+    python export_face_shape_model.py backbone
+    python build_frame_embeddings.py --workers 8
+
+Each distinct image link is fetched once and run through the exported CNN
+backbone. Inline images are read from the blob store. Raw backbone features
+are cached by link, so a re-run only embeds new images. The features are then
+reduced with PCA, L2-normalized and written as a float16 matrix grouped by IVF
+list, next to the k-means centroids that route queries to the lists.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from bottleneck_cache import BottleneckCache
+from catalog_store import CATALOG_STORE, open_catalog_store
+from cnn_classifier import load_interpreter_class
+from frame_embeddings import FRAME_EMBEDDER_PATH, FRAME_EMBEDDINGS_DIR
+from image_store import IMAGE_STORE_DIR, IMAGE_URL_PREFIX, ImageStore, ingest_inline_images
+from runtime_probe import configure_cv2, describe, runtime_config
+
+FEATURE_CACHE_DIR = os.environ.get('MAGDA_FRAME_FEATURE_CACHE_DIR', 'frame_feature_cache')
+FETCH_TIMEOUT = 10
+
+# One embedder per worker process
+_worker_state = {}
+
+
+class FrameEmbedder:
+    """Backbone exported by `export_face_shape_model.py backbone`: RGB in [0, 255], pooled features out"""
+
+    def __init__(self, model_path=FRAME_EMBEDDER_PATH):
+        Interpreter = load_interpreter_class()
+        self.interpreter = Interpreter(model_path=model_path, num_threads=1)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.input_size = (int(self.input['shape'][2]), int(self.input['shape'][1]))
+        self.dim = int(self.output['shape'][-1])
+
+    def embed(self, rgb_image):
+        import cv2
+
+        resized = cv2.resize(rgb_image, self.input_size, interpolation=cv2.INTER_AREA)
+        self.interpreter.set_tensor(self.input['index'], resized[np.newaxis].astype(np.float32))
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output['index'])[0].astype(np.float32)
+
+
+def fetch_image(link, image_store):
+    """Image bytes behind a catalog link, or None if it can't be read"""
+    if link.startswith(IMAGE_URL_PREFIX):
+        blob = image_store.get(link[len(IMAGE_URL_PREFIX):])
+        if blob is None:
+            return None
+        with open(blob[0], 'rb') as f:
+            return f.read()
+    if link.startswith(('http://', 'https://')):
+        request = urllib.request.Request(link, headers={'User-Agent': 'MAGDA frame embeddings'})
+        try:
+            with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT) as response:
+                return response.read()
+        except OSError:
+            return None
+    return None
+
+
+def decode_rgb(data):
+    """Decode to RGB; transparent product shots are flattened onto white rather than black"""
+    import cv2
+
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        return None
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    if image.shape[2] == 4:
+        alpha = image[:, :, 3:].astype(np.float32) / 255
+        image = (image[:, :, :3] * alpha + 255 * (1 - alpha)).astype(np.uint8)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def _init_worker(model_path, image_store_dir):
+    import cv2
+
+    # One process per CPU already
+    configure_cv2(cv2, 1)
+    _worker_state['embedder'] = FrameEmbedder(model_path)
+    _worker_state['image_store'] = ImageStore(image_store_dir)
+
+
+def _embed(link):
+    data = fetch_image(link, _worker_state['image_store'])
+    rgb_image = decode_rgb(data) if data else None
+    return None if rgb_image is None else _worker_state['embedder'].embed(rgb_image)
+
+
+def embed_links(links, model_path, cache_dir, workers):
+    """Raw backbone features for every link, embedding only those missing from the cache"""
+    with open(model_path, 'rb') as f:
+        model_digest = hashlib.sha256(f.read()).hexdigest()[:16]
+    cache = BottleneckCache(os.path.join(cache_dir, model_digest), (FrameEmbedder(model_path).dim,))
+    todo = cache.missing(links)
+    print(f"{len(links)} distinct images, {len(links) - len(todo)} cached, embedding {len(todo)} with {workers} workers")
+
+    failed = set()
+    if todo:
+        start = time.perf_counter()
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(model_path, IMAGE_STORE_DIR)
+        ) as executor:
+            chunksize = max(1, len(todo) // (workers * 8))
+            done_links, done_features = [], []
+            for link, features in zip(todo, executor.map(_embed, todo, chunksize=chunksize)):
+                if features is None:
+                    failed.add(link)
+                    continue
+                done_links.append(link)
+                done_features.append(features)
+                if len(done_links) >= 1024:
+                    cache.add(done_links, np.stack(done_features))
+                    done_links, done_features = [], []
+            if done_links:
+                cache.add(done_links, np.stack(done_features))
+        elapsed = time.perf_counter() - start
+        print(f"Embedded {len(todo) - len(failed)} images in {elapsed:.1f}s, {len(failed)} could not be read")
+
+    embedded = [link for link in links if link not in failed]
+    return embedded, np.asarray(cache.features()[cache.row_indices(embedded)], dtype=np.float32), model_digest
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def fit_pca(features, dim, rng, sample_size=50000):
+    """Mean and the top `dim` principal axes, fitted on a sample"""
+    sample = features[rng.choice(len(features), min(len(features), sample_size), replace=False)]
+    mean = sample.mean(axis=0)
+    _, _, axes = np.linalg.svd(sample - mean, full_matrices=False)
+    return mean, axes[:dim]
+
+
+def assign_lists(vectors, centroids, chunk_size=65536):
+    return np.concatenate([
+        np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+        for start in range(0, len(vectors), chunk_size)
+    ])
+
+
+def train_ivf(vectors, lists, rng, iterations=20, sample_per_list=64):
+    """Spherical k-means centroids for `lists` IVF lists, trained on a sample"""
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), lists * sample_per_list), replace=False)]
+    centroids = sample[rng.choice(len(sample), lists, replace=False)]
+    for _ in range(iterations):
+        assignment = assign_lists(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        counts = np.bincount(assignment, minlength=lists)
+        # Lists that lost every point restart from a random sample
+        empty = counts == 0
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids.astype(np.float32)
+
+
+def write_index(directory, config, keys, vectors, centroids, assignment):
+    """Write rows grouped by IVF list next to the old index, then swap it in"""
+    order = np.argsort(assignment, kind='stable')
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=len(centroids))))).astype(np.int64)
+
+    tmp_dir = directory.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, 'vectors.npy'), vectors[order].astype(np.float16))
+    np.save(os.path.join(tmp_dir, 'centroids.npy'), centroids)
+    np.save(os.path.join(tmp_dir, 'offsets.npy'), offsets)
+    with open(os.path.join(tmp_dir, 'keys.json'), 'w') as f:
+        json.dump([keys[row] for row in order], f)
+    with open(os.path.join(tmp_dir, 'index.json'), 'w') as f:
+        json.dump(config, f)
+
+    old_dir = directory.rstrip(os.sep) + '.old'
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(directory):
+        os.replace(directory, old_dir)
+    os.replace(tmp_dir, directory)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--catalog', default=os.environ.get('MAGDA_CATALOG_PATH', 'stock.csv'))
+    parser.add_argument('--store', default=CATALOG_STORE, choices=('csv', 'memory', 'mongodb'))
+    parser.add_argument('--model', default=FRAME_EMBEDDER_PATH)
+    parser.add_argument('--output', default=FRAME_EMBEDDINGS_DIR)
+    parser.add_argument('--cache-dir', default=FEATURE_CACHE_DIR)
+    parser.add_argument('--dim', type=int, default=128, help="Embedding size after PCA")
+    parser.add_argument('--lists', type=int, default=0, help="IVF lists; 0 picks 4 * sqrt(frames)")
+    parser.add_argument('--workers', type=int, default=runtime_config()['cpus'])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(f"Runtime: {describe()}")
+
+    records = open_catalog_store(args.store, args.catalog).load()
+    ingest_inline_images(records, ImageStore())
+    links = sorted({record['image_links'] for record in records if record.get('image_links')})
+    embedded, features, model_digest = embed_links(links, args.model, args.cache_dir, max(1, args.workers))
+    if not embedded:
+        raise SystemExit("No catalog image could be embedded")
+
+    rng = np.random.default_rng(args.seed)
+    dim = min(args.dim, features.shape[1], len(features))
+    mean, axes = fit_pca(features, dim, rng)
+    link_vectors = dict(zip(embedded, normalize((features - mean) @ axes.T)))
+
+    keys = [[record['brand'], record['model']] for record in records if record.get('image_links') in link_vectors]
+    vectors = np.stack([link_vectors[record['image_links']] for record in records
+                        if record.get('image_links') in link_vectors]).astype(np.float32)
+    lists = args.lists or int(4 * np.sqrt(len(vectors)))
+    lists = max(1, min(lists, len(vectors)))
+    centroids = train_ivf(vectors, lists, rng)
+    assignment = assign_lists(vectors, centroids)
+
+    config = {"model": os.path.basename(args.model), "model_sha256": model_digest, "dim": dim,
+              "lists": lists, "frames": len(keys), "skipped": len(records) - len(keys)}
+    write_index(args.output, config, keys, vectors, centroids, assignment)
+    print(f"Wrote {len(keys)} {dim}-d embeddings in {lists} lists to {args.output} "
+          f"({len(records) - len(keys)} frames without a readable image)")
+
+
+if __name__ == '__main__':
+    main()
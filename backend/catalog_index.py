@@ -0,0 +1,419 @@
+import bisect
+import copy
+import csv
+
+import numpy as np
+
+CATEGORICAL_COLUMNS = ('brand', 'frame_shape', 'gender', 'age_group')
+SORT_KEYS = ('price', '-price', 'brand', '-brand')
+
+# Update batches touching more than this share of the rows rebuild the index instead of patching it
+REBUILD_FRACTION = 0.25
+# Deleted rows keep their slot until they make up this share of the slots, then the index is compacted
+TOMBSTONE_FRACTION = 0.25
+
+_EMPTY = np.empty(0, dtype=np.int32)
+
+
+def record_key(record):
+    """Catalog rows are identified by brand and model"""
+    return (record['brand'], record['model'])
+
+
+def load_records(path):
+    """Read the stock CSV into a list of dicts.
+
+    Inline `data:image/...;base64,...` links contain an unquoted comma, so a row
+    can come back with extra fields; they are folded back into the last column.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        records = []
+        for row in reader:
+            if not row:
+                continue
+            if len(row) > len(header):
+                row = row[:len(header) - 1] + [','.join(row[len(header) - 1:])]
+            record = dict(zip(header, row))
+            record['price'] = float(record['price'])
+            records.append(record)
+    return records
+
+
+def intersect_sorted(a, b):
+    """Intersect two sorted row-id arrays in O(len(a) * log(len(b)))"""
+    if len(a) > len(b):
+        a, b = b, a
+    if len(a) == 0:
+        return _EMPTY
+    idx = np.searchsorted(b, a)
+    found = idx < len(b)
+    found[found] = b[idx[found]] == a[found]
+    return a[found]
+
+
+def insert_sorted(rows, new_rows):
+    """Merge sorted `new_rows` into the sorted row-id array `rows`"""
+    return np.insert(rows, np.searchsorted(rows, new_rows), new_rows).astype(np.int32)
+
+
+def stable_order(keys, rows):
+    """`rows` sorted by `keys`, ties broken by row id"""
+    return rows[np.lexsort((rows, keys[rows]))].astype(np.int32)
+
+
+def reorder(order, keys, removed, inserted):
+    """Take `removed` out of `order` (a stable_order by `keys`) and slot `inserted` into place.
+
+    Costs a few passes over `order` plus a binary search per inserted row, not a full sort.
+    """
+    if len(removed):
+        order = order[~np.isin(order, removed)]
+    if not len(inserted):
+        return order
+    inserted = stable_order(keys, inserted)
+    ordered_keys = keys[order]
+    positions = np.searchsorted(ordered_keys, keys[inserted], 'left')
+    tied = positions < len(order)
+    tied[tied] = ordered_keys[positions[tied]] == keys[inserted[tied]]
+    if tied.any():
+        # Equal keys stay in row id order: search on (run of equal keys, row id) packed into an int64
+        runs = np.concatenate(([0], np.cumsum(ordered_keys[1:] != ordered_keys[:-1]))).astype(np.int64)
+        packed = (runs << 32) | order
+        positions[tied] = np.searchsorted(packed, (runs[positions[tied]] << 32) | inserted[tied])
+    return np.insert(order, positions, inserted).astype(np.int32)
+
+
+class CategoricalColumn:
+    """Dictionary-encoded column with a sorted posting list of row ids per value.
+
+    Deleted rows have code -1. Values stay in the dictionary after their last
+    row goes, with an empty posting list.
+    """
+
+    def __init__(self, values):
+        self.values = []  # code -> value, in order of first appearance
+        self.lookup = {}  # value -> code
+        self.codes = np.empty(len(values), dtype=np.int32)
+        postings = []
+        for row, value in enumerate(values):
+            code = self.lookup.get(value)
+            if code is None:
+                code = self.lookup[value] = len(self.values)
+                self.values.append(value)
+                postings.append([])
+            self.codes[row] = code
+            postings[code].append(row)
+        self.postings = [np.array(rows, dtype=np.int32) for rows in postings]
+
+    def live_values(self):
+        return [value for value, rows in zip(self.values, self.postings) if len(rows)]
+
+    def updated(self, rows, values, size):
+        """Copy with each of `rows` set to its value in `values` (None deletes it), grown to `size` rows"""
+        column = copy.copy(self)
+        column.values = list(self.values)
+        column.lookup = dict(self.lookup)
+        column.codes = np.full(size, -1, dtype=np.int32)
+        column.codes[:len(self.codes)] = self.codes
+        removed, added = {}, {}
+        for row, value in zip(rows, values):
+            code = -1 if value is None else column.lookup.get(value)
+            if code is None:
+                code = column.lookup[value] = len(column.values)
+                column.values.append(value)
+            old = column.codes[row]
+            if old == code:
+                continue
+            if old >= 0:
+                removed.setdefault(old, []).append(row)
+            if code >= 0:
+                added.setdefault(code, []).append(row)
+            column.codes[row] = code
+
+        # Only the posting lists of values that gained or lost rows are rewritten
+        column.postings = self.postings + [_EMPTY] * (len(column.values) - len(self.values))
+        for code in removed.keys() | added.keys():
+            postings = column.postings[code]
+            if code in removed:
+                postings = postings[~np.isin(postings, removed[code])]
+            if code in added:
+                postings = insert_sorted(postings, np.array(added[code], dtype=np.int32))
+            column.postings[code] = postings
+        return column
+
+    def rows(self, value):
+        code = self.lookup.get(value)
+        return _EMPTY if code is None else self.postings[code]
+
+    def rows_any(self, values):
+        lists = [self.rows(value) for value in set(values)]
+        lists = [rows for rows in lists if len(rows)]
+        if not lists:
+            return _EMPTY
+        if len(lists) == 1:
+            return lists[0]
+        return np.sort(np.concatenate(lists))
+
+
+class CatalogIndex:
+    """Filter index over one immutable snapshot of the catalog.
+
+    `apply` returns the next snapshot and leaves this one untouched, so a request
+    that started on it keeps a consistent view while updates are swapped in.
+    """
+
+    def __init__(self, records, fields=None, sequence=None):
+        self.records = list(records)  # row id -> record, None once deleted
+        self.fields = fields or (tuple(records[0]) if records else ())
+        self.keys = {record_key(record): row for row, record in enumerate(records)}
+        self.all_rows = np.arange(len(records), dtype=np.int32)
+        # Row id -> insertion number. Increases with the row id and survives compaction, so it
+        # breaks sort ties and positions cursors the same way in every snapshot
+        self.sequence = np.arange(len(records), dtype=np.int64) if sequence is None else np.asarray(sequence)
+        self.next_sequence = int(self.sequence[-1]) + 1 if len(self.sequence) else 0
+        self.columns = {
+            column: CategoricalColumn([record[column] for record in records])
+            for column in CATEGORICAL_COLUMNS
+        }
+        # Brand filtering is case-insensitive
+        self.brand_lower = CategoricalColumn([record['brand'].lower() for record in records])
+        self.prices = np.array([record['price'] for record in records], dtype=np.float64)
+        self.sort_orders = {sort: stable_order(keys, self.all_rows) for sort, keys in self._sort_keys().items()}
+        self._rank()
+
+    def _sort_keys(self):
+        # Brands sort by their position among the sorted brand names, kept for seeking cursors
+        brand = self.columns['brand']
+        self.sorted_brands = sorted(brand.values)
+        brand_position = {value: i for i, value in enumerate(self.sorted_brands)}
+        self.brand_keys = np.array([brand_position[value] for value in brand.values], dtype=np.int32)[brand.codes]
+        return {'price': self.prices, '-price': -self.prices, 'brand': self.brand_keys, '-brand': -self.brand_keys}
+
+    def _rank(self):
+        # Sort position of every row for each supported sort order
+        self.sort_ranks = {}
+        for sort, order in self.sort_orders.items():
+            rank = np.zeros(len(self.records), dtype=np.int32)
+            rank[order] = np.arange(len(order), dtype=np.int32)
+            self.sort_ranks[sort] = rank
+        self.price_order = self.sort_orders['price']
+        self.sorted_prices = self.prices[self.price_order]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def distinct(self, column):
+        return self.columns[column].live_values()
+
+    def price_range(self):
+        if not len(self.sorted_prices):
+            return None, None
+        return float(self.sorted_prices[0]), float(self.sorted_prices[-1])
+
+    def diff(self, records):
+        """The (upserts, deletes) that turn this snapshot into `records`"""
+        upserts = []
+        seen = set()
+        for record in records:
+            key = record_key(record)
+            seen.add(key)
+            row = self.keys.get(key)
+            if row is None or self.records[row] != record:
+                upserts.append(record)
+        deletes = [key for key in self.keys if key not in seen]
+        return upserts, deletes
+
+    def apply(self, upserts=(), deletes=()):
+        """Return a new snapshot with `deletes` (keys) removed, then `upserts` added or replaced.
+
+        Rows keep their ids: updates rewrite only the posting lists and sort
+        orders they touch, deletes leave an empty slot and new records are
+        appended. Batches past REBUILD_FRACTION of the catalog, or ones that
+        leave too many empty slots, rebuild a compacted index instead.
+        """
+        keys = dict(self.keys)
+        records = list(self.records)
+        next_sequence = self.next_sequence
+        changed = {}  # row -> record, None for deleted
+        for key in deletes:
+            row = keys.pop(tuple(key), None)
+            if row is not None:
+                changed[row] = None
+        for record in upserts:
+            key = record_key(record)
+            row = keys.get(key)
+            if row is None:
+                row = keys[key] = len(records)
+                records.append(None)
+                next_sequence += 1
+            changed[row] = record
+        for row, record in changed.items():
+            records[row] = record
+
+        if not changed:
+            return self
+        sequence = np.concatenate((self.sequence, np.arange(self.next_sequence, next_sequence, dtype=np.int64)))
+        if (len(changed) > REBUILD_FRACTION * max(len(self), 1)
+                or len(records) - len(keys) > TOMBSTONE_FRACTION * len(records)):
+            live = [row for row, record in enumerate(records) if record is not None]
+            index = CatalogIndex([records[row] for row in live], self.fields, sequence[live])
+            index.next_sequence = next_sequence
+            return index
+
+        index = copy.copy(self)
+        index.records = records
+        index.keys = keys
+        index.sequence = sequence
+        index.next_sequence = next_sequence
+        rows = np.array(sorted(changed), dtype=np.int32)
+        values = [changed[row] for row in rows]
+        index.columns = {
+            column: self.columns[column].updated(
+                rows, [None if record is None else record[column] for record in values], len(records))
+            for column in CATEGORICAL_COLUMNS
+        }
+        index.brand_lower = self.brand_lower.updated(
+            rows, [None if record is None else record['brand'].lower() for record in values], len(records))
+
+        upserted = rows[[record is not None for record in values]]
+        index.prices = np.zeros(len(records), dtype=np.float64)
+        index.prices[:len(self.prices)] = self.prices
+        index.prices[upserted] = [changed[row]['price'] for row in upserted]
+
+        live = np.zeros(len(records), dtype=bool)
+        live[self.all_rows] = True
+        live[rows] = False
+        live[upserted] = True
+        index.all_rows = np.flatnonzero(live).astype(np.int32)
+
+        # Rows that existed before the batch were in the old orders; re-slot the ones still live
+        removed = rows[rows < len(self.records)]
+        index.sort_orders = {
+            sort: reorder(self.sort_orders[sort], keys_for_sort, removed, upserted)
+            for sort, keys_for_sort in index._sort_keys().items()
+        }
+        index._rank()
+        return index
+
+    def filter_options(self):
+        """Every value the search filters can take, as served by /filters"""
+        min_price, max_price = self.price_range()
+        return {
+            "brands": self.distinct('brand'),
+            "frame_shapes": self.distinct('frame_shape'),
+            "genders": self.distinct('gender'),
+            "age_groups": self.distinct('age_group'),
+            "price_range": {
+                "min": min_price,
+                "max": max_price
+            }
+        }
+
+    def _price_rows(self, min_price, max_price):
+        lo = 0 if min_price is None else np.searchsorted(self.sorted_prices, min_price, 'left')
+        hi = len(self.sorted_prices) if max_price is None else np.searchsorted(self.sorted_prices, max_price, 'right')
+        return np.sort(self.price_order[lo:hi])
+
+    def query(self, frame_shapes=None, min_price=None, max_price=None,
+              brand=None, gender=None, age_group=None):
+        """Return the sorted row ids matching every given filter"""
+        lists = []
+        if frame_shapes is not None:
+            lists.append(self.columns['frame_shape'].rows_any(frame_shapes))
+        if brand:
+            lists.append(self.brand_lower.rows(brand.lower()))
+        if gender:
+            lists.append(self.columns['gender'].rows_any([gender, 'unisex']))
+        if age_group:
+            lists.append(self.columns['age_group'].rows(age_group))
+
+        has_price = min_price is not None or max_price is not None
+        if not lists:
+            return self._price_rows(min_price, max_price) if has_price else self.all_rows
+
+        # Intersect smallest first so the work is bounded by the most selective filter
+        lists.sort(key=len)
+        rows = lists[0]
+        for other in lists[1:]:
+            rows = intersect_sorted(rows, other)
+
+        if has_price:
+            prices = self.prices[rows]
+            mask = np.ones(len(rows), dtype=bool)
+            if min_price is not None:
+                mask &= prices >= min_price
+            if max_price is not None:
+                mask &= prices <= max_price
+            rows = rows[mask]
+        return rows
+
+    def sort_value(self, row, sort):
+        """The value `row` is ordered by under `sort`: its price or its brand"""
+        record = self.records[row]
+        return record['price'] if sort.lstrip('-') == 'price' else record['brand']
+
+    def _after(self, rows, sort, after):
+        """Mask of `rows` that come after the `after` key in the order of `sort`.
+
+        The key is (sort value, sequence), or just the sequence without a sort.
+        It holds values rather than positions, so it stays valid in later
+        snapshots even if the row it came from has changed or gone.
+        """
+        sequence = self.sequence[rows]
+        if sort is None:
+            return sequence > after
+        value, after_sequence = after
+        later = sequence > after_sequence
+        if sort.lstrip('-') == 'price':
+            prices = self.prices[rows]
+            beyond = prices < value if sort.startswith('-') else prices > value
+            return beyond | ((prices == value) & later)
+
+        position = bisect.bisect_left(self.sorted_brands, value)
+        exact = position < len(self.sorted_brands) and self.sorted_brands[position] == value
+        keys = self.brand_keys[rows]
+        if sort.startswith('-'):
+            beyond = keys < position
+        else:
+            beyond = keys > position if exact else keys >= position
+        return beyond | ((keys == position) & later) if exact else beyond
+
+    def page(self, rows, sort=None, after=None, limit=None):
+        """Order `rows` by `sort` and cut the window that follows the `after` key.
+
+        Returns (page_rows, next_key); next_key is None on the last page. See
+        `_after` for the key.
+        """
+        if after is not None:
+            rows = rows[self._after(rows, sort, after)]
+        keys = rows if sort is None else self.sort_ranks[sort][rows]
+
+        has_more = limit is not None and len(rows) > limit
+        if sort is not None:
+            if has_more:
+                # Only the first `limit` keys need a full sort
+                order = np.argpartition(keys, limit - 1)[:limit]
+                order = order[np.argsort(keys[order])]
+            else:
+                order = np.argsort(keys)
+            rows, keys = rows[order], keys[order]
+        elif has_more:
+            rows, keys = rows[:limit], keys[:limit]
+
+        if not has_more:
+            return rows, None
+        last = rows[-1]
+        sequence = int(self.sequence[last])
+        return rows, (sequence if sort is None else (self.sort_value(last, sort), sequence))
+
+    def get_records(self, rows, fields=None):
+        if fields is None:
+            return [self.records[row] for row in rows]
+        return [{field: self.records[row][field] for field in fields} for row in rows]
+
+    def iter_records(self, rows, fields=None, chunk_size=512):
+        """Yield records lazily in chunks so large results never materialize at once"""
+        for start in range(0, len(rows), chunk_size):
+            yield from self.get_records(rows[start:start + chunk_size], fields)
@@ -0,0 +1,133 @@
+import os
+
+from catalog_index import load_records, record_key
+
+# Where the catalog lives: csv (read-only, watched for changes), memory (seeded from the CSV,
+# updated through POST /catalog and lost on restart) or mongodb
+CATALOG_STORE = os.environ.get('MAGDA_CATALOG_STORE', 'csv')
+# Seconds between checks for changes made outside the API; 0 disables watching
+CATALOG_POLL_SECONDS = float(os.environ.get('MAGDA_CATALOG_POLL_SECONDS', 2))
+MONGODB_URL = os.environ.get('MAGDA_MONGODB_URL', 'mongodb://mongodb:27017')
+MONGODB_DATABASE = os.environ.get('MAGDA_MONGODB_DATABASE', 'magda')
+MONGODB_COLLECTION = os.environ.get('MAGDA_MONGODB_COLLECTION', 'frames')
+
+
+class ReadOnlyStore(Exception):
+    pass
+
+
+class CsvCatalogStore:
+    """The stock CSV; replace the file (write, then rename over it) to update the catalog"""
+
+    read_only = True
+    watch = True
+
+    def __init__(self, path):
+        self.path = path
+
+    def fingerprint(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self):
+        return load_records(self.path)
+
+    def upsert(self, records):
+        raise ReadOnlyStore(f"{self.path} is read-only here; edit the file instead")
+
+    def delete(self, keys):
+        raise ReadOnlyStore(f"{self.path} is read-only here; edit the file instead")
+
+
+class MemoryCatalogStore:
+    """Mutable in-process catalog with the MongoDB store's interface, for tests and local runs"""
+
+    read_only = False
+    # Only written through POST /catalog, which applies its own changes
+    watch = False
+
+    def __init__(self, records=()):
+        self.records = {record_key(record): dict(record) for record in records}
+        self.version = 0
+
+    def fingerprint(self):
+        return self.version
+
+    def load(self):
+        return [dict(record) for record in self.records.values()]
+
+    def upsert(self, records):
+        for record in records:
+            self.records[record_key(record)] = dict(record)
+        self.version += 1
+
+    def delete(self, keys):
+        for key in keys:
+            self.records.pop(tuple(key), None)
+        self.version += 1
+
+
+class MongoCatalogStore:
+    """One document per frame, keyed by brand and model. Seeded from `seed_path` when empty.
+
+    Change streams need a replica set and the bundled mongo service is standalone,
+    so changes are found by polling. Every write bumps a counter in the
+    `<collection>_meta` collection; other writers should do the same with
+    `{'$inc': {'version': 1}}` on `{'_id': 'catalog'}`. The document count is
+    polled too, so inserts and deletes that skip the counter are still seen.
+    """
+
+    read_only = False
+    watch = True
+
+    def __init__(self, url=MONGODB_URL, database=MONGODB_DATABASE, collection=MONGODB_COLLECTION, seed_path=None):
+        # Deferred so pymongo is only needed when the catalog is kept in MongoDB
+        import pymongo
+
+        self.pymongo = pymongo
+        db = pymongo.MongoClient(url, serverSelectionTimeoutMS=5000)[database]
+        self.collection = db[collection]
+        self.meta = db[f'{collection}_meta']
+        if seed_path and self.collection.estimated_document_count() == 0:
+            self.upsert(load_records(seed_path))
+
+    @staticmethod
+    def _id(key):
+        brand, model = key
+        return {'brand': brand, 'model': model}
+
+    def fingerprint(self):
+        meta = self.meta.find_one({'_id': 'catalog'}) or {}
+        return meta.get('version', 0), self.collection.estimated_document_count()
+
+    def _bump_version(self):
+        self.meta.update_one({'_id': 'catalog'}, {'$inc': {'version': 1}}, upsert=True)
+
+    def load(self):
+        return list(self.collection.find({}, {'_id': 0}))
+
+    def upsert(self, records):
+        operations = [
+            self.pymongo.ReplaceOne({'_id': self._id(record_key(record))}, {'_id': self._id(record_key(record)), **record},
+                                    upsert=True)
+            for record in records
+        ]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+            self._bump_version()
+
+    def delete(self, keys):
+        ids = [self._id(tuple(key)) for key in keys]
+        if ids:
+            self.collection.delete_many({'_id': {'$in': ids}})
+            self._bump_version()
+
+
+def open_catalog_store(kind=CATALOG_STORE, path='stock.csv'):
+    if kind == 'csv':
+        return CsvCatalogStore(path)
+    if kind == 'memory':
+        return MemoryCatalogStore(load_records(path))
+    if kind == 'mongodb':
+        return MongoCatalogStore(seed_path=path)
+    raise ValueError(f"Unknown MAGDA_CATALOG_STORE {kind!r}; expected csv, memory or mongodb")
@@ -0,0 +1,44 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Budget for `import main` in a fresh interpreter; catalog endpoints can serve right after
+IMPORT_BUDGET_MS = float(os.environ.get('MAGDA_IMPORT_BUDGET_MS', 800))
+RUNS = 5
+
+# Modules that must only load on first detection request or in the background warm-up
+HEAVY_MODULES = ('cv2', 'mediapipe', 'tensorflow', 'pandas', 'sklearn', 'matplotlib')
+
+PROBE = f"""
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({{"ms": elapsed, "heavy": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def measure():
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE],
+        capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    runs = [measure() for _ in range(RUNS)]
+    median_ms = statistics.median(run['ms'] for run in runs)
+    heavy = sorted({module for run in runs for module in run['heavy']})
+
+    print(f"import main: median {median_ms:.1f} ms over {RUNS} runs (budget {IMPORT_BUDGET_MS:.0f} ms)")
+    if heavy:
+        print(f"Heavy modules imported eagerly: {', '.join(heavy)}")
+    return median_ms <= IMPORT_BUDGET_MS and not heavy
+
+
+if __name__ == '__main__':
+    raise SystemExit(0 if main() else 1)
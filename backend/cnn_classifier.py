@@ -0,0 +1,83 @@
+import json
+import os
+
+import numpy as np
+
+from runtime_probe import runtime_config
+
+CNN_MODEL_PATH = os.environ.get('MAGDA_CNN_MODEL_PATH', 'face_shape_model.tflite')
+CNN_LABELS_PATH = os.environ.get('MAGDA_CNN_LABELS_PATH', 'face_shape_labels.json')
+# Interpreter threads per worker (MAGDA_CNN_THREADS overrides)
+CNN_THREADS = runtime_config()['cnn_threads']
+# Landmark-classifier confidence below which /detect-face escalates to the CNN; 0 disables it
+CASCADE_THRESHOLD = float(os.environ.get('MAGDA_CASCADE_THRESHOLD', 0.6))
+
+# Input size of the InceptionResNetV2 face-shape model
+CNN_INPUT_SHAPE = (224, 224)
+
+
+def load_interpreter_class():
+    """Find a TFLite interpreter, preferring the standalone runtimes over full TensorFlow"""
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite.python.interpreter import Interpreter
+    return Interpreter
+
+
+def preprocess_input(images):
+    """InceptionResNetV2 preprocessing: scale pixels from [0, 255] to [-1, 1]"""
+    return np.asarray(images, dtype=np.float32) / 127.5 - 1.0
+
+
+class CNNClassifier:
+    """Exported face-shape CNN run through a TFLite interpreter. Not thread-safe: one per worker."""
+
+    def __init__(self, model_path=CNN_MODEL_PATH, labels_path=CNN_LABELS_PATH, num_threads=CNN_THREADS):
+        with open(labels_path) as f:
+            self.classes = json.load(f)
+
+        Interpreter = load_interpreter_class()
+        self.interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+
+    def preprocess(self, rgb_image):
+        """Resize an RGB uint8 image to the model input and normalize it"""
+        import cv2
+
+        # Nearest-neighbour matches the flow_from_directory default used in training
+        resized = cv2.resize(rgb_image, CNN_INPUT_SHAPE, interpolation=cv2.INTER_NEAREST)
+        return preprocess_input(resized)
+
+    def _quantize(self, batch, details):
+        scale, zero_point = details['quantization']
+        if details['dtype'] == np.float32 or not scale:
+            return batch.astype(details['dtype'])
+        info = np.iinfo(details['dtype'])
+        return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(details['dtype'])
+
+    def predict_proba_array(self, image):
+        """Class probabilities for one preprocessed (224, 224, 3) image"""
+        batch = self._quantize(image[np.newaxis], self.input)
+        self.interpreter.set_tensor(self.input['index'], batch)
+        self.interpreter.invoke()
+        output = self.interpreter.get_tensor(self.output['index'])[0]
+
+        scale, zero_point = self.output['quantization']
+        if self.output['dtype'] != np.float32 and scale:
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+    def predict_proba(self, rgb_image):
+        return self.predict_proba_array(self.preprocess(rgb_image))
+
+    def predict(self, rgb_image):
+        """Return (face_shape, confidence) for an RGB uint8 image"""
+        probabilities = self.predict_proba(rgb_image)
+        best = int(np.argmax(probabilities))
+        return self.classes[best], float(probabilities[best])
@@ -0,0 +1,205 @@
+"""Export model.h5 to TFLite and benchmark it against the Keras model.
+
+    python export_face_shape_model.py export --quantize int8
+    python export_face_shape_model.py benchmark --tflite face_shape_model.tflite
+    python export_face_shape_model.py backbone --architecture mobilenet_v3_small
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from cnn_classifier import CNN_INPUT_SHAPE, CNN_LABELS_PATH, CNN_MODEL_PATH
+from frame_embeddings import FRAME_EMBEDDER_PATH
+from runtime_probe import configure_tensorflow
+
+KERAS_MODEL_PATH = 'model.h5'
+WARMUP_IMAGES = 5
+
+
+def representative_dataset(dataset, num_samples):
+    """Yield single preprocessed validation images for int8 calibration"""
+    for image, _ in dataset.unbatch().take(num_samples).as_numpy_iterator():
+        yield [image[np.newaxis].astype(np.float32)]
+
+
+def export(keras_path, output_path, labels_path, quantize, calibration_samples):
+    import tensorflow as tf
+    from train_face_shape_model import class_names, validation_dataset
+
+    model = tf.keras.models.load_model(keras_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize == 'int8':
+        # Full-integer weights and activations; float input/output keeps preprocessing unchanged
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: representative_dataset(validation_dataset, calibration_samples)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    elif quantize == 'dynamic':
+        # int8 weights only, no calibration data needed
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    tflite_model = converter.convert()
+
+    with open(output_path, 'wb') as f:
+        f.write(tflite_model)
+
+    # Class order follows the training label indices; labels are lowercased to match the backend
+    with open(labels_path, 'w') as f:
+        json.dump([name.lower() for name in class_names], f)
+
+    print(f"Wrote {output_path} ({os.path.getsize(output_path) / 1e6:.1f} MB, quantize={quantize})")
+    print(f"Wrote {labels_path}: {class_names}")
+
+
+def export_backbone(architecture, output_path, quantize):
+    """Image backbone for build_frame_embeddings.py: RGB in [0, 255], globally pooled features out"""
+    import tensorflow as tf
+
+    configure_tensorflow(tf)
+    input_shape = CNN_INPUT_SHAPE + (3,)
+    inputs = tf.keras.Input(shape=input_shape)
+    if architecture == 'inception_resnet_v2':
+        # The face-shape CNN's backbone; training keeps it frozen, so these are the same weights
+        base = tf.keras.applications.InceptionResNetV2(
+            weights='imagenet', include_top=False, pooling='avg', input_shape=input_shape)
+        outputs = base(tf.keras.layers.Rescaling(1 / 127.5, offset=-1)(inputs))
+    else:
+        # About 1/20th the size, and it rescales its own input
+        base = tf.keras.applications.MobileNetV3Small(
+            weights='imagenet', include_top=False, pooling='avg', input_shape=input_shape)
+        outputs = base(inputs)
+    model = tf.keras.Model(inputs, outputs)
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize == 'dynamic':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+    print(f"Wrote {output_path} ({os.path.getsize(output_path) / 1e6:.1f} MB, {architecture}, "
+          f"{model.output_shape[-1]}-d features, quantize={quantize})")
+
+
+def peak_rss_mb():
+    # VmHWM resets on exec, unlike ru_maxrss which a spawned child inherits from its parent
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_test_set(limit=None):
+    """Load and preprocess the testing_set images once so every backend sees the same input"""
+    from train_face_shape_model import make_dataset, test_labels, test_paths
+
+    labels = test_labels[:limit]
+    images = np.concatenate([
+        batch for batch, _ in make_dataset(test_paths[:limit], labels).as_numpy_iterator()
+    ])
+    return images, labels
+
+
+def _benchmark_backend(kind, model_path, labels_path, data_path):
+    """Runs in a fresh process so load time and peak memory belong to this backend alone"""
+    data = np.load(data_path)
+    images, labels = data['images'], data['labels']
+    rss_before = peak_rss_mb()
+
+    start = time.perf_counter()
+    if kind == 'keras':
+        import tensorflow as tf
+        model = tf.keras.models.load_model(model_path)
+        predict = lambda image: model(image[np.newaxis], training=False).numpy()[0]
+    else:
+        from cnn_classifier import CNNClassifier
+        predict = CNNClassifier(model_path, labels_path).predict_proba_array
+    load_s = time.perf_counter() - start
+
+    for image in images[:WARMUP_IMAGES]:
+        predict(image)
+
+    latencies = []
+    correct = 0
+    for image, label in zip(images, labels):
+        start = time.perf_counter()
+        probabilities = predict(image)
+        latencies.append((time.perf_counter() - start) * 1000)
+        correct += int(np.argmax(probabilities) == label)
+
+    return {
+        "backend": kind,
+        "model": model_path,
+        "model_mb": round(os.path.getsize(model_path) / 1e6, 2),
+        "images": len(images),
+        "accuracy": round(correct / len(images), 4),
+        "load_s": round(load_s, 2),
+        "mean_ms": round(float(np.mean(latencies)), 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "rss_added_mb": round(peak_rss_mb() - rss_before, 1),
+    }
+
+
+def benchmark(keras_path, tflite_paths, labels_path, limit, output_path):
+    images, labels = load_test_set(limit)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path = os.path.join(tmp, 'testing_set.npz')
+        np.savez(data_path, images=images, labels=labels)
+
+        backends = [('keras', keras_path)] + [('tflite', path) for path in tflite_paths]
+        for kind, model_path in backends:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                result = pool.submit(_benchmark_backend, kind, model_path, labels_path, data_path).result()
+            results.append(result)
+            print(json.dumps(result))
+
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {output_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help="Convert the Keras model to TFLite")
+    export_parser.add_argument('--keras', default=KERAS_MODEL_PATH)
+    export_parser.add_argument('--output', default=CNN_MODEL_PATH)
+    export_parser.add_argument('--labels', default=CNN_LABELS_PATH)
+    export_parser.add_argument('--quantize', choices=('none', 'dynamic', 'int8'), default='int8')
+    export_parser.add_argument('--calibration-samples', type=int, default=200)
+
+    benchmark_parser = subparsers.add_parser('benchmark', help="Compare Keras and TFLite on testing_set")
+    benchmark_parser.add_argument('--keras', default=KERAS_MODEL_PATH)
+    benchmark_parser.add_argument('--tflite', nargs='+', default=[CNN_MODEL_PATH])
+    benchmark_parser.add_argument('--labels', default=CNN_LABELS_PATH)
+    benchmark_parser.add_argument('--limit', type=int, default=None, help="Only use the first N test images")
+    benchmark_parser.add_argument('--output', default='cnn_benchmark.json')
+
+    backbone_parser = subparsers.add_parser('backbone', help="Export an image-embedding backbone for similar frames")
+    backbone_parser.add_argument('--architecture', choices=('mobilenet_v3_small', 'inception_resnet_v2'),
+                                 default='mobilenet_v3_small')
+    backbone_parser.add_argument('--output', default=FRAME_EMBEDDER_PATH)
+    backbone_parser.add_argument('--quantize', choices=('none', 'dynamic'), default='dynamic')
+
+    args = parser.parse_args()
+    if args.command == 'export':
+        export(args.keras, args.output, args.labels, args.quantize, args.calibration_samples)
+    elif args.command == 'backbone':
+        export_backbone(args.architecture, args.output, args.quantize)
+    else:
+        benchmark(args.keras, args.tflite, args.labels, args.limit, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+import os
+import pickle
+
+import cv2
+import numpy as np
+import mediapipe as mp
+
+from cnn_classifier import CASCADE_THRESHOLD, CNN_MODEL_PATH, CNNClassifier
+from face_features import NO_FACE, features_from_coords, landmarks_to_array
+from preprocessing import FACE_CROP, MAX_IMAGE_SIDE, FaceCropper, StageTimer, decode_image, uncrop_landmarks
+from runtime_probe import configure_cv2
+
+MODEL_PATH = 'face_shape_model.pkl'
+
+# Parallelism comes from the inference workers, so OpenCV gets only each worker's share of the CPUs
+configure_cv2(cv2)
+
+mp_face_mesh = mp.solutions.face_mesh
+
+
+def load_model(model_path=MODEL_PATH):
+    """Load the trained (classifier, scaler) pair"""
+    with open(model_path, 'rb') as f:
+        clf, scaler = pickle.load(f)
+    return clf, scaler
+
+
+class FaceShapeDetector:
+    """Face mesh plus classifier, with the CNN as a fallback for uncertain faces.
+
+    Not thread-safe: each worker owns one.
+    """
+
+    def __init__(self, model_path=MODEL_PATH, max_side=MAX_IMAGE_SIDE, face_crop=FACE_CROP,
+                 static_image_mode=True, model=None, cascade_threshold=CASCADE_THRESHOLD,
+                 cnn_model_path=CNN_MODEL_PATH):
+        # static_image_mode=False tracks landmarks across consecutive frames of one stream
+        self.face_mesh = mp_face_mesh.FaceMesh(
+            static_image_mode=static_image_mode,
+            max_num_faces=1,
+            min_detection_confidence=0.5
+        )
+        self.clf, self.scaler = model or load_model(model_path)
+        self.max_side = max_side
+        self.cropper = FaceCropper() if face_crop else None
+        # Below this landmark-classifier confidence the CNN decides; 0 or a missing export disables it
+        self.cascade_threshold = cascade_threshold
+        self.cnn = CNNClassifier(cnn_model_path) \
+            if cascade_threshold > 0 and os.path.exists(cnn_model_path) else None
+
+    def warm_up(self):
+        """Run one blank frame through the graph so the first request doesn't pay for it"""
+        blank = np.zeros((192, 192, 3), dtype=np.uint8)
+        self.face_mesh.process(blank)
+        if self.cropper:
+            self.cropper.face_detection.process(blank)
+        if self.cnn:
+            self.cnn.predict_proba(blank)
+
+    def mesh_timed(self, image_data: bytes, timer=None):
+        """Decode an image and return (rgb_image, (468, 3) landmarks or None, timings)"""
+        timer = timer or StageTimer()
+        img = decode_image(image_data, self.max_side, timer)
+        if img is None:
+            return None, None, timer.timings
+
+        # Convert to RGB
+        rgb_image = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        timer.mark('color')
+
+        # Mesh only the face region when a crop is found, then map back to full-image coordinates
+        box = None
+        if self.cropper:
+            cropped = self.cropper.crop(rgb_image)
+            timer.mark('crop')
+            if cropped is not None:
+                mesh_input, box = cropped
+        if box is None:
+            mesh_input = rgb_image
+
+        # Process the image
+        results = self.face_mesh.process(np.ascontiguousarray(mesh_input))
+        timer.mark('mesh')
+
+        if not results.multi_face_landmarks:
+            return rgb_image, None, timer.timings
+
+        coords = landmarks_to_array(results.multi_face_landmarks[0])
+        if box is not None:
+            height, width = rgb_image.shape[:2]
+            coords = uncrop_landmarks(coords, box, width, height)
+        return rgb_image, coords, timer.timings
+
+    def landmarks_timed(self, image_data: bytes, timer=None):
+        """Decode an image and return its (468, 3) landmark array, or None if no face is found"""
+        _, coords, timings = self.mesh_timed(image_data, timer)
+        return coords, timings
+
+    def landmarks(self, image_data: bytes):
+        return self.landmarks_timed(image_data)[0]
+
+    def classify(self, features):
+        """Scale an (N, 4) feature matrix and predict all face shapes in one call"""
+        features_scaled = self.scaler.transform(features)
+        return self.clf.predict(features_scaled).tolist()
+
+    def probabilities(self, features):
+        """Class probabilities for an (N, 4) feature matrix, one-hot if the model has no predict_proba"""
+        features_scaled = self.scaler.transform(features)
+        if hasattr(self.clf, 'predict_proba'):
+            return self.clf.predict_proba(features_scaled)
+        predictions = self.clf.predict(features_scaled)
+        return (predictions[:, np.newaxis] == self.clf.classes_).astype(np.float64)
+
+    def classify_with_confidence(self, features):
+        """[(face_shape, confidence)] for an (N, 4) feature matrix"""
+        probabilities = self.probabilities(features)
+        best = np.argmax(probabilities, axis=1)
+        return [
+            (str(self.clf.classes_[index]), float(row[index]))
+            for index, row in zip(best, probabilities)
+        ]
+
+    def classify_cnn(self, image_data: bytes):
+        """(face_shape, confidence) from the CNN alone, for images the landmark classifier was unsure of.
+
+        None if this worker has no CNN, e.g. it started before the export was deployed.
+        """
+        if self.cnn is None:
+            return None
+        img = decode_image(image_data, self.max_side)
+        if img is None:
+            return NO_FACE, 0.0
+        return self.cnn.predict(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+
+    def close(self):
+        self.face_mesh.close()
+        if self.cropper:
+            self.cropper.face_detection.close()
+
+    def analyze(self, image_data: bytes):
+        """Predict the face shape, its confidence, which model decided and each stage's time (ms)"""
+        timer = StageTimer()
+        rgb_image, coords, timings = self.mesh_timed(image_data, timer)
+        if coords is None:
+            return {"face_shape": NO_FACE, "confidence": 0.0, "path": "no_face", "timings": timings}
+
+        features = features_from_coords(coords[np.newaxis])
+        timer.mark('features')
+        face_shape, confidence = self.classify_with_confidence(features)[0]
+        timer.mark('classify')
+        path = 'landmarks'
+
+        if self.cnn is not None and confidence < self.cascade_threshold:
+            face_shape, confidence = self.cnn.predict(rgb_image)
+            timer.mark('cnn')
+            path = 'cnn'
+        return {"face_shape": face_shape, "confidence": confidence, "path": path, "timings": timer.timings}
+
+    def detect(self, image_data: bytes) -> str:
+        return self.analyze(image_data)["face_shape"]
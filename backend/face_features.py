@@ -0,0 +1,43 @@
+import numpy as np
+
+NO_FACE = "No face detected"
+
+
+def landmarks_to_array(landmarks):
+    """Copy a FaceMesh landmark list into a (468, 3) float32 array"""
+    return np.array([(p.x, p.y, p.z) for p in landmarks.landmark], dtype=np.float32)
+
+
+def features_from_coords(coords):
+    """Vectorized extract_features over an (N, 468, 3) array of landmark coordinates"""
+    coords = np.asarray(coords, dtype=np.float64)
+    x = coords[:, :, 0]
+    y = coords[:, :, 1]
+
+    # Face height (forehead to chin)
+    face_height = y[:, 152] - y[:, 10]
+
+    # Face width (temple to temple)
+    face_width = x[:, 454] - x[:, 234]
+
+    # Jaw width
+    jaw_width = x[:, 172] - x[:, 397]
+
+    # Cheekbone width
+    cheekbone_width = x[:, 123] - x[:, 352]
+
+    # Forehead width
+    forehead_width = x[:, 109] - x[:, 338]
+
+    # Calculate ratios
+    return np.stack([
+        face_height / face_width,  # Height to width ratio
+        jaw_width / face_width,    # Jaw to face width ratio
+        cheekbone_width / jaw_width,  # Cheekbone to jaw ratio
+        forehead_width / jaw_width,   # Forehead to jaw ratio
+    ], axis=1)
+
+
+def extract_features(landmarks):
+    """Extract meaningful features from facial landmarks"""
+    return features_from_coords(landmarks_to_array(landmarks)[np.newaxis])[0].tolist()
@@ -0,0 +1,120 @@
+import json
+import os
+
+import numpy as np
+
+FRAME_EMBEDDINGS_DIR = os.environ.get('MAGDA_FRAME_EMBEDDINGS_DIR', 'frame_embeddings')
+FRAME_EMBEDDER_PATH = os.environ.get('MAGDA_FRAME_EMBEDDER_PATH', 'frame_embedder.tflite')
+# IVF lists scanned per round of a query; more is slower and closer to an exact search
+SIMILAR_NPROBE = int(os.environ.get('MAGDA_SIMILAR_NPROBE', 16))
+# Filtered queries with at most this many candidate frames skip the IVF lists and score them all
+SIMILAR_EXACT_MAX = int(os.environ.get('MAGDA_SIMILAR_EXACT_MAX', 10000))
+
+
+def top_k(scores, k):
+    """Positions of the k highest scores, best first"""
+    if len(scores) > k:
+        best = np.argpartition(-scores, k - 1)[:k]
+    else:
+        best = np.arange(len(scores))
+    return best[np.argsort(-scores[best], kind='stable')]
+
+
+class FrameEmbeddings:
+    """L2-normalized float16 frame embeddings, memory-mapped, with an IVF index over them.
+
+    build_frame_embeddings.py writes the rows grouped by IVF list, so every
+    list is one contiguous slice of `vectors`. A query scores the centroids and
+    then only the rows of the closest lists.
+    """
+
+    def __init__(self, directory=FRAME_EMBEDDINGS_DIR):
+        with open(os.path.join(directory, 'index.json')) as f:
+            self.config = json.load(f)
+        with open(os.path.join(directory, 'keys.json')) as f:
+            self.keys = [tuple(key) for key in json.load(f)]  # row -> (brand, model)
+        self.vectors = np.load(os.path.join(directory, 'vectors.npy'), mmap_mode='r')
+        self.centroids = np.load(os.path.join(directory, 'centroids.npy'))
+        self.offsets = np.load(os.path.join(directory, 'offsets.npy'))  # list -> first row, plus the end
+        self.models = {}  # model -> rows
+        for row, (_, model) in enumerate(self.keys):
+            self.models.setdefault(model, []).append(row)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def bind(self, catalog):
+        return CatalogEmbeddings(self, catalog)
+
+    def search(self, query, k, allowed, nprobe=SIMILAR_NPROBE):
+        """(rows, scores) of the k rows closest to `query` by cosine among those `allowed`"""
+        if allowed.sum() <= SIMILAR_EXACT_MAX:
+            rows = np.flatnonzero(allowed)
+            scores = self.vectors[rows].astype(np.float32) @ query
+            best = top_k(scores, k)
+            return rows[best], scores[best]
+
+        lists = np.argsort(-(self.centroids @ query))
+        row_parts, score_parts = [], []
+        found = 0
+        # Probe nprobe lists at a time until k allowed rows have been scored; selective filters probe further
+        for start in range(0, len(lists), nprobe):
+            for lst in lists[start:start + nprobe]:
+                lo, hi = self.offsets[lst], self.offsets[lst + 1]
+                keep = allowed[lo:hi]
+                if not keep.any():
+                    continue
+                row_parts.append(np.arange(lo, hi)[keep])
+                score_parts.append(self.vectors[lo:hi][keep].astype(np.float32) @ query)
+                found += int(keep.sum())
+            if found >= k:
+                break
+        if not row_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows, scores = np.concatenate(row_parts), np.concatenate(score_parts)
+        best = top_k(scores, k)
+        return rows[best], scores[best]
+
+
+class CatalogEmbeddings:
+    """FrameEmbeddings rows lined up with one CatalogIndex snapshot.
+
+    Frames added since the embedding job ran have no vector and frames deleted
+    since are never returned.
+    """
+
+    def __init__(self, embeddings, catalog):
+        self.embeddings = embeddings
+        self.catalog_rows = np.array([catalog.keys.get(key, -1) for key in embeddings.keys], dtype=np.int64)
+        self.live = self.catalog_rows >= 0
+        self.embedding_rows = np.full(len(catalog.records), -1, dtype=np.int64)
+        self.embedding_rows[self.catalog_rows[self.live]] = np.flatnonzero(self.live)
+
+    def find(self, model, brand=None):
+        """Embedding rows of live frames with this model code, narrowed to `brand` if given"""
+        keys = self.embeddings.keys
+        rows = [row for row in self.embeddings.models.get(model, []) if self.live[row]]
+        if brand is not None:
+            rows = [row for row in rows if keys[row][0].lower() == brand.lower()]
+        return rows
+
+    def similar(self, row, k, catalog_rows=None):
+        """(catalog rows, scores) of the k frames most like embedding `row`, within `catalog_rows` if given"""
+        if catalog_rows is None:
+            allowed = self.live.copy()
+        else:
+            allowed = np.zeros(len(self.live), dtype=bool)
+            rows = self.embedding_rows[catalog_rows]
+            allowed[rows[rows >= 0]] = True
+        allowed[row] = False
+
+        query = self.embeddings.vectors[row].astype(np.float32)
+        rows, scores = self.embeddings.search(query, k, allowed)
+        return self.catalog_rows[rows], scores
+
+
+def load_frame_embeddings(directory=FRAME_EMBEDDINGS_DIR):
+    """The embeddings written by build_frame_embeddings.py, or None if it hasn't been run"""
+    if not os.path.exists(os.path.join(directory, 'index.json')):
+        return None
+    return FrameEmbeddings(directory)
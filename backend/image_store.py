@@ -0,0 +1,128 @@
+import base64
+import binascii
+import hashlib
+import os
+import re
+import sys
+
+from fastapi import HTTPException
+from fastapi.responses import FileResponse, Response
+
+IMAGE_STORE_DIR = os.environ.get('MAGDA_IMAGE_STORE_DIR', 'frame_images')
+IMAGE_URL_PREFIX = os.environ.get('MAGDA_IMAGE_URL_PREFIX', '/frame-images/')
+
+DATA_URI = re.compile(r'^data:(image/[\w.+-]+);base64,(.*)$', re.DOTALL)
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+EXTENSIONS = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+}
+MEDIA_TYPES = {ext: media_type for media_type, ext in EXTENSIONS.items()}
+
+
+class ImageStore:
+    """Content-addressed image blobs on local disk, named <sha256>.<ext>"""
+
+    def __init__(self, directory=IMAGE_STORE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.blobs = {}  # hash -> (path, media_type)
+        for name in os.listdir(directory):
+            image_hash, _, ext = name.partition('.')
+            if ext in MEDIA_TYPES:
+                self.blobs[image_hash] = (os.path.join(directory, name), MEDIA_TYPES[ext])
+
+    def put(self, data: bytes, media_type: str) -> str:
+        image_hash = hashlib.sha256(data).hexdigest()
+        if image_hash not in self.blobs:
+            path = os.path.join(self.directory, f"{image_hash}.{EXTENSIONS.get(media_type, 'bin')}")
+            # Write then rename so readers never see a partial file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self.blobs[image_hash] = (path, media_type)
+        return image_hash
+
+    def get(self, image_hash: str):
+        return self.blobs.get(image_hash)
+
+
+def decode_data_uri(link):
+    """(media_type, bytes) of an inline data: URI image, None for any other link.
+
+    Raises ValueError if the base64 payload is malformed.
+    """
+    match = DATA_URI.match(link or '')
+    if not match:
+        return None
+    media_type, payload = match.groups()
+    try:
+        return media_type, base64.b64decode(payload, validate=True)
+    except binascii.Error as e:
+        raise ValueError(f"Malformed base64 image data: {e}") from None
+
+
+def ingest_inline_images(records, store, url_prefix=IMAGE_URL_PREFIX):
+    """Move inline data: URI images into the store and replace them with short URLs"""
+    moved = 0
+    for record in records:
+        image = decode_data_uri(record.get('image_links'))
+        if image is None:
+            continue
+        image_hash = store.put(image[1], image[0])
+        record['image_links'] = f"{url_prefix}{image_hash}"
+        moved += 1
+    return moved
+
+
+def blob_response(image_hash, path, media_type, headers):
+    """Serve a blob with a strong ETag, long-lived caching and single-range support"""
+    etag = f'"{image_hash}"'
+    response_headers = {
+        'ETag': etag,
+        'Cache-Control': 'public, max-age=31536000, immutable',
+        'Accept-Ranges': 'bytes',
+    }
+
+    if_none_match = headers.get('if-none-match')
+    if if_none_match and (if_none_match.strip() == '*' or etag in if_none_match):
+        return Response(status_code=304, headers=response_headers)
+
+    match = RANGE.match(headers.get('range', '').strip())
+    if not match or match.groups() == ('', ''):
+        # Full body: FileResponse streams straight from the file
+        return FileResponse(path, media_type=media_type, headers=response_headers)
+
+    size = os.path.getsize(path)
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(0, size - int(last))
+        end = size - 1
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=416,
+            headers={'Content-Range': f"bytes */{size}"}
+        )
+
+    with open(path, 'rb') as f:
+        f.seek(start)
+        body = f.read(end - start + 1)
+    response_headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+    return Response(body, status_code=206, media_type=media_type, headers=response_headers)
+
+
+if __name__ == '__main__':
+    # Pre-populate the store from a catalog CSV: python image_store.py [stock.csv]
+    from catalog_index import load_records
+
+    store = ImageStore()
+    moved = ingest_inline_images(load_records(sys.argv[1] if len(sys.argv) > 1 else 'stock.csv'), store)
+    print(f"Moved {moved} inline images into {store.directory} ({len(store.blobs)} blobs total)")
@@ -0,0 +1,149 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from runtime_probe import runtime_config
+
+# Pool configuration, overridable from the environment
+INFERENCE_MODE = os.environ.get('MAGDA_INFERENCE_MODE', 'thread')  # "thread" or "process"
+# One worker per CPU this server process may use (MAGDA_INFERENCE_WORKERS overrides)
+INFERENCE_WORKERS = runtime_config()['inference_workers']
+INFERENCE_QUEUE_SIZE = int(os.environ.get('MAGDA_INFERENCE_QUEUE_SIZE', 2 * INFERENCE_WORKERS))
+
+# Each worker thread (or the main thread of each worker process) owns one detector
+_worker_state = threading.local()
+
+
+class PoolSaturated(Exception):
+    """Raised when every worker is busy and the wait queue is full"""
+
+
+def _init_worker(model_path):
+    # Imported here so only workers pay for loading cv2 and mediapipe
+    from face_detection import FaceShapeDetector, MODEL_PATH
+
+    detector = FaceShapeDetector(model_path or MODEL_PATH)
+    detector.warm_up()
+    _worker_state.detector = detector
+
+
+def _call_detector(method, *args):
+    return getattr(_worker_state.detector, method)(*args)
+
+
+def _call_detector_many(method, items):
+    fn = getattr(_worker_state.detector, method)
+    return [fn(item) for item in items]
+
+
+def _ping():
+    return os.getpid(), threading.get_ident()
+
+
+class InferencePool:
+    """Runs FaceShapeDetector calls off the event loop with bounded queueing"""
+
+    def __init__(self, mode=INFERENCE_MODE, workers=INFERENCE_WORKERS,
+                 queue_size=INFERENCE_QUEUE_SIZE, model_path=None):
+        if mode not in ('thread', 'process'):
+            raise ValueError(f"Unknown inference mode: {mode}")
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.capacity = self.workers + max(0, queue_size)
+        self.model_path = model_path
+        self._executor = None
+        self._pending = 0
+        self._starting = None
+        self.error = None
+
+    @property
+    def pending(self):
+        return self._pending
+
+    @property
+    def state(self):
+        if self._starting is None:
+            return 'failed' if self.error else 'idle'
+        return 'ready' if self._starting.done() else 'loading'
+
+    async def ensure_started(self):
+        """Start the pool on first use; concurrent callers share the same start-up"""
+        if self._starting is None:
+            self.error = None
+            self._starting = asyncio.ensure_future(self.start())
+        try:
+            # Shielded so a cancelled request doesn't abort start-up for everyone else
+            await asyncio.shield(self._starting)
+        except Exception as exc:
+            if self._starting is not None and self._starting.done():
+                # Let the next request retry, e.g. after the model file is deployed
+                self.error = repr(exc)
+                self._starting = None
+                self.shutdown()
+            raise
+
+    async def start(self):
+        """Create the executor and warm up every worker before serving traffic"""
+        if self.mode == 'process':
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self.model_path,)
+            )
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix='face-mesh',
+                initializer=_init_worker,
+                initargs=(self.model_path,)
+            )
+
+        # Submitting one task per worker forces all of them to spawn (and warm up) now
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[
+            loop.run_in_executor(self._executor, _ping) for _ in range(self.workers)
+        ])
+
+    def shutdown(self):
+        self._starting = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, method, *args):
+        """Call `method` on a worker's detector, or raise PoolSaturated if the queue is full"""
+        if self._pending >= self.capacity:
+            raise PoolSaturated()
+
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, _call_detector, method, *args)
+        finally:
+            self._pending -= 1
+
+    async def map(self, method, items):
+        """Call `method` on every item, spread across the workers as one chunk per worker"""
+        items = list(items)
+        chunks = [items[i::self.workers] for i in range(min(self.workers, len(items)))]
+        if self._pending + len(chunks) > self.capacity:
+            raise PoolSaturated()
+
+        self._pending += len(chunks)
+        try:
+            loop = asyncio.get_running_loop()
+            chunk_results = await asyncio.gather(*[
+                loop.run_in_executor(self._executor, _call_detector_many, method, chunk)
+                for chunk in chunks
+            ])
+        finally:
+            self._pending -= len(chunks)
+
+        # Undo the round-robin split so results line up with `items`
+        results = [None] * len(items)
+        for i, chunk_result in enumerate(chunk_results):
+            results[i::self.workers] = chunk_result
+        return results
@@ -1,12 +1,49 @@
-from fastapi import FastAPI, UploadFile, File
+import asyncio
+import base64
+import json
+import logging
+import os
+import secrets
+import time
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request, Response, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-import cv2
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field, field_validator
+from starlette.concurrency import run_in_threadpool
 import numpy as np
-import mediapipe as mp
-import pandas as pd
-import pickle
 from typing import List, Optional
 from face_shape_recommendations import FACE_SHAPE_RECOMMENDATIONS, FRAME_STYLE_CHARACTERISTICS
+from catalog_index import SORT_KEYS, CatalogIndex
+from catalog_store import CATALOG_POLL_SECONDS, CATALOG_STORE, open_catalog_store
+from cnn_classifier import CASCADE_THRESHOLD, CNN_MODEL_PATH
+from face_features import NO_FACE, features_from_coords
+from frame_embeddings import load_frame_embeddings
+from image_store import ImageStore, blob_response, decode_data_uri, ingest_inline_images
+from materialized_responses import MaterializedResponses
+from inference_pool import INFERENCE_WORKERS, InferencePool, PoolSaturated
+from metrics import (
+    CATALOG_STAGE_SECONDS, DETECT_RESULTS, DETECT_STAGE_SECONDS,
+    CallbackMetric, MetricsMiddleware, StageClock, registry
+)
+from result_cache import DetectionCache, content_key, perceptual_hash
+from runtime_probe import configure_blas, describe, runtime_config
+
+# Catalog endpoints only need numpy. cv2, mediapipe and the model load on first use
+# or in a background warm-up, depending on MAGDA_ML_STARTUP: eager, background or lazy
+ML_STARTUP = os.environ.get('MAGDA_ML_STARTUP', 'background')
+
+CATALOG_PATH = os.environ.get('MAGDA_CATALOG_PATH', 'stock.csv')
+MAX_BATCH_SIZE = int(os.environ.get('MAGDA_MAX_BATCH_SIZE', 32))
+MAX_PAGE_SIZE = int(os.environ.get('MAGDA_MAX_PAGE_SIZE', 1000))
+MAX_SIMILAR = int(os.environ.get('MAGDA_MAX_SIMILAR', 100))
+MAX_STREAMS = int(os.environ.get('MAGDA_MAX_STREAMS', INFERENCE_WORKERS))
+# Bearer token for POST /catalog; unset disables catalog updates over HTTP
+CATALOG_TOKEN = os.environ.get('MAGDA_CATALOG_TOKEN')
+
+logger = logging.getLogger(__name__)
+
+# Cap BLAS threads to one worker's share of the CPUs, here and in process-mode workers
+configure_blas()
 
 app = FastAPI()
 
@@ -17,85 +54,200 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing", "X-Profile"],
 )
+# Request timings, in-flight count and the X-Profile sampling hook, served on /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Load the stock data, move inline images out to the blob store and build the filter index.
+# Updates build a new index snapshot off the event loop and swap it in with one assignment
+catalog_load_start = time.perf_counter()
+image_store = ImageStore()
+catalog_store = open_catalog_store(path=CATALOG_PATH)
+
+def load_catalog_records():
+    records = catalog_store.load()
+    ingest_inline_images(records, image_store)
+    return records
+
+catalog_fingerprint = catalog_store.fingerprint()
+catalog = CatalogIndex(load_catalog_records())
+catalog_load_ms = (time.perf_counter() - catalog_load_start) * 1000
+catalog_version = 0
+# Serializes store writes, reloads and snapshot swaps
+catalog_lock = asyncio.Lock()
+catalog_watcher = None
+
+# /filters and unparameterized /matching-frames bodies, encoded on first request per catalog snapshot
+materialized = MaterializedResponses(catalog, FACE_SHAPE_RECOMMENDATIONS)
+
+# Image embeddings from build_frame_embeddings.py, lined up with each catalog snapshot
+frame_embeddings = load_frame_embeddings()
+similar_frames = frame_embeddings.bind(catalog) if frame_embeddings else None
+
+def current_materialized():
+    """Materialized responses for the live catalog; a new snapshot or recommendation table starts empty"""
+    global materialized
+    if not materialized.is_current(catalog, FACE_SHAPE_RECOMMENDATIONS):
+        materialized = MaterializedResponses(catalog, FACE_SHAPE_RECOMMENDATIONS)
+    return materialized
 
-# Load the stock data
-df = pd.read_csv('stock.csv')
+async def apply_catalog_changes(upserts, deletes, commit=None):
+    """Build the next snapshot and everything derived from it in the threadpool, then swap them in.
 
-# Initialize face mesh
-mp_face_mesh = mp.solutions.face_mesh
-face_mesh = mp_face_mesh.FaceMesh(
-    static_image_mode=True,
-    max_num_faces=1,
-    min_detection_confidence=0.5
+    `commit`, if given, is awaited once they are built and before the swap, so
+    a batch that fails to build never reaches it. The store's fingerprint is
+    recorded after it, so the watcher doesn't reload our own write. Callers
+    hold catalog_lock.
+    Handlers never await between reads of `catalog`, so every request sees
+    exactly one snapshot, old or new.
+    """
+    global catalog, similar_frames, catalog_version, catalog_fingerprint
+    start = time.perf_counter()
+    snapshot = await run_in_threadpool(catalog.apply, upserts, deletes)
+    similar = None
+    if snapshot is not catalog and frame_embeddings:
+        similar = await run_in_threadpool(frame_embeddings.bind, snapshot)
+    if commit is not None:
+        await commit()
+        catalog_fingerprint = await run_in_threadpool(catalog_store.fingerprint)
+    if snapshot is catalog:
+        return
+    catalog, similar_frames = snapshot, similar
+    catalog_version += 1
+    logger.info("Catalog version %d: %d upserted, %d deleted, %d rows (%.0f ms)", catalog_version,
+                len(upserts), len(deletes), len(catalog), (time.perf_counter() - start) * 1000)
+
+async def watch_catalog():
+    """Poll the catalog store and apply whatever changed since the last look"""
+    global catalog_fingerprint
+    while True:
+        await asyncio.sleep(CATALOG_POLL_SECONDS)
+        try:
+            async with catalog_lock:
+                fingerprint = await run_in_threadpool(catalog_store.fingerprint)
+                if fingerprint == catalog_fingerprint:
+                    continue
+                catalog_fingerprint = fingerprint
+                records = await run_in_threadpool(load_catalog_records)
+                upserts, deletes = await run_in_threadpool(catalog.diff, records)
+                await apply_catalog_changes(upserts, deletes)
+        except Exception:
+            logger.exception("Reloading the catalog failed")
+
+# Face detection runs on a pool of workers, each with its own FaceMesh and model
+inference_pool = InferencePool()
+
+# Recent /detect-face responses, keyed by image content (and optionally perceptual hash)
+detection_cache = DetectionCache()
+
+# State that already keeps its own counts is read when /metrics is scraped
+CallbackMetric(
+    registry, 'magda_detect_cache_lookups_total', '/detect-face result cache lookups by outcome',
+    lambda: {(outcome,): detection_cache.stats()[outcome] for outcome in ('hits', 'near_hits', 'misses')},
+    type='counter', labelnames=('outcome',)
 )
+CallbackMetric(registry, 'magda_inference_pending', 'Face detection calls running or queued on the worker pool',
+               lambda: inference_pool.pending)
+CallbackMetric(registry, 'magda_streams_active', 'Open /ws/detect connections', lambda: active_streams)
+CallbackMetric(registry, 'magda_catalog_rows', 'Frames in the live catalog snapshot', lambda: len(catalog))
+CallbackMetric(registry, 'magda_catalog_version', 'Catalog snapshots swapped in since startup',
+               lambda: catalog_version, type='counter')
 
-# Load the trained model and scaler
-with open('face_shape_model.pkl', 'rb') as f:
-    clf, scaler = pickle.load(f)
-
-def extract_features(landmarks):
-    """Extract meaningful features from facial landmarks"""
-    features = []
-    
-    # Face height (forehead to chin)
-    face_height = landmarks.landmark[152].y - landmarks.landmark[10].y
-    
-    # Face width (temple to temple)
-    face_width = landmarks.landmark[454].x - landmarks.landmark[234].x
-    
-    # Jaw width
-    jaw_width = landmarks.landmark[172].x - landmarks.landmark[397].x
-    
-    # Cheekbone width
-    cheekbone_width = landmarks.landmark[123].x - landmarks.landmark[352].x
-    
-    # Forehead width
-    forehead_width = landmarks.landmark[109].x - landmarks.landmark[338].x
-    
-    # Calculate ratios
-    features.extend([
-        face_height / face_width,  # Height to width ratio
-        jaw_width / face_width,    # Jaw to face width ratio
-        cheekbone_width / jaw_width,  # Cheekbone to jaw ratio
-        forehead_width / jaw_width,   # Forehead to jaw ratio
-    ])
-    
-    return features
-
-def detect_face_shape(image_data: bytes) -> str:
-    # Convert bytes to numpy array
-    nparr = np.frombuffer(image_data, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    
-    # Convert to RGB
-    rgb_image = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    
-    # Process the image
-    results = face_mesh.process(rgb_image)
-    
-    if not results.multi_face_landmarks:
-        return "No face detected"
-    
-    landmarks = results.multi_face_landmarks[0]
-    
-    # Extract features
-    features = extract_features(landmarks)
-    
-    # Scale features
-    features_scaled = scaler.transform([features])
-    
-    # Predict face shape
-    face_shape = clf.predict(features_scaled)[0]
-    
-    return face_shape
+async def warm_up_inference_pool():
+    try:
+        await inference_pool.ensure_started()
+    except Exception:
+        logger.exception("Background warm-up of the inference pool failed")
 
-@app.post("/detect-face")
-async def detect_face(file: UploadFile = File(...)):
-    contents = await file.read()
-    face_shape = detect_face_shape(contents)
+@app.on_event("startup")
+async def log_runtime_config():
+    # uvicorn's own logger, so the line shows up next to its start-up messages
+    logging.getLogger('uvicorn.error').info("Runtime: %s", describe())
+
+@app.on_event("startup")
+async def start_inference_pool():
+    if ML_STARTUP == 'eager':
+        await inference_pool.ensure_started()
+    elif ML_STARTUP == 'background':
+        asyncio.create_task(warm_up_inference_pool())
+
+@app.on_event("startup")
+async def start_catalog_watcher():
+    global catalog_watcher
+    if catalog_store.watch and CATALOG_POLL_SECONDS > 0:
+        catalog_watcher = asyncio.create_task(watch_catalog())
+
+@app.on_event("shutdown")
+def stop_inference_pool():
+    inference_pool.shutdown()
+
+@app.on_event("shutdown")
+def stop_catalog_watcher():
+    if catalog_watcher is not None:
+        catalog_watcher.cancel()
+
+async def require_inference_pool():
+    """Start the pool on first use; a failed start-up becomes a 503 rather than a 500"""
+    try:
+        await inference_pool.ensure_started()
+    except Exception:
+        logger.exception("Inference pool failed to start")
+        raise HTTPException(
+            status_code=503,
+            detail="Face detection is unavailable",
+            headers={"Retry-After": "5"}
+        )
+
+@app.get("/ready")
+async def get_readiness():
+    """Report which components are loaded; catalog endpoints are ready as soon as this answers"""
+    return {
+        "startup_mode": ML_STARTUP,
+        "runtime": runtime_config(),
+        "catalog": {
+            "loaded": True,
+            "store": CATALOG_STORE,
+            "rows": len(catalog),
+            "version": catalog_version,
+            "load_ms": round(catalog_load_ms, 2),
+            "materialized": current_materialized().stats(),
+            "embedded_frames": int(similar_frames.live.sum()) if similar_frames else 0,
+        },
+        "inference_pool": {
+            "state": inference_pool.state,
+            "mode": inference_pool.mode,
+            "workers": inference_pool.workers,
+            "error": inference_pool.error,
+        },
+        "cascade": {
+            "threshold": CASCADE_THRESHOLD,
+            "cnn_available": cascade_enabled(),
+        },
+        "stream_model": {
+            "loaded": stream_model is not None,
+        },
+    }
+
+def pool_busy():
+    return HTTPException(
+        status_code=503,
+        detail="Face detection is busy, please retry",
+        headers={"Retry-After": "1"}
+    )
+
+def server_timing(timings):
+    return ", ".join(f"{stage};dur={ms:.2f}" for stage, ms in timings.items())
+
+def cascade_enabled():
+    """Whether workers escalate uncertain faces to the CNN; they load it only if the export exists"""
+    return CASCADE_THRESHOLD > 0 and os.path.exists(CNN_MODEL_PATH)
+
+def face_shape_response(face_shape: str, confidence: float, path: str):
     return {
         "face_shape": face_shape,
+        "confidence": confidence,
+        "path": path,
         "recommended_styles": FACE_SHAPE_RECOMMENDATIONS.get(face_shape, []),
         "style_info": {
             style: FRAME_STYLE_CHARACTERISTICS[style]
@@ -104,72 +256,361 @@ async def detect_face(file: UploadFile = File(...)):
         }
     }
 
+@app.post("/detect-face")
+async def detect_face(file: UploadFile = File(...)):
+    clock = StageClock(DETECT_STAGE_SECONDS)
+    contents = await file.read()
+    clock.mark('read')
+
+    key = content_key(contents)
+    phash = None
+    if detection_cache.uses_phash:
+        # Reduced-size grayscale decode, cheap next to the mesh but still kept off the event loop
+        phash = await run_in_threadpool(perceptual_hash, contents)
+    cached = detection_cache.get(key, phash)
+    clock.mark('cache')
+    if cached is not None:
+        return cached
+
+    await require_inference_pool()
+    try:
+        analysis = await inference_pool.run('analyze', contents)
+    except PoolSaturated:
+        raise pool_busy()
+    # Queueing plus the worker's own stages, which are recorded individually below
+    clock.mark('inference')
+    DETECT_STAGE_SECONDS.observe_ms(analysis["timings"])
+    DETECT_RESULTS.inc((analysis["path"],))
+
+    result = face_shape_response(analysis["face_shape"], analysis["confidence"], analysis["path"])
+    detection_cache.put(key, result, phash)
+    clock.mark('respond')
+    # Per-stage timings go in a Server-Timing header so cached bodies stay identical
+    return JSONResponse(result, headers={"Server-Timing": server_timing(analysis["timings"])})
+
+# Webcam streams each get their own tracking FaceMesh but share one read-only (clf, scaler)
+active_streams = 0
+stream_model = None
+
+def load_stream_model():
+    """Import the cv2/mediapipe stack and load the shared model; slow, so it runs in the threadpool"""
+    # Imported here only so that the import cost lands in the threadpool too
+    import stream_detection
+    from face_detection import load_model
+
+    return load_model()
+
+@app.websocket("/ws/detect")
+async def ws_detect(websocket: WebSocket):
+    """Send JPEG frames as binary messages, receive smoothed face-shape decisions as JSON"""
+    global active_streams, stream_model
+    await websocket.accept()
+    if active_streams >= MAX_STREAMS:
+        # 1013: try again later
+        await websocket.close(code=1013)
+        return
+
+    active_streams += 1
+    try:
+        # Deferred so catalog-only workers never import cv2 and mediapipe
+        if stream_model is None:
+            stream_model = await run_in_threadpool(load_stream_model)
+        # Already imported by load_stream_model
+        from stream_detection import serve_stream
+
+        await serve_stream(websocket, stream_model)
+    finally:
+        active_streams -= 1
+
+@app.get("/detect-face/cache")
+async def get_detection_cache_stats():
+    """Hit/miss counters and size of the detection result cache"""
+    return detection_cache.stats()
+
+@app.post("/detect-face-batch")
+async def detect_face_batch(files: List[UploadFile] = File(...)):
+    """Detect face shapes for several images with a single classifier call"""
+    if len(files) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {MAX_BATCH_SIZE} images per batch"
+        )
+
+    contents = [await file.read() for file in files]
+    keys = [content_key(data) for data in contents]
+    results = [detection_cache.get(key) for key in keys]
+    pending = [i for i, result in enumerate(results) if result is None]
+    if pending:
+        await require_inference_pool()
+
+    try:
+        # Decode and run the mesh in parallel across the workers
+        landmarks = await inference_pool.map('landmarks', [contents[i] for i in pending])
+
+        decisions = [(NO_FACE, 0.0, 'no_face')] * len(pending)
+        found = [j for j, coords in enumerate(landmarks) if coords is not None]
+        if found:
+            # One (N, 468, 3) array -> one (N, 4) feature matrix -> one predict call
+            coords = np.stack([landmarks[j] for j in found])
+            predictions = await inference_pool.run('classify_with_confidence', features_from_coords(coords))
+            for j, (face_shape, confidence) in zip(found, predictions):
+                decisions[j] = (face_shape, confidence, 'landmarks')
+
+            uncertain = [j for j in found if decisions[j][1] < CASCADE_THRESHOLD] if cascade_enabled() else []
+            if uncertain:
+                # Only the uncertain images pay for the CNN, spread across the workers
+                cnn_predictions = await inference_pool.map('classify_cnn', [contents[pending[j]] for j in uncertain])
+                for j, prediction in zip(uncertain, cnn_predictions):
+                    # Workers without the CNN leave the landmark decision in place
+                    if prediction is not None:
+                        decisions[j] = (*prediction, 'cnn')
+    except PoolSaturated:
+        raise pool_busy()
+
+    for i, decision in zip(pending, decisions):
+        DETECT_RESULTS.inc((decision[2],))
+        results[i] = face_shape_response(*decision)
+        detection_cache.put(keys[i], results[i])
+
+    return [
+        {"filename": file.filename, **result}
+        for file, result in zip(files, results)
+    ]
+
+def encode_cursor(sort: Optional[str], key) -> str:
+    # The last row's sort value and insertion sequence, so the next page is found by value
+    return base64.urlsafe_b64encode(json.dumps([sort or '', key]).encode()).decode()
+
+def decode_cursor(cursor: str, sort: Optional[str]):
+    try:
+        cursor_sort, key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if cursor_sort != (sort or ''):
+        raise HTTPException(status_code=400, detail="Cursor was issued for a different sort order")
+    try:
+        if sort is None:
+            return int(key)
+        value, sequence = key
+        return (str(value) if sort.lstrip('-') == 'brand' else float(value), int(sequence))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_fields(fields):
+    if fields is None:
+        return None
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in catalog.fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+def catalog_response(rows, response: Response, sort, cursor, limit, fields, format, clock):
+    """Sort, paginate, project and serialize a set of catalog rows"""
+    fields = parse_fields(fields)
+    after = decode_cursor(cursor, sort) if cursor else None
+    rows, next_key = catalog.page(rows, sort=sort, after=after, limit=limit)
+    clock.mark('page')
+    headers = {}
+    if next_key is not None:
+        headers["X-Next-Cursor"] = encode_cursor(sort, next_key)
+
+    if format == 'ndjson':
+        lines = (json.dumps(record) + '\n' for record in catalog.iter_records(rows, fields))
+        return StreamingResponse(lines, media_type='application/x-ndjson', headers=headers)
+
+    response.headers.update(headers)
+    records = catalog.get_records(rows, fields)
+    clock.mark('records')
+    return records
+
+# Query parameters shared by the catalog listing endpoints
+SortParam = Query(None, pattern=f"^({'|'.join(SORT_KEYS)})$", description="price, -price, brand or -brand")
+LimitParam = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size; omit for all results")
+CursorParam = Query(None, description="X-Next-Cursor value from the previous page")
+FieldsParam = Query(None, description="Comma-separated list of fields to return")
+FormatParam = Query('json', pattern="^(json|ndjson)$", description="json, or ndjson to stream one record per line")
+
 @app.get("/matching-frames/{face_shape}")
 async def get_matching_frames(
     face_shape: str,
+    request: Request,
+    response: Response,
     gender: Optional[str] = None,
-    age_group: Optional[str] = None
+    age_group: Optional[str] = None,
+    sort: Optional[str] = SortParam,
+    limit: Optional[int] = LimitParam,
+    cursor: Optional[str] = CursorParam,
+    fields: Optional[str] = FieldsParam,
+    format: str = FormatParam
 ):
+    current = current_materialized()
+    materialize = (sort is None and limit is None and cursor is None and fields is None and format == 'json'
+                   and current.covers(face_shape, gender, age_group))
+    if materialize:
+        key = ('matching_frames', face_shape, gender, age_group)
+        cached = current.response(key, request.headers.get('if-none-match'))
+        if cached is not None:
+            return cached
+
+    clock = StageClock(CATALOG_STAGE_SECONDS, ('matching_frames',))
     recommended_styles = FACE_SHAPE_RECOMMENDATIONS.get(face_shape, [])
-    matching_frames = df[df['frame_shape'].isin(recommended_styles)]
-    
-    if gender:
-        matching_frames = matching_frames[
-            (matching_frames['gender'] == gender) | 
-            (matching_frames['gender'] == 'unisex')
-        ]
-    
-    if age_group:
-        matching_frames = matching_frames[matching_frames['age_group'] == age_group]
-        
-    return matching_frames.to_dict(orient='records')
+    rows = catalog.query(
+        frame_shapes=recommended_styles,
+        gender=gender,
+        age_group=age_group
+    )
+    clock.mark('query')
+    if materialize:
+        records = catalog.get_records(rows)
+        clock.mark('records')
+        return current.store(key, records, request.headers.get('if-none-match'))
+    return catalog_response(rows, response, sort, cursor, limit, fields, format, clock)
 
 @app.get("/frames")
 async def get_frames(
+    response: Response,
     shape: Optional[str] = None,
     min_price: Optional[float] = None,
     max_price: Optional[float] = None,
     brand: Optional[str] = None,
     gender: Optional[str] = None,
-    age_group: Optional[str] = None
+    age_group: Optional[str] = None,
+    sort: Optional[str] = SortParam,
+    limit: Optional[int] = LimitParam,
+    cursor: Optional[str] = CursorParam,
+    fields: Optional[str] = FieldsParam,
+    format: str = FormatParam
 ):
-    filtered_df = df.copy()
-    
+    clock = StageClock(CATALOG_STAGE_SECONDS, ('frames',))
+    frame_shapes = None
     if shape:
         if shape in FACE_SHAPE_RECOMMENDATIONS:
             # If a face shape is provided, get all recommended frame shapes
-            recommended_styles = FACE_SHAPE_RECOMMENDATIONS[shape]
-            filtered_df = filtered_df[filtered_df['frame_shape'].isin(recommended_styles)]
+            frame_shapes = FACE_SHAPE_RECOMMENDATIONS[shape]
         else:
             # If a specific frame shape is provided
-            filtered_df = filtered_df[filtered_df['frame_shape'] == shape]
-            
-    if min_price is not None:
-        filtered_df = filtered_df[filtered_df['price'] >= min_price]
-    if max_price is not None:
-        filtered_df = filtered_df[filtered_df['price'] <= max_price]
-    if brand:
-        filtered_df = filtered_df[filtered_df['brand'].str.lower() == brand.lower()]
-    if gender:
-        filtered_df = filtered_df[
-            (filtered_df['gender'] == gender) | 
-            (filtered_df['gender'] == 'unisex')
-        ]
-    if age_group:
-        filtered_df = filtered_df[filtered_df['age_group'] == age_group]
-        
-    return filtered_df.to_dict(orient='records')
+            frame_shapes = [shape]
+
+    rows = catalog.query(
+        frame_shapes=frame_shapes,
+        min_price=min_price,
+        max_price=max_price,
+        brand=brand,
+        gender=gender,
+        age_group=age_group
+    )
+    clock.mark('query')
+    return catalog_response(rows, response, sort, cursor, limit, fields, format, clock)
+
+@app.get("/frames/{model}/similar")
+async def get_similar_frames(
+    model: str,
+    brand: Optional[str] = None,
+    gender: Optional[str] = None,
+    age_group: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    limit: int = Query(12, ge=1, le=MAX_SIMILAR),
+    fields: Optional[str] = FieldsParam
+):
+    """Frames that look most like `model`, best match first, optionally filtered like /frames"""
+    if similar_frames is None:
+        raise HTTPException(status_code=503, detail="Similar frames are unavailable until build_frame_embeddings.py has run")
+    clock = StageClock(CATALOG_STAGE_SECONDS, ('similar',))
+    fields = parse_fields(fields)
+    matches = similar_frames.find(model, brand)
+    if not matches:
+        raise HTTPException(status_code=404, detail="No embedded frame with that model")
+    if len(matches) > 1:
+        raise HTTPException(status_code=400, detail="Several brands sell that model; pass brand")
+
+    rows = None
+    if gender or age_group or min_price is not None or max_price is not None:
+        rows = catalog.query(min_price=min_price, max_price=max_price, gender=gender, age_group=age_group)
+    clock.mark('query')
+    rows, scores = similar_frames.similar(matches[0], limit, rows)
+    clock.mark('search')
+    records = [
+        {**record, "similarity": round(float(score), 4)}
+        for record, score in zip(catalog.get_records(rows, fields), scores)
+    ]
+    clock.mark('records')
+    return records
 
 @app.get("/filters")
-async def get_filters():
+async def get_filters(request: Request):
     """Get all available filter options"""
-    return {
-        "brands": df['brand'].unique().tolist(),
-        "frame_shapes": df['frame_shape'].unique().tolist(),
-        "genders": df['gender'].unique().tolist(),
-        "age_groups": df['age_group'].unique().tolist(),
-        "price_range": {
-            "min": float(df['price'].min()),
-            "max": float(df['price'].max())
-        }
-    }
+    current = current_materialized()
+    if_none_match = request.headers.get('if-none-match')
+    cached = current.response(('filters',), if_none_match)
+    if cached is not None:
+        return cached
+    return current.store(('filters',), catalog.filter_options(), if_none_match)
+
+class Frame(BaseModel):
+    brand: str
+    model: str
+    frame_shape: str
+    price: float = Field(ge=0, allow_inf_nan=False)
+    gender: str
+    age_group: str
+    image_links: str = ''
+
+    @field_validator('image_links')
+    @classmethod
+    def check_inline_image(cls, value):
+        # A bad data: URI is a 422 here rather than a failure while ingesting
+        decode_data_uri(value)
+        return value
+
+class FrameKey(BaseModel):
+    brand: str
+    model: str
+
+class CatalogChanges(BaseModel):
+    upsert: List[Frame] = []
+    delete: List[FrameKey] = []
+
+@app.post("/catalog")
+async def update_catalog(changes: CatalogChanges, request: Request):
+    """Bulk upsert and delete frames by brand and model; deletes apply first.
+
+    The patched index is built first, then the store is written and the index
+    swapped in, so the changes are live when this returns and a batch the index
+    rejects never reaches the store. Requests keep being served throughout.
+    """
+    if not CATALOG_TOKEN:
+        raise HTTPException(status_code=403, detail="Catalog updates are disabled")
+    if not secrets.compare_digest(request.headers.get('authorization', ''), f"Bearer {CATALOG_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid catalog token", headers={"WWW-Authenticate": "Bearer"})
+    if catalog_store.read_only:
+        raise HTTPException(status_code=409, detail=f"The {CATALOG_STORE} catalog store is read-only")
+
+    upserts = [frame.model_dump() for frame in changes.upsert]
+    deletes = [(key.brand, key.model) for key in changes.delete]
+    # The store keeps the records as sent; the index gets inline images moved to the blob store
+    stored = [dict(record) for record in upserts]
+
+    async def write_store():
+        await run_in_threadpool(catalog_store.delete, deletes)
+        await run_in_threadpool(catalog_store.upsert, stored)
+
+    async with catalog_lock:
+        await run_in_threadpool(ingest_inline_images, upserts, image_store)
+        await apply_catalog_changes(upserts, deletes, commit=write_store)
+    return {"upserted": len(upserts), "deleted": len(deletes), "rows": len(catalog), "version": catalog_version}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of request, stage and cache metrics"""
+    return Response(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/frame-images/{image_hash}")
+async def get_frame_image(image_hash: str, request: Request):
+    """Serve a catalog image from the content-addressed blob store"""
+    blob = image_store.get(image_hash)
+    if blob is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    path, media_type = blob
+    return blob_response(image_hash, path, media_type, request.headers)
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+
+from fastapi.responses import Response
+
+# Upper bound on the pre-serialized bodies kept in memory; bodies past it are encoded per request
+MATERIALIZE_MAX_BYTES = int(os.environ.get('MAGDA_MATERIALIZE_MAX_BYTES', 64 * 1024 * 1024))
+# Bodies larger than this are never kept, so a few huge unfiltered lists can't crowd out the rest
+MATERIALIZE_MAX_BODY_BYTES = int(os.environ.get('MAGDA_MATERIALIZE_MAX_BODY_BYTES', 2 * 1024 * 1024))
+MATERIALIZE_MAX_ENTRIES = int(os.environ.get('MAGDA_MATERIALIZE_MAX_ENTRIES', 1024))
+
+# Rough per-entry cost of the key, ETag and dict slot on top of the body
+ENTRY_OVERHEAD = 512
+
+
+def serialize(content) -> bytes:
+    """Encode exactly as FastAPI's JSONResponse would"""
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(',', ':')).encode('utf-8')
+
+
+def tables_digest(*tables) -> str:
+    """Fingerprint of the static lookup tables the materialized bodies were built from"""
+    return hashlib.sha256(json.dumps(tables, sort_keys=True).encode()).hexdigest()
+
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match uses the weak comparison, so W/ prefixes are ignored"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+
+
+class MaterializedResponses:
+    """Pre-serialized bodies and strong ETags for /filters and unparameterized /matching-frames.
+
+    One per catalog snapshot, empty to begin with. The first request for a
+    combination encodes it through `store`, and later requests are a dict
+    lookup. `is_current` tells callers when to start a new one.
+    """
+
+    def __init__(self, catalog, recommendations, max_bytes=MATERIALIZE_MAX_BYTES,
+                 max_body_bytes=MATERIALIZE_MAX_BODY_BYTES, max_entries=MATERIALIZE_MAX_ENTRIES):
+        self.catalog = catalog
+        self.digest = tables_digest(recommendations)
+        self.max_bytes = max_bytes
+        self.max_body_bytes = max_body_bytes
+        self.max_entries = max_entries
+        self.face_shapes = set(recommendations)
+        self.genders = {None, *catalog.distinct('gender')}
+        self.age_groups = {None, *catalog.distinct('age_group')}
+        self.bodies = {}  # key -> (body, etag)
+        self.size = 0
+        self.skipped = 0
+
+    def covers(self, face_shape, gender, age_group):
+        """Whether a /matching-frames combination may be kept: only values the catalog has, so
+        made-up query strings can't grow the cache"""
+        return face_shape in self.face_shapes and gender in self.genders and age_group in self.age_groups
+
+    def store(self, key, content, if_none_match):
+        """Encode `content`, keep it for `key` if it fits the caps, and return the response"""
+        body = serialize(content)
+        size = len(body) + ENTRY_OVERHEAD
+        if (len(body) > self.max_body_bytes or self.size + size > self.max_bytes
+                or len(self.bodies) >= self.max_entries):
+            self.skipped += 1
+            return Response(body, media_type='application/json')
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        self.bodies[key] = (body, etag)
+        self.size += size
+        return self.response(key, if_none_match)
+
+    def is_current(self, catalog, recommendations):
+        return catalog is self.catalog and tables_digest(recommendations) == self.digest
+
+    def response(self, key, if_none_match):
+        """A 200 or 304 for `key`, or None if that combination isn't materialized"""
+        entry = self.bodies.get(key)
+        if entry is None:
+            return None
+        body, etag = entry
+        # no-cache: browsers keep the body but revalidate, so catalog updates show up immediately
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type='application/json', headers=headers)
+
+    def stats(self):
+        return {"responses": len(self.bodies), "bytes": self.size, "skipped": self.skipped}
@@ -0,0 +1,283 @@
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import Counter as Tally
+
+from starlette.concurrency import run_in_threadpool
+
+# Requests carrying this header value are profiled; unset disables profiling
+PROFILE_TOKEN = os.environ.get('MAGDA_PROFILE_TOKEN')
+PROFILE_HEADER = b'x-profile'
+PROFILE_DIR = os.environ.get('MAGDA_PROFILE_DIR', 'profiles')
+PROFILE_INTERVAL = float(os.environ.get('MAGDA_PROFILE_INTERVAL', 0.005))
+
+# Latency buckets in seconds, from sub-millisecond catalog lookups to multi-second CNN batches
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    """Base for metrics in the Prometheus text format.
+
+    Updated only from the event loop thread (worker timings come back with
+    their results), so there is no locking on the hot path.
+    """
+
+    type = 'untyped'
+
+    def __init__(self, registry, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    def samples(self):
+        """Yield (suffix, labelvalues, extra_label, value)"""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for suffix, labelvalues, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_labels(self.labelnames, labelvalues, extra)} {_number(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, registry, name, help, labelnames=()):
+        super().__init__(registry, name, help, labelnames)
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield '', labels, '', value
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+
+class CallbackMetric(Metric):
+    """Counter or gauge read from existing state when /metrics is scraped.
+
+    `callback` returns a number, or a dict of labelvalues tuple -> number.
+    """
+
+    def __init__(self, registry, name, help, callback, type='gauge', labelnames=()):
+        self.type = type
+        self.callback = callback
+        super().__init__(registry, name, help, labelnames)
+
+    def samples(self):
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            yield '', labels, '', value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, registry, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {}  # labels -> [per-bucket counts (+Inf last), sum]
+
+    def observe(self, value, labels=()):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def observe_ms(self, timings, labels=()):
+        """Record a StageTimer-style {stage: ms} dict, one series per stage"""
+        for stage, ms in timings.items():
+            self.observe(ms / 1000, labels + (stage,))
+
+    def samples(self):
+        for labels, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield '_bucket', labels, f'le="{le}"', cumulative
+            yield '_sum', labels, '', total
+            yield '_count', labels, '', cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+class StageClock:
+    """Observe the time since the previous mark into a histogram, labelled by stage"""
+
+    def __init__(self, histogram, labels=()):
+        self.histogram = histogram
+        self.labels = labels
+        self.last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.histogram.observe(now - self.last, self.labels + (stage,))
+        self.last = now
+
+
+registry = Registry()
+
+REQUEST_SECONDS = Histogram(
+    registry, 'magda_http_request_duration_seconds',
+    'Time from request start to the last response byte', ('route', 'method', 'status')
+)
+REQUESTS_IN_FLIGHT = Gauge(registry, 'magda_http_requests_in_flight', 'HTTP requests being handled')
+DETECT_STAGE_SECONDS = Histogram(
+    registry, 'magda_detect_stage_duration_seconds',
+    'Time per /detect-face stage: read, then decode to classify or cnn in a worker, then respond', ('stage',)
+)
+DETECT_RESULTS = Counter(
+    registry, 'magda_detect_results_total',
+    'Fresh face-shape decisions by the path that made them (landmarks, cnn or no_face)', ('path',)
+)
+CATALOG_STAGE_SECONDS = Histogram(
+    registry, 'magda_catalog_stage_duration_seconds',
+    'Time per catalog endpoint stage; JSON encoding is the remainder of the request time',
+    ('endpoint', 'stage')
+)
+
+
+class SamplingProfiler:
+    """Samples the Python stack of every other thread at a fixed interval until stopped"""
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = Tally()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='magda-profiler', daemon=True)
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, path):
+        """Write collapsed stacks (one `frame;frame;... count` line each), flamegraph.pl format"""
+        self._stop.set()
+        self._thread.join()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by route template, method and status class.
+
+    Requests sending `X-Profile: <MAGDA_PROFILE_TOKEN>` are also sampled by a
+    SamplingProfiler; the response's X-Profile header names the file written
+    under MAGDA_PROFILE_DIR once the response is complete.
+    """
+
+    def __init__(self, app, profile_token=PROFILE_TOKEN, profile_dir=PROFILE_DIR):
+        self.app = app
+        self.profile_token = profile_token.encode() if profile_token else None
+        self.profile_dir = profile_dir
+        self._route_paths = {}
+
+    def _route(self, scope):
+        endpoint = scope.get('endpoint')
+        if endpoint is None:
+            # Unmatched paths share one label so scanners can't blow up the series count
+            return 'unmatched'
+        path = self._route_paths.get(endpoint)
+        if path is None:
+            routes = getattr(scope.get('app'), 'routes', ())
+            path = next((route.path for route in routes if getattr(route, 'endpoint', None) is endpoint), scope['path'])
+            self._route_paths[endpoint] = path
+        return path
+
+    def _profile_path(self, scope):
+        if self.profile_token is None:
+            return None
+        for name, value in scope['headers']:
+            if name == PROFILE_HEADER and value == self.profile_token:
+                return os.path.join(self.profile_dir, f'profile-{time.strftime("%Y%m%d-%H%M%S")}-{time.monotonic_ns()}.txt')
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+        profile_path = self._profile_path(scope)
+        profiler = SamplingProfiler().start() if profile_path else None
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if profile_path:
+                    message['headers'] = list(message.get('headers', [])) + [
+                        (b'x-profile', os.path.basename(profile_path).encode())
+                    ]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                (self._route(scope), scope['method'], f'{status // 100}xx')
+            )
+            if profiler:
+                # Joining the sampler and writing the file would otherwise block the event loop
+                await run_in_threadpool(profiler.stop, profile_path)
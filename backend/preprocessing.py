@@ -0,0 +1,179 @@
+import os
+import time
+
+import cv2
+import numpy as np
+import mediapipe as mp
+
+# Longest image side handed to FaceMesh; 0 (the default) disables downscaling.
+# Turn it on once tests/test_preprocessing.py agrees with full resolution on your reference images
+MAX_IMAGE_SIDE = int(os.environ.get('MAGDA_MAX_IMAGE_SIDE', 0))
+# Run a cheap face detector first and mesh only the face crop
+FACE_CROP = os.environ.get('MAGDA_FACE_CROP', '0') == '1'
+# Extra context kept around the detected face box, as a fraction of its size
+FACE_CROP_MARGIN = 0.4
+
+# JPEG start-of-frame markers carry the image dimensions (C4, C8 and CC are not SOF)
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+class StageTimer:
+    """Collects per-stage wall-clock timings in milliseconds"""
+
+    def __init__(self):
+        self.timings = {}
+        self._last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0.0) + (now - self._last) * 1000
+        self._last = now
+
+
+def jpeg_size(data: bytes):
+    """Read (width, height) from a JPEG header without decoding, or None if not a JPEG"""
+    if data[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            # Standalone markers have no length field
+            i += 2
+            continue
+        if marker in SOF_MARKERS:
+            height = int.from_bytes(data[i + 5:i + 7], 'big')
+            width = int.from_bytes(data[i + 7:i + 9], 'big')
+            return width, height
+        if marker == 0xDA:
+            # Start of scan before any frame header
+            return None
+        i += 2 + int.from_bytes(data[i + 2:i + 4], 'big')
+    return None
+
+
+def decode_flag(data: bytes, max_side: int):
+    """Pick the smallest JPEG reduced-size decode that still covers `max_side`"""
+    size = jpeg_size(data) if max_side else None
+    if size is None:
+        return cv2.IMREAD_COLOR
+    longest = max(size)
+    for factor, flag in REDUCED_DECODE_FLAGS:
+        if longest // factor >= max_side:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def decode_image(data: bytes, max_side=MAX_IMAGE_SIDE, timer=None):
+    """Decode to BGR at no more than `max_side` on the longest side, or None if undecodable"""
+    nparr = np.frombuffer(data, np.uint8)
+    img = cv2.imdecode(nparr, decode_flag(data, max_side))
+    if timer:
+        timer.mark('decode')
+    if img is None:
+        return None
+
+    if max_side and max(img.shape[:2]) > max_side:
+        scale = max_side / max(img.shape[:2])
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    if timer:
+        timer.mark('resize')
+    return img
+
+
+class FaceCropper:
+    """BlazeFace short-range detector used to crop the face before FaceMesh"""
+
+    def __init__(self, margin=FACE_CROP_MARGIN):
+        self.margin = margin
+        self.face_detection = mp.solutions.face_detection.FaceDetection(
+            model_selection=0,
+            min_detection_confidence=0.5
+        )
+
+    def crop(self, rgb_image):
+        """Return (crop, (x0, y0, crop_width, crop_height)), or None if no face is found"""
+        results = self.face_detection.process(rgb_image)
+        if not results.detections:
+            return None
+
+        height, width = rgb_image.shape[:2]
+        box = results.detections[0].location_data.relative_bounding_box
+        pad_x = box.width * self.margin
+        pad_y = box.height * self.margin
+        x0 = max(0, int((box.xmin - pad_x) * width))
+        y0 = max(0, int((box.ymin - pad_y) * height))
+        x1 = min(width, int(np.ceil((box.xmin + box.width + pad_x) * width)))
+        y1 = min(height, int(np.ceil((box.ymin + box.height + pad_y) * height)))
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return rgb_image[y0:y1, x0:x1], (x0, y0, x1 - x0, y1 - y0)
+
+
+def uncrop_landmarks(coords, box, width, height):
+    """Map (468, 3) landmarks normalized to a crop back to full-image normalized coordinates"""
+    x0, y0, crop_width, crop_height = box
+    mapped = np.empty_like(coords)
+    mapped[:, 0] = (coords[:, 0] * crop_width + x0) / width
+    mapped[:, 1] = (coords[:, 1] * crop_height + y0) / height
+    # FaceMesh z uses roughly the same scale as x
+    mapped[:, 2] = coords[:, 2] * crop_width / width
+    return mapped
+
+
+def verify(directory, max_side=MAX_IMAGE_SIDE, face_crop=FACE_CROP):
+    """Compare predictions of the fast path against full-resolution decoding on a reference set"""
+    from face_detection import FaceShapeDetector
+
+    reference = FaceShapeDetector(max_side=0, face_crop=False)
+    fast = FaceShapeDetector(max_side=max_side, face_crop=face_crop)
+
+    paths = sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(directory)
+        for name in names
+        if name.lower().endswith(('.jpg', '.jpeg', '.png'))
+    )
+    mismatches = []
+    totals = {'reference': {}, 'fast': {}}
+    for path in paths:
+        with open(path, 'rb') as f:
+            data = f.read()
+        expected = reference.analyze(data)
+        actual = fast.analyze(data)
+        for name, result in (('reference', expected), ('fast', actual)):
+            for stage, ms in result['timings'].items():
+                totals[name][stage] = totals[name].get(stage, 0.0) + ms
+        if expected['face_shape'] != actual['face_shape']:
+            mismatches.append((path, expected['face_shape'], actual['face_shape']))
+
+    print(f"Images: {len(paths)}, max_side={max_side}, face_crop={face_crop}")
+    for name, stages in totals.items():
+        mean = {stage: round(ms / max(1, len(paths)), 2) for stage, ms in stages.items()}
+        print(f"{name} mean ms/stage: {mean} (total {round(sum(mean.values()), 2)})")
+    for path, expected, actual in mismatches:
+        print(f"MISMATCH {path}: {expected} -> {actual}")
+    print(f"Agreement: {len(paths) - len(mismatches)}/{len(paths)}")
+    return not mismatches
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check that fast-path preprocessing keeps predictions unchanged")
+    parser.add_argument('directory', help="Folder of reference face images, e.g. 'FaceShape Dataset/testing_set'")
+    parser.add_argument('--max-side', type=int, default=MAX_IMAGE_SIDE)
+    parser.add_argument('--face-crop', action='store_true', default=FACE_CROP)
+    args = parser.parse_args()
+    raise SystemExit(0 if verify(args.directory, args.max_side, args.face_crop) else 1)
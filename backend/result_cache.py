@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Cache configuration, overridable from the environment
+CACHE_MAX_ENTRIES = int(os.environ.get('MAGDA_CACHE_MAX_ENTRIES', 1024))
+CACHE_MAX_BYTES = int(os.environ.get('MAGDA_CACHE_MAX_BYTES', 8 * 1024 * 1024))
+CACHE_TTL = float(os.environ.get('MAGDA_CACHE_TTL', 300))
+# Max Hamming distance between perceptual hashes to count as the same image; unset disables it
+CACHE_PHASH_DISTANCE = os.environ.get('MAGDA_CACHE_PHASH_DISTANCE')
+
+# Rough per-entry bookkeeping cost on top of the serialized value
+ENTRY_OVERHEAD = 256
+
+
+def content_key(image_data: bytes) -> str:
+    return hashlib.sha256(image_data).hexdigest()
+
+
+def perceptual_hash(image_data: bytes):
+    """64-bit difference hash of a downscaled grayscale image, or None if it can't be decoded"""
+    import cv2
+
+    nparr = np.frombuffer(image_data, np.uint8)
+    img = cv2.imdecode(nparr, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if img is None:
+        return None
+    small = cv2.resize(img, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class DetectionCache:
+    """LRU + TTL cache of /detect-face responses keyed by content hash.
+
+    With `phash_distance` set, a miss on the exact key falls back to the most
+    recent entry whose perceptual hash is within that Hamming distance.
+    Only used from the event loop thread, so no locking.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES,
+                 ttl=CACHE_TTL, phash_distance=CACHE_PHASH_DISTANCE, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.phash_distance = None if phash_distance in (None, '') else int(phash_distance)
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (value, size, expires_at, phash)
+        self.size = 0
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def uses_phash(self):
+        return self.phash_distance is not None
+
+    def _drop(self, key):
+        _, size, _, _ = self._entries.pop(key)
+        self.size -= size
+
+    def get(self, key, phash=None):
+        entry = self._entries.get(key)
+        now = self.clock()
+        if entry is not None:
+            if entry[2] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self._drop(key)
+
+        if phash is not None and self.uses_phash:
+            # Newest entries first: a webcam re-submit most likely matches the latest frame
+            for other_key in reversed(self._entries):
+                value, _, expires_at, other_phash = self._entries[other_key]
+                if other_phash is not None and expires_at > now \
+                        and (phash ^ other_phash).bit_count() <= self.phash_distance:
+                    self._entries.move_to_end(other_key)
+                    self.near_hits += 1
+                    return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key, value, phash=None):
+        size = len(json.dumps(value)) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (value, size, self.clock() + self.ttl, phash)
+        self.size += size
+
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
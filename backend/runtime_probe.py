@@ -0,0 +1,221 @@
+"""Probe the CPU, memory and accelerators this process may use and pick thread counts to match.
+
+    python runtime_probe.py
+
+The backend, the inference workers and the training scripts all size their
+thread pools from `runtime_config()`. Every choice can be overridden from the
+environment, e.g. MAGDA_CPUS=4 or MAGDA_CV2_THREADS=2.
+"""
+import importlib.util
+import math
+import os
+import platform
+import sys
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+# Rough resident size of one inference worker (FaceMesh graph, classifier, decode buffers)
+WORKER_MEMORY_MB = int(os.environ.get('MAGDA_WORKER_MEMORY_MB', 300))
+# Share of the memory limit the inference workers may take together
+WORKER_MEMORY_SHARE = 0.75
+
+# Instruction sets the TFLite (XNNPACK), MediaPipe and OpenCV kernels pick fast paths for
+SIMD_FLAGS = ('sse4_2', 'avx', 'avx2', 'fma', 'f16c', 'avx512f', 'avx512_vnni', 'avx_vnni', 'asimd', 'asimddp', 'sve')
+BLAS_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+_config = None
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_quota():
+    """CPUs allowed by the cgroup CPU quota (Docker --cpus), or None when unlimited"""
+    cpu_max = _read(os.path.join(CGROUP_ROOT, 'cpu.max'))  # cgroup v2: "<quota> <period>" or "max <period>"
+    if cpu_max:
+        quota, _, period = cpu_max.partition(' ')
+        if quota != 'max':
+            return int(quota) / int(period)
+        return None
+    quota = _read(os.path.join(CGROUP_ROOT, 'cpu', 'cpu.cfs_quota_us'))  # cgroup v1
+    period = _read(os.path.join(CGROUP_ROOT, 'cpu', 'cpu.cfs_period_us'))
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def cgroup_memory_limit():
+    """Bytes allowed by the cgroup memory limit, or None when unlimited"""
+    limit = _read(os.path.join(CGROUP_ROOT, 'memory.max')) or _read(
+        os.path.join(CGROUP_ROOT, 'memory', 'memory.limit_in_bytes'))
+    # cgroup v1 reports "unlimited" as a number near 2**63
+    if not limit or limit == 'max' or int(limit) >= 2 ** 60:
+        return None
+    return int(limit)
+
+
+def physical_memory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def simd_features():
+    """SIMD extensions the CPU reports, from /proc/cpuinfo (x86 "flags", Arm "Features")"""
+    cpuinfo = _read('/proc/cpuinfo') or ''
+    flags = set()
+    for line in cpuinfo.splitlines():
+        name, _, value = line.partition(':')
+        if name.strip() in ('flags', 'Features'):
+            flags.update(value.split())
+            break
+    if not flags and platform.machine() in ('arm64', 'aarch64'):
+        # Apple silicon and other Arm64 CPUs without /proc/cpuinfo always have NEON
+        flags.add('asimd')
+    return [flag for flag in SIMD_FLAGS if flag in flags]
+
+
+def probe():
+    """Facts about the hardware visible to this process"""
+    online = os.cpu_count() or 1
+    affinity = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else online
+    quota = cgroup_cpu_quota()
+    cpus = min(affinity, max(1, math.ceil(quota))) if quota else affinity
+
+    memory_limit = cgroup_memory_limit()
+    memory = physical_memory()
+    if memory_limit is not None:
+        memory = min(memory, memory_limit) if memory else memory_limit
+
+    return {
+        "machine": platform.machine(),
+        "cpus_online": online,
+        "cpus_affinity": affinity,
+        "cpu_quota": quota,
+        "cpus": cpus,
+        "memory_bytes": memory,
+        "simd": simd_features(),
+    }
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def runtime_config():
+    """Thread and worker counts for this process, computed once.
+
+    The CPUs are split evenly between server processes (uvicorn/gunicorn
+    WEB_CONCURRENCY). Each process runs one inference worker per CPU share,
+    as many as memory allows. Each worker then gets a single thread for
+    OpenCV, the CNN and BLAS, so adding workers never oversubscribes cores.
+    """
+    global _config
+    if _config is not None:
+        return _config
+
+    facts = probe()
+    cpus = _env_int('MAGDA_CPUS', facts['cpus'])
+    processes = max(1, _env_int('MAGDA_SERVER_PROCESSES', _env_int('WEB_CONCURRENCY', 1)))
+    budget = max(1, cpus // processes)
+
+    workers = budget
+    if facts['memory_bytes']:
+        fit = int(facts['memory_bytes'] * WORKER_MEMORY_SHARE / processes / (WORKER_MEMORY_MB * 1024 * 1024))
+        workers = max(1, min(workers, fit))
+    workers = max(1, _env_int('MAGDA_INFERENCE_WORKERS', workers))
+    threads_per_worker = max(1, budget // workers)
+
+    _config = {
+        **facts,
+        "cpus": cpus,
+        "server_processes": processes,
+        "inference_workers": workers,
+        "cv2_threads": _env_int('MAGDA_CV2_THREADS', threads_per_worker),
+        "cnn_threads": _env_int('MAGDA_CNN_THREADS', threads_per_worker),
+        "blas_threads": _env_int('MAGDA_BLAS_THREADS', threads_per_worker),
+        # Training owns the machine: one intra-op thread per CPU, two ops in flight
+        "tf_intra_op_threads": _env_int('MAGDA_TF_INTRA_OP_THREADS', cpus),
+        "tf_inter_op_threads": _env_int('MAGDA_TF_INTER_OP_THREADS', min(2, cpus)),
+    }
+    return _config
+
+
+def configure_blas(threads=None):
+    """Cap BLAS/OpenMP threads here and in any process spawned from here; explicit env vars win"""
+    threads = threads or runtime_config()['blas_threads']
+    for name in BLAS_ENV_VARS:
+        os.environ.setdefault(name, str(threads))
+    try:
+        # Already-loaded BLAS libraries ignore the env vars; scikit-learn ships threadpoolctl
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(limits=int(os.environ['OPENBLAS_NUM_THREADS']), user_api='blas')
+
+
+def configure_cv2(cv2, threads=None):
+    cv2.setNumThreads(threads or runtime_config()['cv2_threads'])
+
+
+def configure_tensorflow(tf, intra_op=None, inter_op=None):
+    """Must run before TensorFlow executes its first op"""
+    config = runtime_config()
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op or config['tf_intra_op_threads'])
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op or config['tf_inter_op_threads'])
+
+
+def describe(config=None):
+    config = config or runtime_config()
+    memory = f"{config['memory_bytes'] / 2 ** 30:.1f} GiB" if config['memory_bytes'] else "unknown"
+    quota = f", quota {config['cpu_quota']:g}" if config['cpu_quota'] else ""
+    return (f"{config['cpus']} CPUs ({config['cpus_affinity']} usable{quota}) / {config['server_processes']} "
+            f"server processes, {memory} memory, SIMD {' '.join(config['simd']) or 'none'}; "
+            f"{config['inference_workers']} inference workers with cv2 {config['cv2_threads']}, "
+            f"CNN {config['cnn_threads']}, BLAS {config['blas_threads']} threads each; "
+            f"TensorFlow intra-op {config['tf_intra_op_threads']}, inter-op {config['tf_inter_op_threads']}")
+
+
+def report_tensorflow():
+    """TensorFlow build and device facts, as check_gpu.py used to print"""
+    import tensorflow as tf
+
+    print("TensorFlow version:", tf.__version__)
+    print("\nCUDA Environment:")
+    for var in ('CUDA_PATH', 'CUDA_HOME', 'LD_LIBRARY_PATH', 'PATH'):
+        print(f"{var}:", os.environ.get(var, 'Not set'))
+
+    print("\nTensorFlow CUDA build information:")
+    print("Built with CUDA:", tf.test.is_built_with_cuda())
+    print("Built with GPU support:", tf.test.is_built_with_gpu_support())
+
+    print("\nPhysical Devices:")
+    print("CPU Devices:", tf.config.list_physical_devices('CPU'))
+    print("GPU Devices:", tf.config.list_physical_devices('GPU'))
+
+    if len(tf.config.list_physical_devices('GPU')) > 0:
+        print("\nTesting GPU computation...")
+        with tf.device('/GPU:0'):
+            a = tf.constant([[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+            b = tf.constant([[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]])
+            print("Matrix multiplication result:", tf.matmul(a, b).numpy())
+    else:
+        print("\nNo GPU available. Using CPU only.")
+
+
+if __name__ == '__main__':
+    print("Python version:", sys.version)
+    print(describe())
+    for name, value in runtime_config().items():
+        print(f"  {name}: {value}")
+    if importlib.util.find_spec('tensorflow') is None:
+        print("\nTensorFlow is not installed; skipping the GPU checks")
+    else:
+        print()
+        report_tensorflow()
@@ -0,0 +1,122 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from face_detection import FaceShapeDetector
+from face_features import NO_FACE, features_from_coords
+from preprocessing import StageTimer
+
+# Weight of the newest frame in the exponential moving average of class probabilities
+STREAM_EMA_ALPHA = float(os.environ.get('MAGDA_STREAM_EMA_ALPHA', 0.3))
+# Consecutive frames without a face before the smoothed decision is dropped
+STREAM_FACE_LOST_FRAMES = int(os.environ.get('MAGDA_STREAM_FACE_LOST_FRAMES', 15))
+
+
+class StreamSession:
+    """Tracking-mode FaceMesh for one webcam stream, with EMA-smoothed face-shape output"""
+
+    def __init__(self, model, alpha=STREAM_EMA_ALPHA, face_lost_frames=STREAM_FACE_LOST_FRAMES):
+        # Frames are smoothed instead of escalated, so streams never load the CNN
+        self.detector = FaceShapeDetector(static_image_mode=False, model=model, cascade_threshold=0)
+        self.classes = [str(label) for label in self.detector.clf.classes_]
+        self.alpha = alpha
+        self.face_lost_frames = face_lost_frames
+        self.ema = None
+        self.missed = 0
+
+    def process(self, image_data: bytes):
+        timer = StageTimer()
+        coords, timings = self.detector.landmarks_timed(image_data, timer)
+
+        if coords is None:
+            self.missed += 1
+            if self.missed >= self.face_lost_frames:
+                self.ema = None
+            raw_face_shape = NO_FACE
+        else:
+            self.missed = 0
+            probabilities = self.detector.probabilities(features_from_coords(coords[np.newaxis]))[0]
+            self.ema = probabilities if self.ema is None else \
+                self.alpha * probabilities + (1 - self.alpha) * self.ema
+            raw_face_shape = self.classes[int(np.argmax(probabilities))]
+            timer.mark('classify')
+
+        if self.ema is None:
+            face_shape, confidence = NO_FACE, 0.0
+        else:
+            best = int(np.argmax(self.ema))
+            face_shape, confidence = self.classes[best], float(self.ema[best])
+        return {
+            "face_shape": face_shape,
+            "confidence": confidence,
+            "raw_face_shape": raw_face_shape,
+            "timings": timings,
+        }
+
+    def close(self):
+        self.detector.close()
+
+
+async def serve_stream(websocket, model):
+    """Run one accepted /ws/detect connection until the client disconnects.
+
+    Frames arrive as binary JPEG messages; a text message closes the connection
+    with 1003. Only the newest frame is kept while
+    inference is busy, so a client sending faster than we can process never
+    builds a backlog; each reply reports how many frames were dropped.
+    """
+    loop = asyncio.get_running_loop()
+    # One thread per connection: the tracking graph must see frames in order
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='face-stream')
+    session = await loop.run_in_executor(executor, StreamSession, model)
+
+    latest = None
+    frame_ready = asyncio.Event()
+    received = 0
+    dropped = 0
+
+    async def receive_frames():
+        nonlocal latest, received, dropped
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+            data = message.get('bytes')
+            if data is None:
+                # 1003: frames must be binary JPEG messages
+                await websocket.close(code=1003)
+                return
+            received += 1
+            if latest is not None:
+                dropped += 1
+            latest = data
+            frame_ready.set()
+
+    receiver = asyncio.create_task(receive_frames())
+    try:
+        while True:
+            waiter = asyncio.create_task(frame_ready.wait())
+            await asyncio.wait({receiver, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver.done():
+                waiter.cancel()
+                break
+
+            frame, latest = latest, None
+            frame_ready.clear()
+            result = await loop.run_in_executor(executor, session.process, frame)
+            try:
+                await websocket.send_json({**result, "frame": received, "dropped": dropped})
+            except Exception:
+                # The peer went away mid-send; the server-specific error means the same as a disconnect
+                break
+    finally:
+        receiver.cancel()
+        try:
+            await receiver
+        except (asyncio.CancelledError, Exception):
+            # Cleanup must finish whatever the receiver died of
+            pass
+        await loop.run_in_executor(executor, session.close)
+        executor.shutdown(wait=False)
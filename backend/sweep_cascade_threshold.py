@@ -0,0 +1,135 @@
+"""Chart cascade accuracy against mean latency over a range of confidence thresholds.
+
+    python sweep_cascade_threshold.py --dataset 'FaceShape Dataset'
+
+Each testing_set image is meshed, classified by the landmark model and by the
+CNN exactly once; every threshold is then scored from those measurements.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from build_face_shape_model import DATASET_DIR, scan_dataset
+from cnn_classifier import CNN_MODEL_PATH, CNN_LABELS_PATH
+from face_features import features_from_coords
+
+
+def measure(dataset_dir, max_side, face_crop, cnn_model_path, cnn_labels_path):
+    """Per-image landmark decision, CNN decision and the time each path costs (ms)"""
+    from cnn_classifier import CNNClassifier
+    from face_detection import FaceShapeDetector
+    from preprocessing import StageTimer
+
+    detector = FaceShapeDetector(max_side=max_side, face_crop=face_crop, cascade_threshold=0)
+    cnn = CNNClassifier(cnn_model_path, cnn_labels_path)
+    detector.warm_up()
+    cnn.predict_proba(np.zeros((192, 192, 3), dtype=np.uint8))
+
+    columns = scan_dataset(dataset_dir)
+    measurements = []
+    for path, split, label in zip(columns['path'], columns['split'], columns['label']):
+        if split != 'testing_set':
+            continue
+        with open(os.path.join(dataset_dir, path), 'rb') as f:
+            data = f.read()
+
+        timer = StageTimer()
+        rgb_image, coords, timings = detector.mesh_timed(data, timer)
+        if coords is None:
+            measurements.append({"label": label, "found": False, "landmarks_ms": sum(timings.values())})
+            continue
+        face_shape, confidence = detector.classify_with_confidence(features_from_coords(coords[np.newaxis]))[0]
+        timer.mark('classify')
+
+        start = time.perf_counter()
+        cnn_face_shape, _ = cnn.predict(rgb_image)
+        measurements.append({
+            "label": label,
+            "found": True,
+            "landmarks": face_shape,
+            "confidence": confidence,
+            "landmarks_ms": sum(timer.timings.values()),
+            "cnn": cnn_face_shape,
+            "cnn_ms": (time.perf_counter() - start) * 1000,
+        })
+    detector.close()
+    return measurements
+
+
+def sweep(measurements, thresholds):
+    """Accuracy, escalation rate and mean latency per threshold; images without a face count as wrong"""
+    rows = []
+    for threshold in thresholds:
+        correct = 0
+        escalated = 0
+        total_ms = 0.0
+        for m in measurements:
+            total_ms += m["landmarks_ms"]
+            if not m["found"]:
+                continue
+            if m["confidence"] < threshold:
+                escalated += 1
+                total_ms += m["cnn_ms"]
+                correct += m["cnn"] == m["label"]
+            else:
+                correct += m["landmarks"] == m["label"]
+        rows.append({
+            "threshold": round(float(threshold), 3),
+            "accuracy": round(correct / len(measurements), 4),
+            "escalated": round(escalated / len(measurements), 4),
+            "mean_ms": round(total_ms / len(measurements), 2),
+        })
+    return rows
+
+
+def plot(rows, output_path):
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(8, 6))
+    plt.plot([row["mean_ms"] for row in rows], [row["accuracy"] for row in rows], 'bo-')
+    for row in rows[::2]:
+        plt.annotate(f'{row["threshold"]:.2f}', (row["mean_ms"], row["accuracy"]),
+                     textcoords='offset points', xytext=(5, -10))
+    plt.title('Cascade accuracy vs mean latency (labels: threshold)')
+    plt.xlabel('Mean latency (ms)')
+    plt.ylabel('Test accuracy')
+    plt.grid(True)
+    plt.savefig(output_path)
+    plt.close()
+
+
+def main():
+    from preprocessing import FACE_CROP, MAX_IMAGE_SIDE
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', default=DATASET_DIR, help="Folder holding testing_set")
+    parser.add_argument('--cnn', default=CNN_MODEL_PATH)
+    parser.add_argument('--labels', default=CNN_LABELS_PATH)
+    parser.add_argument('--max-side', type=int, default=MAX_IMAGE_SIDE)
+    parser.add_argument('--face-crop', action='store_true', default=FACE_CROP)
+    parser.add_argument('--steps', type=int, default=20, help="Thresholds evenly spaced over [0, 1]")
+    parser.add_argument('--output', default='cascade_sweep.json')
+    parser.add_argument('--plot', default='cascade_sweep.png', help="Empty to skip the chart")
+    args = parser.parse_args()
+
+    measurements = measure(args.dataset, args.max_side, args.face_crop, args.cnn, args.labels)
+    if not measurements:
+        raise SystemExit(f"No testing_set images under {args.dataset}")
+    rows = sweep(measurements, np.linspace(0, 1, args.steps + 1))
+
+    for row in rows:
+        print(f"threshold {row['threshold']:.2f}: accuracy {row['accuracy']:.3f}, "
+              f"escalated {row['escalated']:.0%}, mean {row['mean_ms']:.1f} ms")
+    with open(args.output, 'w') as f:
+        json.dump({"images": len(measurements), "thresholds": rows}, f, indent=2)
+    print(f"Wrote {args.output}")
+    if args.plot:
+        plot(rows, args.plot)
+        print(f"Wrote {args.plot}")
+
+
+if __name__ == '__main__':
+    main()
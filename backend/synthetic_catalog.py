@@ -0,0 +1,87 @@
+"""Scale stock.csv up to a synthetic catalog for benchmarks.
+
+    python synthetic_catalog.py --rows 1000000 --output stock_1m.csv
+
+Frame shape, gender and age group keep the value frequencies of the real
+catalog. Brands grow with the square root of the row count and follow a
+Zipf-like popularity curve. Prices are real prices with log-normal jitter.
+Image links are reused from the real rows, after inline images have been
+moved to the blob store.
+"""
+import argparse
+import csv
+
+import numpy as np
+
+from catalog_index import load_records
+from image_store import ImageStore, ingest_inline_images
+
+# Low-cardinality columns sampled from their empirical distribution
+SAMPLED_COLUMNS = ('frame_shape', 'gender', 'age_group', 'image_links')
+
+
+def empirical(rng, values, size):
+    """Draw `size` values with the frequencies they have in `values`"""
+    unique, counts = np.unique(np.asarray(values, dtype=object).astype(str), return_counts=True)
+    return unique[rng.choice(len(unique), size=size, p=counts / counts.sum())]
+
+
+def synthesize(records, rows, seed=0):
+    """Return `rows` catalog records shaped like `records`"""
+    rng = np.random.default_rng(seed)
+    columns = {name: empirical(rng, [r[name] for r in records], rows) for name in SAMPLED_COLUMNS}
+
+    base_brands = sorted({r['brand'] for r in records})
+    copies = max(1, int(np.sqrt(rows / len(records))))
+    brands = [brand if i == 0 else f"{brand} {i + 1}" for i in range(copies) for brand in base_brands]
+    popularity = 1.0 / np.arange(1, len(brands) + 1)
+    brand_codes = rng.choice(len(brands), size=rows, p=popularity / popularity.sum())
+
+    base_prices = np.array([r['price'] for r in records])
+    prices = np.round(rng.choice(base_prices, size=rows) * rng.lognormal(0.0, 0.25, size=rows), 2)
+
+    return [
+        {
+            'brand': brands[brand_codes[i]],
+            'model': f"SYN{i:07d}",
+            'frame_shape': columns['frame_shape'][i],
+            'price': float(prices[i]),
+            'gender': columns['gender'][i],
+            'age_group': columns['age_group'][i],
+            'image_links': columns['image_links'][i],
+        }
+        for i in range(rows)
+    ]
+
+
+def load_base_records(path='stock.csv'):
+    """The real catalog, with inline images swapped for blob-store links as the backend does"""
+    records = load_records(path)
+    ingest_inline_images(records, ImageStore())
+    return records
+
+
+def write_csv(records, path):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=list(records[0]))
+        writer.writeheader()
+        for record in records:
+            writer.writerow({**record, 'price': f"{record['price']:.2f}"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default='stock.csv')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', required=True)
+    args = parser.parse_args()
+
+    records = synthesize(load_base_records(args.source), args.rows, args.seed)
+    write_csv(records, args.output)
+    brands = len({r['brand'] for r in records})
+    print(f"Wrote {len(records)} rows ({brands} brands) to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
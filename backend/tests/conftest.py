@@ -0,0 +1,33 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The backend modules import each other as top-level modules
+sys.path.insert(0, BACKEND_DIR)
+
+# main reads its configuration at import: serve stock.csv from an in-memory store, keep
+# extracted images out of the tree and never load the face detection stack
+_scratch = tempfile.mkdtemp(prefix='magda-tests-')
+os.environ.update({
+    'MAGDA_CATALOG_PATH': os.path.join(BACKEND_DIR, 'stock.csv'),
+    'MAGDA_CATALOG_STORE': 'memory',
+    'MAGDA_CATALOG_POLL_SECONDS': '0',
+    'MAGDA_CATALOG_TOKEN': 'test-token',
+    'MAGDA_IMAGE_STORE_DIR': os.path.join(_scratch, 'frame_images'),
+    'MAGDA_FRAME_EMBEDDINGS_DIR': os.path.join(_scratch, 'frame_embeddings'),
+    'MAGDA_ML_STARTUP': 'lazy',
+})
+
+
+@pytest.fixture(scope='session')
+def client():
+    from fastapi.testclient import TestClient
+
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
@@ -0,0 +1,86 @@
+import base64
+import json
+
+import pytest
+
+
+def make_cursor(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+@pytest.mark.parametrize('sort', [None, 'price', '-price', 'brand', '-brand'])
+def test_pages_cover_the_full_listing(client, sort):
+    params = {} if sort is None else {'sort': sort}
+    everything = client.get('/frames', params=params).json()
+
+    pages, cursor = [], None
+    while True:
+        response = client.get('/frames', params={**params, 'limit': 3, **({'cursor': cursor} if cursor else {})})
+        assert response.status_code == 200
+        pages.extend(response.json())
+        cursor = response.headers.get('x-next-cursor')
+        if cursor is None:
+            break
+    assert pages == everything
+
+
+@pytest.mark.parametrize('cursor', [
+    'not a cursor!',
+    base64.urlsafe_b64encode(b'garbage').decode(),
+    make_cursor(['price', ['cheap', 3]]),
+    make_cursor(['price', [10.0]]),
+    make_cursor(['price', None]),
+    make_cursor(['price', 7]),
+    make_cursor('price'),
+])
+def test_malformed_cursor_is_a_client_error(client, cursor):
+    response = client.get('/frames', params={'sort': 'price', 'cursor': cursor})
+    assert response.status_code == 400
+    assert response.json()['detail'] == "Invalid cursor"
+
+
+def test_unsorted_cursor_must_hold_a_sequence(client):
+    response = client.get('/frames', params={'cursor': make_cursor(['', 'three'])})
+    assert response.status_code == 400
+
+
+def test_cursor_for_another_sort_is_rejected(client):
+    cursor = client.get('/frames', params={'sort': 'price', 'limit': 2}).headers['x-next-cursor']
+    for params in ({'sort': 'brand'}, {}):
+        response = client.get('/frames', params={**params, 'cursor': cursor})
+        assert response.status_code == 400
+        assert response.json()['detail'] == "Cursor was issued for a different sort order"
+
+
+def test_matching_frames_pages_with_cursor(client):
+    everything = client.get('/matching-frames/oval', params={'sort': '-price'}).json()
+    first = client.get('/matching-frames/oval', params={'sort': '-price', 'limit': 2})
+    rest = client.get('/matching-frames/oval', params={'sort': '-price', 'cursor': first.headers['x-next-cursor']})
+    assert first.json() + rest.json() == everything
+
+
+def test_fields_projection(client):
+    response = client.get('/frames', params={'fields': 'brand, price', 'limit': 5})
+    assert response.status_code == 200
+    assert all(set(record) == {'brand', 'price'} for record in response.json())
+
+
+def test_unknown_fields_are_rejected(client):
+    response = client.get('/frames', params={'fields': 'brand,colour,size'})
+    assert response.status_code == 400
+    assert response.json()['detail'] == "Unknown fields: colour, size"
+
+
+def test_ndjson_streams_the_json_records(client):
+    params = {'sort': 'price', 'fields': 'brand,model,price'}
+    expected = client.get('/frames', params=params).json()
+    response = client.get('/frames', params={**params, 'format': 'ndjson'})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('application/x-ndjson')
+    assert [json.loads(line) for line in response.text.splitlines()] == expected
+
+
+def test_ndjson_page_carries_the_cursor(client):
+    response = client.get('/frames', params={'sort': 'brand', 'limit': 2, 'format': 'ndjson'})
+    assert len(response.text.splitlines()) == 2
+    assert 'x-next-cursor' in response.headers
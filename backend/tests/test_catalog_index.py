@@ -0,0 +1,144 @@
+import random
+
+import pytest
+
+from catalog_index import SORT_KEYS, TOMBSTONE_FRACTION, CatalogIndex, record_key
+
+BRANDS = ('Ray-Ban', 'Oakley', 'oakley', 'Persol', 'Gucci')
+FRAME_SHAPES = ('Round', 'Square', 'Aviator', 'Cat Eye')
+GENDERS = ('male', 'female', 'unisex')
+AGE_GROUPS = ('adult', 'kids')
+# Few distinct prices, so every sort order has plenty of ties
+PRICES = (49.0, 99.5, 150.0, 150.0, 220.0)
+
+QUERIES = [
+    {},
+    {'frame_shapes': ['Round', 'Aviator']},
+    {'brand': 'OAKLEY'},
+    {'gender': 'female'},
+    {'age_group': 'kids'},
+    {'min_price': 99.5},
+    {'max_price': 150.0},
+    {'min_price': 60, 'max_price': 200, 'gender': 'male'},
+    {'frame_shapes': ['Square'], 'brand': 'persol', 'age_group': 'adult'},
+]
+
+
+def make_record(rng, model):
+    return {
+        'brand': rng.choice(BRANDS),
+        'model': model,
+        'frame_shape': rng.choice(FRAME_SHAPES),
+        'price': rng.choice(PRICES),
+        'gender': rng.choice(GENDERS),
+        'age_group': rng.choice(AGE_GROUPS),
+        'image_links': '',
+    }
+
+
+def random_batch(rng, index, next_model):
+    """(upserts, deletes, next_model): a mix of new rows, edited rows and deletes"""
+    live = list(index.keys)
+    deletes = rng.sample(live, min(len(live), rng.randint(0, 12)))
+    upserts = []
+    for key in rng.sample(live, min(len(live), rng.randint(0, 12))):
+        record = make_record(rng, key[1])
+        record['brand'] = key[0]
+        upserts.append(record)
+    for _ in range(rng.randint(0, 12)):
+        upserts.append(make_record(rng, f'm{next_model}'))
+        next_model += 1
+    return upserts, deletes, next_model
+
+
+def keys_of(index, rows):
+    return [record_key(index.records[row]) for row in rows]
+
+
+def assert_same_catalog(patched, rebuilt):
+    assert len(patched) == len(rebuilt)
+    assert sorted(keys_of(patched, patched.all_rows)) == sorted(keys_of(rebuilt, rebuilt.all_rows))
+    for column in ('brand', 'frame_shape', 'gender', 'age_group'):
+        assert sorted(patched.distinct(column)) == sorted(rebuilt.distinct(column))
+    assert patched.price_range() == rebuilt.price_range()
+    for query in QUERIES:
+        assert sorted(keys_of(patched, patched.query(**query))) == sorted(keys_of(rebuilt, rebuilt.query(**query)))
+    for sort in SORT_KEYS:
+        # Ties keep catalog order, which a compacting rebuild preserves
+        assert keys_of(patched, patched.page(patched.all_rows, sort)[0]) == \
+            keys_of(rebuilt, rebuilt.page(rebuilt.all_rows, sort)[0])
+
+
+def rebuild(index):
+    return CatalogIndex([record for record in index.records if record is not None], index.fields)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_apply_matches_full_rebuild(seed):
+    rng = random.Random(seed)
+    index = CatalogIndex([make_record(rng, f'm{i}') for i in range(200)])
+    next_model = 200
+    for _ in range(60):
+        upserts, deletes, next_model = random_batch(rng, index, next_model)
+        index = index.apply(upserts, deletes)
+        assert_same_catalog(index, rebuild(index))
+
+
+def test_apply_leaves_the_previous_snapshot_untouched():
+    rng = random.Random(0)
+    before = CatalogIndex([make_record(rng, f'm{i}') for i in range(100)])
+    expected = {sort: keys_of(before, before.page(before.all_rows, sort)[0]) for sort in SORT_KEYS}
+    expected_rows = {str(query): keys_of(before, before.query(**query)) for query in QUERIES}
+
+    after = before.apply([make_record(rng, 'new')], [('Ray-Ban', 'm0'), record_key(before.records[1])])
+    assert after is not before
+    assert len(before) == 100
+    for sort in SORT_KEYS:
+        assert keys_of(before, before.page(before.all_rows, sort)[0]) == expected[sort]
+    for query in QUERIES:
+        assert keys_of(before, before.query(**query)) == expected_rows[str(query)]
+
+
+def test_empty_batch_returns_the_same_snapshot():
+    rng = random.Random(0)
+    index = CatalogIndex([make_record(rng, f'm{i}') for i in range(10)])
+    assert index.apply([], [('Nobody', 'nothing')]) is index
+
+
+def test_tombstones_are_compacted():
+    rng = random.Random(0)
+    index = CatalogIndex([make_record(rng, f'm{i}') for i in range(100)])
+    live = list(index.keys)
+    # Small batches patch in place and leave empty slots behind
+    index = index.apply(deletes=live[:10])
+    assert len(index.records) == 100 and len(index) == 90
+
+    deleted = 10
+    while len(index.records) > len(index):
+        batch = live[deleted:deleted + 10]
+        index = index.apply(deletes=batch)
+        deleted += len(batch)
+        assert len(index.records) - len(index) <= TOMBSTONE_FRACTION * max(len(index.records), 1)
+    assert len(index.records) == len(index) == 100 - deleted
+    assert_same_catalog(index, rebuild(index))
+
+
+@pytest.mark.parametrize('sort', (None,) + SORT_KEYS)
+def test_cursor_survives_updates_and_compaction(sort):
+    rng = random.Random(1)
+    index = CatalogIndex([make_record(rng, f'm{i}') for i in range(100)])
+    rows, cursor = index.page(index.all_rows, sort, limit=10)
+    first_page = set(keys_of(index, rows))
+    full_order = keys_of(index, index.page(index.all_rows, sort)[0])
+
+    # Cheap new frames sort first by price, a compacting delete renumbers every row
+    cheap = [dict(make_record(rng, f'cheap{i}'), price=1.0) for i in range(3)]
+    index = index.apply(cheap, [])
+    index = index.apply(deletes=list(index.keys)[20:60])
+    assert len(index.records) == len(index)
+
+    rows, _ = index.page(index.all_rows, sort, after=cursor)
+    rest = keys_of(index, rows)
+    assert not first_page & set(rest)
+    expected = [key for key in full_order[10:] if key in index.keys]
+    assert [key for key in rest if not key[1].startswith('cheap')] == expected
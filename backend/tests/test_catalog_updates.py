@@ -0,0 +1,70 @@
+import base64
+
+import pytest
+
+from image_store import decode_data_uri
+
+AUTH = {'Authorization': 'Bearer test-token'}
+PNG = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+
+
+def frame(model, **fields):
+    return {'brand': 'Testbrand', 'model': model, 'frame_shape': 'round', 'price': 120.0,
+            'gender': 'unisex', 'age_group': 'adult', **fields}
+
+
+def test_decode_data_uri():
+    assert decode_data_uri('https://example.com/a.jpg') is None
+    assert decode_data_uri('') is None
+    assert decode_data_uri('data:image/png;base64,' + base64.b64encode(PNG).decode()) == ('image/png', PNG)
+    with pytest.raises(ValueError):
+        decode_data_uri('data:image/png;base64,not*base64')
+
+
+@pytest.mark.parametrize('link', ['data:image/jpeg;base64,@@@@', 'data:image/png;base64,abc'])
+def test_malformed_inline_image_is_rejected(client, link):
+    rows = client.get('/ready').json()['catalog']['rows']
+    response = client.post('/catalog', json={'upsert': [frame('bad-image', image_links=link)]}, headers=AUTH)
+    assert response.status_code == 422
+    assert client.get('/ready').json()['catalog']['rows'] == rows
+    assert client.get('/frames', params={'brand': 'Testbrand'}).json() == []
+
+
+def test_inline_image_moves_to_the_blob_store(client):
+    link = 'data:image/png;base64,' + base64.b64encode(PNG).decode()
+    response = client.post('/catalog', json={'upsert': [frame('inline-image', image_links=link)]}, headers=AUTH)
+    assert response.status_code == 200
+
+    [record] = client.get('/frames', params={'brand': 'Testbrand'}).json()
+    assert record['image_links'].startswith('/frame-images/')
+    image = client.get(record['image_links'])
+    assert image.status_code == 200 and image.content == PNG
+
+    response = client.post('/catalog', json={'delete': [{'brand': 'Testbrand', 'model': 'inline-image'}]},
+                           headers=AUTH)
+    assert response.status_code == 200
+    assert client.get('/frames', params={'brand': 'Testbrand'}).json() == []
+
+
+@pytest.mark.parametrize('price', ['nan', 'inf', '-inf', -1])
+def test_invalid_price_is_rejected(client, price):
+    response = client.post('/catalog', json={'upsert': [frame('bad-price', price=price)]}, headers=AUTH)
+    assert response.status_code == 422
+
+
+def test_updates_need_the_token(client):
+    response = client.post('/catalog', json={'upsert': [frame('no-token')]},
+                           headers={'Authorization': 'Bearer wrong'})
+    assert response.status_code == 401
+
+
+def test_own_writes_record_the_fingerprint(client):
+    import main
+
+    response = client.post('/catalog', json={'upsert': [frame('fingerprint')]}, headers=AUTH)
+    assert response.status_code == 200
+    assert main.catalog_fingerprint == main.catalog_store.fingerprint()
+    client.post('/catalog', json={'delete': [{'brand': 'Testbrand', 'model': 'fingerprint'}]}, headers=AUTH)
+    assert main.catalog_fingerprint == main.catalog_store.fingerprint()
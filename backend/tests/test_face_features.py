@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from face_features import extract_features, features_from_coords
+
+
+def scalar_features(landmarks):
+    """The per-landmark formula features_from_coords replaced"""
+    face_height = landmarks.landmark[152].y - landmarks.landmark[10].y
+    face_width = landmarks.landmark[454].x - landmarks.landmark[234].x
+    jaw_width = landmarks.landmark[172].x - landmarks.landmark[397].x
+    cheekbone_width = landmarks.landmark[123].x - landmarks.landmark[352].x
+    forehead_width = landmarks.landmark[109].x - landmarks.landmark[338].x
+    return [
+        face_height / face_width,
+        jaw_width / face_width,
+        cheekbone_width / jaw_width,
+        forehead_width / jaw_width,
+    ]
+
+
+def as_landmarks(coords):
+    """A FaceMesh-like landmark list; protobuf exposes the float32 values as Python floats"""
+    return SimpleNamespace(landmark=[SimpleNamespace(x=float(x), y=float(y), z=float(z)) for x, y, z in coords])
+
+
+@pytest.mark.parametrize('faces', [1, 7])
+def test_vectorized_features_match_the_scalar_formula(faces):
+    coords = np.random.default_rng(faces).random((faces, 468, 3), dtype=np.float32)
+    expected = [scalar_features(as_landmarks(face)) for face in coords]
+    np.testing.assert_allclose(features_from_coords(coords), expected, rtol=1e-12)
+    for face, row in zip(coords, expected):
+        np.testing.assert_allclose(extract_features(as_landmarks(face)), row, rtol=1e-12)
+
+
+def test_zero_width_landmarks():
+    coords = np.random.default_rng(0).random((2, 468, 3), dtype=np.float32)
+    # Face 0: temples on top of each other; face 1: jaw points on top of each other
+    coords[0, 454, 0] = coords[0, 234, 0]
+    coords[1, 172, 0] = coords[1, 397, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        features = features_from_coords(coords)
+
+    # The scalar formula raised on these; the vectorized one yields inf/nan in exactly those ratios
+    for face in coords:
+        with pytest.raises(ZeroDivisionError):
+            scalar_features(as_landmarks(face))
+    assert not np.isfinite(features[0, :2]).any()
+    assert not np.isfinite(features[1, 2:]).any()
+
+    # The ratios that don't divide by the degenerate width still match
+    landmarks = as_landmarks(coords[0])
+    jaw_width = landmarks.landmark[172].x - landmarks.landmark[397].x
+    np.testing.assert_allclose(features[0, 2:], [
+        (landmarks.landmark[123].x - landmarks.landmark[352].x) / jaw_width,
+        (landmarks.landmark[109].x - landmarks.landmark[338].x) / jaw_width,
+    ], rtol=1e-12)
@@ -0,0 +1,50 @@
+from catalog_index import CatalogIndex
+from materialized_responses import ENTRY_OVERHEAD, MaterializedResponses
+
+RECOMMENDATIONS = {'oval': ['Round', 'Square'], 'round': ['Square']}
+
+
+def catalog():
+    return CatalogIndex([
+        {'brand': 'A', 'model': f'm{i}', 'frame_shape': shape, 'price': 10.0 + i,
+         'gender': gender, 'age_group': 'adult', 'image_links': ''}
+        for i, (shape, gender) in enumerate([('Round', 'male'), ('Square', 'female'), ('Square', 'unisex')])
+    ])
+
+
+def test_only_catalog_values_are_covered():
+    responses = MaterializedResponses(catalog(), RECOMMENDATIONS)
+    assert responses.covers('oval', None, None)
+    assert responses.covers('round', 'female', 'adult')
+    assert not responses.covers('square', None, None)
+    assert not responses.covers('oval', 'g1', None)
+    assert not responses.covers('oval', None, 'teen')
+
+
+def test_entries_are_capped_and_charged_their_overhead():
+    responses = MaterializedResponses(catalog(), RECOMMENDATIONS, max_entries=2)
+    for i in range(3):
+        response = responses.store(('matching_frames', i), [i], None)
+        assert response.status_code == 200
+    assert len(responses.bodies) == 2
+    assert responses.stats() == {"responses": 2, "bytes": 2 * (3 + ENTRY_OVERHEAD), "skipped": 1}
+    # Bodies that aren't kept carry no ETag
+    assert 'etag' not in response.headers
+
+
+def test_byte_cap_counts_the_overhead():
+    responses = MaterializedResponses(catalog(), RECOMMENDATIONS, max_bytes=ENTRY_OVERHEAD + 3)
+    assert 'etag' in responses.store(('filters',), [1], None).headers
+    assert 'etag' not in responses.store(('other',), [2], None).headers
+
+
+def test_made_up_query_strings_are_not_kept(client):
+    client.get('/matching-frames/oval')
+    before = client.get('/ready').json()['catalog']['materialized']['responses']
+    for i in range(50):
+        response = client.get(f'/matching-frames/x{i}', params={'gender': f'g{i}'})
+        assert response.status_code == 200 and 'etag' not in response.headers
+    assert client.get('/ready').json()['catalog']['materialized']['responses'] == before
+
+    response = client.get('/matching-frames/oval')
+    assert client.get('/matching-frames/oval', headers={'If-None-Match': response.headers['etag']}).status_code == 304
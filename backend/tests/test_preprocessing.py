@@ -0,0 +1,68 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from preprocessing import MAX_IMAGE_SIDE, decode_image, jpeg_size
+
+# Folder of face photos to check the downscaled path against, e.g. "FaceShape Dataset/testing_set"
+REFERENCE_FACES = os.environ.get('MAGDA_REFERENCE_FACES')
+# Largest difference allowed in any landmark ratio feature between the two paths
+FEATURE_TOLERANCE = 0.02
+
+
+def jpeg(width, height):
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+def test_jpeg_size_reads_the_header():
+    assert jpeg_size(jpeg(300, 200)) == (300, 200)
+    assert jpeg_size(cv2.imencode('.png', np.zeros((4, 4, 3), np.uint8))[1].tobytes()) is None
+
+
+def test_full_resolution_unless_a_max_side_is_set():
+    data = jpeg(1600, 1200)
+    assert decode_image(data, max_side=0).shape[:2] == (1200, 1600)
+    assert decode_image(data, max_side=500).shape[:2] == (375, 500)
+    # Smaller images are never upscaled
+    assert decode_image(data, max_side=4000).shape[:2] == (1200, 1600)
+
+
+def reference_images():
+    if not REFERENCE_FACES or not os.path.isdir(REFERENCE_FACES):
+        return []
+    return sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(REFERENCE_FACES)
+        for name in names
+        if name.lower().endswith(('.jpg', '.jpeg', '.png'))
+    )
+
+
+@pytest.mark.skipif(not reference_images(), reason="set MAGDA_REFERENCE_FACES to a folder of face photos")
+def test_downscaled_decode_matches_full_resolution():
+    from face_detection import FaceShapeDetector
+    from face_features import features_from_coords
+
+    max_side = MAX_IMAGE_SIDE or 1024
+    reference = FaceShapeDetector(max_side=0, face_crop=False, cascade_threshold=0)
+    fast = FaceShapeDetector(max_side=max_side, face_crop=False, cascade_threshold=0,
+                             model=(reference.clf, reference.scaler))
+
+    compared = 0
+    for path in reference_images():
+        with open(path, 'rb') as f:
+            data = f.read()
+        expected, actual = reference.landmarks(data), fast.landmarks(data)
+        if expected is None:
+            continue
+        assert actual is not None, f"{path}: no face at max_side={max_side}"
+        expected_features = features_from_coords(expected[np.newaxis])
+        actual_features = features_from_coords(actual[np.newaxis])
+        np.testing.assert_allclose(actual_features, expected_features, atol=FEATURE_TOLERANCE, err_msg=path)
+        assert fast.classify(actual_features) == reference.classify(expected_features), path
+        compared += 1
+    assert compared, "no reference image had a face"
@@ -0,0 +1,102 @@
+import json
+
+from result_cache import ENTRY_OVERHEAD, DetectionCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def entry_size(value):
+    return len(json.dumps(value)) + ENTRY_OVERHEAD
+
+
+def test_entries_expire_after_the_ttl():
+    clock = FakeClock()
+    cache = DetectionCache(ttl=10, clock=clock)
+    cache.put('a', {'face_shape': 'oval'})
+
+    clock.now += 9.9
+    assert cache.get('a') == {'face_shape': 'oval'}
+    clock.now += 0.1
+    assert cache.get('a') is None
+    assert cache.stats() == {"entries": 0, "bytes": 0, "hits": 1, "near_hits": 0, "misses": 1, "evictions": 0}
+
+
+def test_put_restarts_the_ttl():
+    clock = FakeClock()
+    cache = DetectionCache(ttl=10, clock=clock)
+    cache.put('a', 1)
+    clock.now += 8
+    cache.put('a', 2)
+    clock.now += 8
+    assert cache.get('a') == 2
+
+
+def test_least_recently_used_entry_is_evicted_first():
+    cache = DetectionCache(max_entries=3, clock=FakeClock())
+    for key in 'abc':
+        cache.put(key, key)
+    cache.get('a')  # b is now the least recently used
+    cache.put('d', 'd')
+    assert cache.get('b') is None
+    assert [cache.get(key) for key in 'acd'] == ['a', 'c', 'd']
+    assert cache.stats()['evictions'] == 1
+
+
+def test_byte_cap_evicts_oldest_until_it_fits():
+    value = {'face_shape': 'round', 'pad': 'x' * 100}
+    size = entry_size(value)
+    cache = DetectionCache(max_bytes=3 * size, clock=FakeClock())
+    for key in 'abc':
+        cache.put(key, value)
+    assert cache.size == 3 * size
+
+    # Twice the size of one entry: the two oldest go
+    big = {'face_shape': 'round', 'pad': 'x' * (size + 100)}
+    cache.put('d', big)
+    assert cache.get('a') is None and cache.get('b') is None
+    assert cache.get('c') == value and cache.get('d') == big
+    assert cache.size == size + entry_size(big) <= cache.max_bytes
+
+
+def test_values_larger_than_the_cap_are_not_cached():
+    cache = DetectionCache(max_bytes=ENTRY_OVERHEAD + 10, clock=FakeClock())
+    cache.put('a', 'x' * 100)
+    assert cache.get('a') is None
+    assert cache.size == 0
+
+
+def test_near_hit_threshold_is_inclusive():
+    cache = DetectionCache(phash_distance=4, clock=FakeClock())
+    phash = 0b1010_1010_1111_0000
+    cache.put('a', 'frame', phash)
+
+    assert cache.get('b', phash ^ 0b1111) == 'frame'  # 4 bits differ
+    assert cache.get('c', phash ^ 0b1_1111) is None  # 5 bits differ
+    assert cache.stats()['near_hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_near_hits_prefer_the_newest_entry_and_skip_expired_ones():
+    clock = FakeClock()
+    cache = DetectionCache(ttl=10, phash_distance=2, clock=clock)
+    cache.put('old', 'old frame', 0b0000)
+    clock.now += 5
+    cache.put('new', 'new frame', 0b0011)
+    assert cache.get('query', 0b0001) == 'new frame'
+
+    clock.now += 6  # 'old' has expired, 'new' has not
+    assert cache.get('query', 0b0000) == 'new frame'
+    clock.now += 5
+    assert cache.get('query', 0b0000) is None
+
+
+def test_near_hits_are_off_without_a_distance():
+    cache = DetectionCache(clock=FakeClock())
+    cache.put('a', 'frame', 0b1)
+    assert not cache.uses_phash
+    assert cache.get('b', 0b1) is None
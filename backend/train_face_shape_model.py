@@ -1,20 +1,24 @@
 # General Libs
+import argparse
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+import tensorflow as tf
 from tensorflow import keras
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
-from tensorflow.keras.preprocessing import image
 from tensorflow.keras.applications.inception_resnet_v2 import InceptionResNetV2, preprocess_input
-from tensorflow.keras.layers import Dense, Flatten
+from tensorflow.keras.layers import Dense, Flatten, Input
 from tensorflow.keras.models import Model, load_model
 from tensorflow.keras.optimizers import Adam
 import numpy as np
-import random
 import matplotlib.pyplot as plt
-from PIL import ImageFile
 import itertools
 from sklearn.metrics import classification_report, confusion_matrix
 
-# Fix error with PIL
-ImageFile.LOAD_TRUNCATED_IMAGES = True
+from bottleneck_cache import BOTTLENECK_CACHE_DIR, BottleneckCache, cache_key, view_seed
+from runtime_probe import configure_tensorflow, describe
+
+# Size TensorFlow's thread pools before the first op below runs
+configure_tensorflow(tf)
 
 # Parameters
 im_shape = (224, 224)
@@ -22,64 +26,173 @@ TRAINING_DIR = 'FaceShape Dataset/training_set'
 TEST_DIR = 'FaceShape Dataset/testing_set'
 seed = 10
 BATCH_SIZE = 16
+EPOCHS = 15
+MODEL_PATH = 'model.h5'
+HEAD_WEIGHTS_PATH = 'head.weights.h5'
+# Images run through the backbone per cache write in bottleneck mode
+CACHE_CHUNK = 256
+
+# Input pipeline, matching the ImageDataGenerator setup it replaced
+VALIDATION_SPLIT = 0.2
+# Every format flow_from_directory listed; tf.io can't decode the last three, so PIL does
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.ppm', '.tif', '.tiff')
+PIL_ONLY_PATTERN = r'.*\.(ppm|tiff?)'
+ROTATION_RANGE = 20  # degrees
+SHIFT_RANGE = 0.2  # fraction of width / height
+SHEAR_RANGE = 0.2  # degrees, as ImageDataGenerator interpreted shear_range
+ZOOM_RANGE = 0.2
+IDENTITY_TRANSFORM = tf.constant([1, 0, 0, 0, 1, 0, 0, 0], dtype=tf.float32)
+AUTOTUNE = tf.data.AUTOTUNE
+
+def list_classes(directory):
+    return sorted(entry.name for entry in os.scandir(directory) if entry.is_dir())
+
+def list_class_files(directory, class_name):
+    # Same walk order as flow_from_directory, so the validation split picks the same files
+    return [
+        os.path.join(root, name)
+        for root, _, files in sorted(os.walk(os.path.join(directory, class_name)), key=lambda walk: walk[0])
+        for name in sorted(files) if name.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+
+def list_files(directory, classes, subset=None):
+    """Image paths and class indices; per class, the first 20% of files are the validation subset"""
+    with ThreadPoolExecutor() as executor:
+        per_class = list(executor.map(lambda name: list_class_files(directory, name), classes))
+    
+    paths, labels = [], []
+    for label, files in enumerate(per_class):
+        split = int(VALIDATION_SPLIT * len(files))
+        if subset == 'training':
+            files = files[split:]
+        elif subset == 'validation':
+            files = files[:split]
+        paths += files
+        labels += [label] * len(files)
+    return paths, np.array(labels, dtype=np.int32)
+
+def decode_with_pil(path):
+    from PIL import Image
+
+    with Image.open(os.fsdecode(np.asarray(path).item())) as image:
+        return np.asarray(image.convert('RGB'))
+
+def decode_with_tf(path):
+    data = tf.io.read_file(path)
+    return tf.cond(
+        tf.io.is_jpeg(data),
+        # Recover truncated JPEGs, as ImageFile.LOAD_TRUNCATED_IMAGES did under PIL
+        lambda: tf.io.decode_jpeg(data, channels=3, try_recover_truncated=True, acceptable_fraction=0.5),
+        lambda: tf.io.decode_image(data, channels=3, expand_animations=False)
+    )
+
+def decode_image(path):
+    image = tf.cond(
+        tf.strings.regex_full_match(tf.strings.lower(path), PIL_ONLY_PATTERN),
+        lambda: tf.ensure_shape(tf.numpy_function(decode_with_pil, [path], tf.uint8), [None, None, 3]),
+        lambda: decode_with_tf(path)
+    )
+    # Nearest-neighbour resize, the flow_from_directory default
+    return tf.cast(tf.image.resize(image, im_shape, method='nearest'), tf.uint8)
+
+def random_transform(stateless_seed):
+    """Projective transform for one random rotation, shift, shear, zoom and flip"""
+    u = tf.random.stateless_uniform([7], seed=stateless_seed, minval=-1.0, maxval=1.0)
+    theta = np.deg2rad(ROTATION_RANGE) * u[0]
+    tx = SHIFT_RANGE * im_shape[1] * u[1]
+    ty = SHIFT_RANGE * im_shape[0] * u[2]
+    shear = np.deg2rad(SHEAR_RANGE) * u[3]
+    zx = (1 + ZOOM_RANGE * u[4]) * tf.sign(u[6])  # negative x scale is a horizontal flip
+    zy = 1 + ZOOM_RANGE * u[5]
+    
+    # Output-to-input mapping: rotation @ shear @ zoom about the image centre, then shift
+    m00 = tf.cos(theta) * zx
+    m01 = -(tf.cos(theta) * tf.sin(shear) + tf.sin(theta) * tf.cos(shear)) * zy
+    m10 = tf.sin(theta) * zx
+    m11 = (tf.cos(theta) * tf.cos(shear) - tf.sin(theta) * tf.sin(shear)) * zy
+    cx, cy = (im_shape[1] - 1) / 2, (im_shape[0] - 1) / 2
+    return tf.stack([
+        m00, m01, cx - m00 * cx - m01 * cy + tx,
+        m10, m11, cy - m10 * cx - m11 * cy + ty,
+        0.0, 0.0
+    ])
+
+def apply_transforms(images, transforms):
+    """Warp a whole batch in one op; edges repeat the nearest pixel like fill_mode='nearest'"""
+    return tf.raw_ops.ImageProjectiveTransformV3(
+        images=tf.cast(images, tf.float32),
+        transforms=transforms,
+        output_shape=tf.shape(images)[1:3],
+        fill_value=0.0,
+        interpolation='BILINEAR',
+        fill_mode='NEAREST'
+    )
+
+def make_dataset(paths, labels, training=False):
+    """Batches of preprocessed images and one-hot labels"""
+    dataset = tf.data.Dataset.from_tensor_slices((paths, labels))
+    if training:
+        dataset = dataset.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.map(lambda path, label: (decode_image(path), label), num_parallel_calls=AUTOTUNE)
+    
+    if training:
+        # One stateless seed per image, different every epoch but reproducible across runs
+        seeds = tf.data.Dataset.random(seed=seed, rerandomize_each_iteration=True).batch(2)
+        dataset = tf.data.Dataset.zip((dataset, seeds)).map(
+            lambda element, image_seed: (element[0], element[1], random_transform(image_seed)),
+            num_parallel_calls=AUTOTUNE
+        )
+        dataset = dataset.batch(BATCH_SIZE).map(
+            lambda images, labels, transforms: (
+                preprocess_input(apply_transforms(images, transforms)), tf.one_hot(labels, num_classes)
+            ),
+            num_parallel_calls=AUTOTUNE
+        )
+    else:
+        # Decoded uint8 images stay in memory, so later epochs skip reading and decoding
+        dataset = dataset.cache().batch(BATCH_SIZE).map(
+            lambda images, labels: (preprocess_input(tf.cast(images, tf.float32)), tf.one_hot(labels, num_classes)),
+            num_parallel_calls=AUTOTUNE
+        )
+    return dataset.prefetch(AUTOTUNE)
 
-# Data generators
-data_generator = ImageDataGenerator(
-    validation_split=0.2,
-    rotation_range=20,
-    width_shift_range=0.2,
-    height_shift_range=0.2,
-    preprocessing_function=preprocess_input,
-    shear_range=0.2,
-    zoom_range=0.2,
-    horizontal_flip=True,
-    fill_mode='nearest'
-)
-
-val_data_generator = ImageDataGenerator(
-    preprocessing_function=preprocess_input,
-    validation_split=0.2
-)
-
-# Generator for the train part
-train_generator = data_generator.flow_from_directory(
-    TRAINING_DIR,
-    target_size=im_shape,
-    shuffle=True,
-    seed=seed,
-    class_mode='categorical',
-    batch_size=BATCH_SIZE,
-    subset="training"
-)
-
-# Generator for the validation part
-validation_generator = val_data_generator.flow_from_directory(
-    TRAINING_DIR,
-    target_size=im_shape,
-    shuffle=False,
-    seed=seed,
-    class_mode='categorical',
-    batch_size=BATCH_SIZE,
-    subset="validation"
-)
-
-# Generator for the test dataset
-test_generator = ImageDataGenerator(preprocessing_function=preprocess_input)
-test_generator = test_generator.flow_from_directory(
-    TEST_DIR,
-    target_size=im_shape,
-    shuffle=False,
-    seed=seed,
-    class_mode='categorical',
-    batch_size=BATCH_SIZE
-)
-
-def create_model(num_classes):
-    base_model = InceptionResNetV2(
+def make_view_dataset(paths, views):
+    """Batches of preprocessed images; view 0 is the plain image, later views a seeded augmentation"""
+    seeds = [[view_seed(path, seed, view), view] for path, view in zip(paths, views)]
+    dataset = tf.data.Dataset.from_tensor_slices((paths, seeds, np.asarray(views) > 0))
+    dataset = dataset.map(
+        lambda path, view_seed_, augmented: (
+            decode_image(path), tf.where(augmented, random_transform(view_seed_), IDENTITY_TRANSFORM)
+        ),
+        num_parallel_calls=AUTOTUNE
+    )
+    dataset = dataset.batch(BATCH_SIZE).map(
+        lambda images, transforms: preprocess_input(apply_transforms(images, transforms)),
+        num_parallel_calls=AUTOTUNE
+    )
+    return dataset.prefetch(AUTOTUNE)
+
+# Dataset splits
+class_names = list_classes(TRAINING_DIR)
+num_classes = len(class_names)
+train_paths, train_labels = list_files(TRAINING_DIR, class_names, subset='training')
+validation_paths, validation_labels = list_files(TRAINING_DIR, class_names, subset='validation')
+test_paths, test_labels = list_files(TEST_DIR, class_names)
+
+train_dataset = make_dataset(train_paths, train_labels, training=True)
+validation_dataset = make_dataset(validation_paths, validation_labels)
+test_dataset = make_dataset(test_paths, test_labels)
+
+def create_base_model():
+    return InceptionResNetV2(
         weights='imagenet',
         include_top=False,
         input_shape=(im_shape[0], im_shape[1], 3)
     )
+
+def create_model(num_classes, base_model=None):
+    if base_model is None:
+        base_model = create_base_model()
     
     x = base_model.output
     x = Flatten()(x)
@@ -101,6 +214,65 @@ def create_model(num_classes):
     
     return model
 
+def create_head(feature_shape, num_classes):
+    """The trainable layers of create_model, fed with cached backbone activations"""
+    inputs = Input(shape=feature_shape)
+    x = Flatten()(inputs)
+    x = Dense(200, activation='relu')(x)
+    predictions = Dense(num_classes, activation='softmax', kernel_initializer='random_uniform')(x)
+    
+    model = Model(inputs=inputs, outputs=predictions)
+    model.compile(
+        optimizer=Adam(),
+        loss='categorical_crossentropy',
+        metrics=['accuracy']
+    )
+    
+    return model
+
+def cache_features(base_model, cache, paths, views):
+    """Run the backbone over every view not cached yet; return cache rows ordered view by view"""
+    keys = [cache_key(path, seed, view) for view in range(views) for path in paths]
+    missing = set(cache.missing(keys))
+    todo = [(path, view, key) for view in range(views) for path, key in
+            zip(paths, keys[view * len(paths):(view + 1) * len(paths)]) if key in missing]
+    print(f"{len(keys) - len(todo)} of {len(keys)} views cached, computing {len(todo)}")
+    
+    for start in range(0, len(todo), CACHE_CHUNK):
+        chunk = todo[start:start + CACHE_CHUNK]
+        dataset = make_view_dataset([path for path, _, _ in chunk], [view for _, view, _ in chunk])
+        cache.add([key for _, _, key in chunk], base_model.predict(dataset, verbose=0))
+        print(f"  {start + len(chunk)}/{len(todo)}")
+    
+    return cache.row_indices(keys)
+
+class CachedFeatureSequence(keras.utils.Sequence):
+    """Batches of memory-mapped activations and one-hot labels"""
+    
+    def __init__(self, features, rows, labels, num_classes, shuffle):
+        super().__init__()
+        self.features = features
+        self.rows = rows
+        self.labels = np.asarray(labels)
+        self.num_classes = num_classes
+        self.shuffle = shuffle
+        self.order = np.arange(len(rows))
+        self.on_epoch_end()
+    
+    def __len__(self):
+        return math.ceil(len(self.rows) / BATCH_SIZE)
+    
+    def __getitem__(self, index):
+        # Sorted rows keep each batch's memmap reads moving forward through the file
+        batch = np.sort(self.order[index * BATCH_SIZE:(index + 1) * BATCH_SIZE])
+        x = self.features[self.rows[batch]].astype(np.float32)
+        y = keras.utils.to_categorical(self.labels[batch], self.num_classes)
+        return x, y
+    
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.order)
+
 def plot_training_history(history):
     history_dict = history.history
     loss_values = history_dict['loss']
@@ -156,25 +328,22 @@ def plot_confusion_matrix(cm, classes, normalize=True, title='Confusion matrix')
     plt.savefig('confusion_matrix.png')
     plt.close()
 
-def main():
-    # Get dataset information
-    nb_train_samples = train_generator.samples
-    nb_validation_samples = validation_generator.samples
-    nb_test_samples = test_generator.samples
-    classes = list(train_generator.class_indices.keys())
-    print('Classes:', classes)
-    num_classes = len(classes)
+def print_report(y_true, Y_pred, classes):
+    y_pred = np.argmax(Y_pred, axis=1)
     
-    # Create and train model
-    model = create_model(num_classes)
+    cm = confusion_matrix(y_true, y_pred)
+    plot_confusion_matrix(cm, classes, normalize=False, title='Confusion Matrix')
     
-    # Training parameters
-    epochs = 15
-    callbacks_list = [
+    print('\nClassification Report:')
+    print(classification_report(y_true, y_pred, target_names=classes))
+
+def checkpoint_callbacks(filepath, save_weights_only=False):
+    return [
         keras.callbacks.ModelCheckpoint(
-            filepath='model.h5',
+            filepath=filepath,
             monitor='val_loss',
             save_best_only=True,
+            save_weights_only=save_weights_only,
             verbose=1
         ),
         keras.callbacks.EarlyStopping(
@@ -183,47 +352,114 @@ def main():
             verbose=1
         )
     ]
+
+def train_full(classes, epochs):
+    """Train through the frozen backbone, running it on every augmented batch of every epoch"""
+    num_classes = len(classes)
+    
+    # Create and train model
+    model = create_model(num_classes)
     
     # Train the model
     print("\nTraining model...")
     history = model.fit(
-        train_generator,
-        steps_per_epoch=nb_train_samples // BATCH_SIZE,
+        train_dataset,
         epochs=epochs,
-        callbacks=callbacks_list,
-        validation_data=validation_generator,
-        verbose=1,
-        validation_steps=nb_validation_samples // BATCH_SIZE
+        callbacks=checkpoint_callbacks(MODEL_PATH),
+        validation_data=validation_dataset,
+        verbose=1
     )
     
     # Plot training history
     plot_training_history(history)
     
     # Load the best model
-    model = load_model('model.h5')
+    model = load_model(MODEL_PATH)
     
     # Evaluate on validation set
     print("\nEvaluating on validation set...")
-    val_score = model.evaluate(validation_generator)
+    val_score = model.evaluate(validation_dataset)
     print('Validation loss:', val_score[0])
     print('Validation accuracy:', val_score[1])
     
     # Evaluate on test set
     print("\nEvaluating on test set...")
-    test_score = model.evaluate(test_generator)
+    test_score = model.evaluate(test_dataset)
     print('Test loss:', test_score[0])
     print('Test accuracy:', test_score[1])
     
     # Generate predictions and confusion matrix
     print("\nGenerating confusion matrix...")
-    Y_pred = model.predict(test_generator)
-    y_pred = np.argmax(Y_pred, axis=1)
+    print_report(test_labels, model.predict(test_dataset), classes)
+
+def train_bottleneck(classes, epochs, views, cache_dir):
+    """Run the frozen backbone once per image view, then train only the head from the cache"""
+    num_classes = len(classes)
+    base_model = create_base_model()
+    cache = BottleneckCache(cache_dir, base_model.output_shape[1:])
     
-    cm = confusion_matrix(test_generator.classes, y_pred)
-    plot_confusion_matrix(cm, classes, normalize=False, title='Confusion Matrix')
+    print(f"\nCaching backbone features in {cache_dir} ({views} augmented views per training image)...")
+    train_rows = cache_features(base_model, cache, train_paths, views + 1)
+    val_rows = cache_features(base_model, cache, validation_paths, 1)
+    test_rows = cache_features(base_model, cache, test_paths, 1)
+    features = cache.features()
     
-    print('\nClassification Report:')
-    print(classification_report(test_generator.classes, y_pred, target_names=classes))
+    train_sequence = CachedFeatureSequence(
+        features, train_rows, np.tile(train_labels, views + 1), num_classes, shuffle=True
+    )
+    val_sequence = CachedFeatureSequence(features, val_rows, validation_labels, num_classes, shuffle=False)
+    test_sequence = CachedFeatureSequence(features, test_rows, test_labels, num_classes, shuffle=False)
+    
+    print("\nTraining head...")
+    head = create_head(cache.feature_shape, num_classes)
+    history = head.fit(
+        train_sequence,
+        epochs=epochs,
+        callbacks=checkpoint_callbacks(HEAD_WEIGHTS_PATH, save_weights_only=True),
+        validation_data=val_sequence,
+        verbose=1
+    )
+    plot_training_history(history)
+    head.load_weights(HEAD_WEIGHTS_PATH)
+    
+    # Graft the head onto the backbone so model.h5 is the same model full mode produces
+    model = create_model(num_classes, base_model)
+    for source, target in zip(head.layers[-2:], model.layers[-2:]):
+        target.set_weights(source.get_weights())
+    model.save(MODEL_PATH)
+    print(f"Saved {MODEL_PATH}")
+    
+    print("\nEvaluating on validation set...")
+    val_score = head.evaluate(val_sequence)
+    print('Validation loss:', val_score[0])
+    print('Validation accuracy:', val_score[1])
+    
+    print("\nEvaluating on test set...")
+    test_score = head.evaluate(test_sequence)
+    print('Test loss:', test_score[0])
+    print('Test accuracy:', test_score[1])
+    
+    print("\nGenerating confusion matrix...")
+    print_report(test_labels, head.predict(test_sequence), classes)
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the InceptionResNetV2 face-shape classifier")
+    parser.add_argument('--mode', choices=('full', 'bottleneck'), default='full',
+                        help="bottleneck caches backbone activations and trains only the head")
+    parser.add_argument('--epochs', type=int, default=EPOCHS)
+    parser.add_argument('--views', type=int, default=4,
+                        help="bottleneck mode: augmented views cached per training image, besides the original")
+    parser.add_argument('--cache-dir', default=BOTTLENECK_CACHE_DIR)
+    args = parser.parse_args()
+    print(f"Runtime: {describe()}")
+    
+    # Get dataset information
+    print('Classes:', class_names)
+    
+    if args.mode == 'bottleneck':
+        train_bottleneck(class_names, args.epochs, args.views, args.cache_dir)
+    else:
+        train_full(class_names, args.epochs)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -15,6 +15,9 @@ interface FrameListProps {
   frames: Frame[]
 }
 
+// Images moved to the backend blob store come back as paths like /frame-images/<hash>
+const imageUrl = (link: string) => link.startsWith('/') ? `http://localhost:8000${link}` : link
+
 const FrameList = ({ frames }: FrameListProps) => {
   return (
     <Grid container spacing={3} sx={{ mt: 2 }}>
@@ -24,7 +27,7 @@ const FrameList = ({ frames }: FrameListProps) => {
             <CardMedia
               component="img"
               height="200"
-              image={frame.image_links}
+              image={imageUrl(frame.image_links)}
               alt={`${frame.brand} ${frame.model}`}
               sx={{ objectFit: 'contain', p: 2 }}
             />
@@ -66,7 +69,7 @@ const FrameList = ({ frames }: FrameListProps) => {
                 size="small" 
                 variant="outlined"
                 startIcon={<Visibility />}
-                onClick={() => window.open(frame.image_links, '_blank')}
+                onClick={() => window.open(imageUrl(frame.image_links), '_blank')}
               >
                 View Product
               </Button>
@@ -1,7 +1,7 @@
 import { useCallback, useRef, useState, useEffect } from 'react'
 import Webcam from 'react-webcam'
 import { Box, Button, Paper, FormControl, InputLabel, Select, MenuItem, Typography, Alert } from '@mui/material'
-import { PhotoCamera } from '@mui/icons-material'
+import { PhotoCamera, Videocam, VideocamOff } from '@mui/icons-material'
 import axios from 'axios'
 import FaceMeshOverlay from './FaceMeshOverlay'
 
@@ -23,6 +23,10 @@ const WebcamCapture = ({ setFaceShape, setFrames, setIsLoading }: WebcamCaptureP
   const [selectedDevice, setSelectedDevice] = useState<string>('')
   const [videoElement, setVideoElement] = useState<HTMLVideoElement | null>(null)
   const [error, setError] = useState<string | null>(null)
+  const [isLive, setIsLive] = useState(false)
+  const [liveConfidence, setLiveConfidence] = useState<number | null>(null)
+  const wsRef = useRef<WebSocket | null>(null)
+  const liveShapeRef = useRef<string | null>(null)
 
   useEffect(() => {
     // Get available video devices
@@ -165,6 +169,59 @@ const WebcamCapture = ({ setFaceShape, setFrames, setIsLoading }: WebcamCaptureP
     }
   }, [setFaceShape, setFrames, setIsLoading])
 
+  // Live mode streams frames over a WebSocket; the next frame is sent only after
+  // the previous result arrives, and the server drops any that pile up anyway
+  const sendLiveFrame = useCallback(async () => {
+    const ws = wsRef.current
+    const imageSrc = webcamRef.current?.getScreenshot()
+    if (!ws || ws.readyState !== WebSocket.OPEN || !imageSrc) return
+    const blob = await fetch(imageSrc).then(res => res.blob())
+    ws.send(blob)
+  }, [])
+
+  const startLive = useCallback(() => {
+    const ws = new WebSocket('ws://localhost:8000/ws/detect')
+    ws.onopen = () => sendLiveFrame()
+    ws.onmessage = (event) => {
+      const { face_shape, confidence } = JSON.parse(event.data)
+      if (face_shape !== 'No face detected') {
+        liveShapeRef.current = face_shape
+        setFaceShape(face_shape)
+        setLiveConfidence(confidence)
+      }
+      sendLiveFrame()
+    }
+    ws.onclose = (event) => {
+      if (event.code === 1013) {
+        setError('Live detection is busy, please try again shortly.')
+      }
+      wsRef.current = null
+      setIsLive(false)
+    }
+    wsRef.current = ws
+    setIsLive(true)
+  }, [sendLiveFrame, setFaceShape])
+
+  const stopLive = useCallback(async () => {
+    wsRef.current?.close()
+    wsRef.current = null
+    setIsLive(false)
+
+    const face_shape = liveShapeRef.current
+    if (!face_shape) return
+    setIsLoading(true)
+    try {
+      const framesResponse = await axios.get(`http://localhost:8000/matching-frames/${face_shape}`)
+      setFrames(framesResponse.data)
+    } catch (error) {
+      console.error('Error:', error)
+    } finally {
+      setIsLoading(false)
+    }
+  }, [setFrames, setIsLoading])
+
+  useEffect(() => () => wsRef.current?.close(), [])
+
   const handleDeviceChange = (event: any) => {
     setSelectedDevice(event.target.value)
     setHasPhoto(false) // Reset photo state when changing device
@@ -243,15 +300,30 @@ const WebcamCapture = ({ setFaceShape, setFrames, setIsLoading }: WebcamCaptureP
           </Box>
         )}
 
-        <Button
-          variant="contained"
-          startIcon={<PhotoCamera />}
-          onClick={capture}
-          sx={{ mt: 2 }}
-          disabled={hasPhoto || !selectedDevice || error !== null}
-        >
-          Take Photo
-        </Button>
+        {isLive && liveConfidence !== null && (
+          <Typography variant="body2" color="text.secondary" sx={{ mt: 1 }}>
+            Confidence: {Math.round(liveConfidence * 100)}%
+          </Typography>
+        )}
+
+        <Box sx={{ mt: 2, display: 'flex', gap: 2 }}>
+          <Button
+            variant="contained"
+            startIcon={<PhotoCamera />}
+            onClick={capture}
+            disabled={hasPhoto || isLive || !selectedDevice || error !== null}
+          >
+            Take Photo
+          </Button>
+          <Button
+            variant="outlined"
+            startIcon={isLive ? <VideocamOff /> : <Videocam />}
+            onClick={isLive ? stopLive : startLive}
+            disabled={hasPhoto || !selectedDevice || error !== null}
+          >
+            {isLive ? 'Stop Live' : 'Live Detect'}
+          </Button>
+        </Box>
       </Paper>
     </Box>
   )